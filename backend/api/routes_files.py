@@ -1,36 +1,122 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import FileResponse
-from pathlib import Path
-from core.settings import settings
-import os
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import FileResponse, JSONResponse, Response
+from email.utils import formatdate
+from typing import Optional
+from core.storage import StoredFile, get_storage
+from ml.peaks import select_level, sidecar_path
+import anyio
+import asyncio
+import json
 
 router = APIRouter(prefix="/api", tags=["files"])
 
+# Generated files never change, so they can be cached forever
+IMMUTABLE = "public, max-age=31536000, immutable"
+MEDIA_TYPES = {"wav": "audio/wav", "mp3": "audio/mpeg"}
+
+
+class StoredFileResponse(FileResponse):
+    """
+    Serve an indexed file without stat'ing it: length and validators come from
+    the index. When the server offers the ASGI zero-copy send extension the
+    body goes out via sendfile; otherwise it is streamed in large chunks.
+    The file is opened before any header is sent, so a file that left the
+    storage (pre-generation pool eviction) is a 404, not a truncated 200.
+    """
+    
+    chunk_size = 256 * 1024
+    
+    def __init__(self, stored: StoredFile):
+        super().__init__(
+            path=str(stored.path),
+            media_type=MEDIA_TYPES.get(stored.format, "application/octet-stream"),
+            filename=stored.name,
+            headers={
+                "Content-Length": str(stored.size),
+                "Last-Modified": formatdate(stored.created, usegmt=True),
+                "ETag": f'"{stored.sha256}"',
+                "Cache-Control": IMMUTABLE,
+            },
+        )
+        self.size = stored.size
+    
+    async def __call__(self, scope, receive, send):
+        try:
+            file = await anyio.open_file(self.path, mode="rb")
+        except OSError:
+            await JSONResponse({"detail": "File not found"}, status_code=404)(scope, receive, send)
+            return
+        
+        async with file:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if scope["method"].upper() == "HEAD":
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+            elif "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopysend", "file": file.wrapped.fileno(), "count": self.size})
+            else:
+                more_body = True
+                while more_body:
+                    chunk = await file.read(self.chunk_size)
+                    more_body = len(chunk) == self.chunk_size
+                    await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+
+def lookup(name: str) -> Optional[StoredFile]:
+    """Index entry of a stored file (a SQLite query: call it off the event loop)"""
+    return get_storage().get(name)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether the client's If-None-Match already names this version"""
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    candidates = [candidate.strip().removeprefix("W/") for candidate in header.split(",")]
+    return "*" in candidates or etag in candidates
+
 
 @router.get("/files/{filename}")
-async def get_audio_file(filename: str):
+async def get_audio_file(filename: str, request: Request):
     """Serve generated audio file"""
-    # Security: prevent directory traversal
-    if ".." in filename or "/" in filename or "\\" in filename:
-        raise HTTPException(status_code=400, detail="Invalid filename")
-    
-    filepath = Path(settings.output_dir) / filename
+    stored = await asyncio.to_thread(lookup, filename)
     
-    if not filepath.exists():
+    # Only indexed names resolve, so no path from the request reaches the filesystem
+    if stored is None or stored.name != filename:
         raise HTTPException(status_code=404, detail="File not found")
     
-    # Determine content type
-    if filename.endswith(".wav"):
-        media_type = "audio/wav"
-    elif filename.endswith(".mp3"):
-        media_type = "audio/mpeg"
-    else:
-        media_type = "application/octet-stream"
-    
-    return FileResponse(
-        path=str(filepath),
-        media_type=media_type,
-        filename=filename,
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
-    )
+    etag = f'"{stored.sha256}"'
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": IMMUTABLE})
+    
+    return StoredFileResponse(stored)
+
+
 
+@router.get("/files/{file_id}/peaks")
+async def get_audio_peaks(
+    file_id: str,
+    width: Optional[int] = Query(default=None, ge=1, le=100000, description="Peaks needed to draw the waveform")
+):
+    """
+    Serve the waveform peaks and metadata of a generated file.
+    Without `width` the whole sidecar is returned; with it, only the best-fitting
+    level, decoded to a list of interleaved min/max values in [-127, 127].
+    """
+    # Accept the audio filename as well as the bare id; the index knows whether peaks exist
+    stored = await asyncio.to_thread(lookup, file_id)
+    if stored is None or not stored.has_peaks:
+        raise HTTPException(status_code=404, detail="Peaks not found")
+    
+    try:
+        content = await anyio.Path(sidecar_path(stored.path)).read_bytes()
+    except OSError:
+        raise HTTPException(status_code=404, detail="Peaks not found")
+    
+    cache_headers = {"Cache-Control": IMMUTABLE}
+    
+    if width is None:
+        return Response(content, media_type="application/json", headers=cache_headers)
+    
+    peaks = json.loads(content)
+    metadata = {key: value for key, value in peaks.items() if key != "levels"}
+    return JSONResponse({**metadata, **select_level(peaks, width)}, headers=cache_headers)
@@ -1,9 +1,17 @@
 from fastapi import APIRouter, HTTPException, Request, Depends
-from pydantic import BaseModel, Field, field_validator
-from typing import Optional
-from core.jobs import job_manager
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, Field, ValidationError, field_validator, model_validator
+from typing import List, Optional
+from core.jobs import job_manager, JobItem, JobStatus
+from core.melodies import get_melody_store
+from core.metrics import metrics
+from core.pregen import get_pregen_pool, pregen_key
 from core.ratelimit import IPRateLimiter
 from core.settings import settings
+from ml.registry import registry
+from ml.routing import cheapest_estimate, estimate_seconds
+from ml.sampling import random_seed
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
@@ -25,17 +33,22 @@ def get_client_ip(request: Request) -> str:
     return request.client.host if request.client else "unknown"
 
 
-class GenerateRequest(BaseModel):
+def get_client_key(request: Request) -> str:
+    """Key grouping a client's jobs: X-Client-Key header, or the client IP"""
+    key = request.headers.get("X-Client-Key", "").strip()
+    return key[:128] if key else get_client_ip(request)
+
+
+class GenerationParams(BaseModel):
     model: str = Field(default="musicgen-small", description="Model to use")
-    prompt: str = Field(..., min_length=1, max_length=500, description="Text prompt")
-    duration: int = Field(default=10, ge=1, le=60, description="Duration in seconds")
+    duration: int = Field(default=10, ge=1, description="Duration in seconds")
     seed: Optional[int] = Field(default=None, ge=-1, description="Random seed (-1 for random)")
     temperature: float = Field(default=1.0, ge=0.0, le=3.0)
     top_k: int = Field(default=250, ge=0, le=500)
     top_p: float = Field(default=0.0, ge=0.0, le=1.0)
     cfg_coef: float = Field(default=3.0, ge=0.0, le=10.0, description="Classifier-Free Guidance")
     stereo: bool = Field(default=True)
-    sample_rate: int = Field(default=32000, description="Sample rate (16000 or 32000)")
+    sample_rate: int = Field(default=32000, description="Output sample rate, resampled from the model's native rate")
     format: str = Field(default="wav", description="Output format (wav or mp3)")
     
     @field_validator("sample_rate")
@@ -44,13 +57,118 @@ class GenerateRequest(BaseModel):
         if v not in [16000, 32000, 44100, 48000]:
             raise ValueError("Sample rate must be 16000, 32000, 44100, or 48000")
         return v
+
+
+class GenerateRequest(GenerationParams):
+    prompt: str = Field(..., min_length=1, max_length=500, description="Text prompt")
+    long_form: bool = Field(default=False, description="Generate in overlapping windows beyond max_duration")
+    num_variations: int = Field(default=1, ge=1, description="Takes of the same prompt, generated in one pass")
+    seeds: Optional[List[int]] = Field(default=None, description="One seed per variation")
+    allow_degrade: bool = Field(default=False, description="Allow a cheaper model or a shorter duration when the server is busy")
+    allow_similar: bool = Field(default=False, description="Without a seed, accept an earlier clip of a near-identical prompt")
+    melody_id: Optional[str] = Field(default=None, description="Reference melody uploaded to /api/melodies (melody models only)")
+    deadline: Optional[float] = Field(default=None, gt=0, description="Seconds after submission by which the result is needed")
+    
+    @model_validator(mode="after")
+    def validate_duration(self):
+        limit = settings.longform_max_duration if self.long_form else settings.max_duration
+        if self.duration > limit:
+            raise ValueError(f"Duration exceeds maximum of {limit} seconds")
+        return self
     
-    @field_validator("duration")
+    @model_validator(mode="after")
+    def validate_variations(self):
+        if self.seeds:
+            if self.num_variations == 1:
+                self.num_variations = len(self.seeds)
+            elif self.num_variations != len(self.seeds):
+                raise ValueError("seeds must contain one seed per variation")
+            if any(seed < 0 for seed in self.seeds):
+                raise ValueError("Variation seeds must be non-negative")
+        if self.num_variations > settings.max_variations:
+            raise ValueError(f"num_variations exceeds maximum of {settings.max_variations}")
+        if self.num_variations > 1 and self.long_form:
+            raise ValueError("Variations are not supported for long-form generation")
+        return self
+    
+    @model_validator(mode="after")
+    def validate_melody(self):
+        if self.melody_id is not None and self.long_form:
+            raise ValueError("Melody conditioning is not supported for long-form generation")
+        return self
+    
+    def variation_seeds(self) -> List[int]:
+        """Seeds of each take: explicit list, consecutive from `seed`, or random"""
+        if self.seeds:
+            return list(self.seeds)
+        if self.seed is not None and self.seed >= 0:
+            return [self.seed + i for i in range(self.num_variations)]
+        return [random_seed() for _ in range(self.num_variations)]
+
+
+class BatchItem(BaseModel):
+    """One prompt of a batch; unset params fall back to the batch's shared params"""
+    prompt: str = Field(..., min_length=1, max_length=500, description="Text prompt")
+    duration: Optional[int] = Field(default=None, ge=1)
+    seed: Optional[int] = Field(default=None, ge=-1)
+    temperature: Optional[float] = Field(default=None, ge=0.0, le=3.0)
+    top_k: Optional[int] = Field(default=None, ge=0, le=500)
+    top_p: Optional[float] = Field(default=None, ge=0.0, le=1.0)
+    cfg_coef: Optional[float] = Field(default=None, ge=0.0, le=10.0)
+
+
+class BatchGenerateRequest(GenerationParams):
+    items: List[BatchItem] = Field(..., min_length=1, description="Prompts to generate")
+    
+    @field_validator("items")
     @classmethod
-    def validate_duration(cls, v):
-        if v > settings.max_duration:
-            raise ValueError(f"Duration exceeds maximum of {settings.max_duration} seconds")
+    def validate_items(cls, v):
+        if len(v) > settings.batch_max_items:
+            raise ValueError(f"Batch exceeds maximum of {settings.batch_max_items} items")
         return v
+    
+    def resolve_items(self) -> List[GenerateRequest]:
+        """Per-item requests with shared params applied (raises RequestValidationError)"""
+        shared = self.model_dump(exclude={"items"})
+        resolved, errors = [], []
+        for index, item in enumerate(self.items):
+            try:
+                resolved.append(GenerateRequest(**{**shared, **item.model_dump(exclude_none=True)}))
+            except ValidationError as e:
+                errors.extend(
+                    {**error, "loc": ("body", "items", index, *error["loc"])}
+                    for error in e.errors(include_url=False)
+                )
+        if errors:
+            raise RequestValidationError(errors)
+        return resolved
+
+
+async def check_deadline(params: dict):
+    """
+    Reject a job that cannot finish within its deadline given the current queue
+    (raises HTTPException 503). Every variation counts; degradable single takes
+    are judged on their cheapest option.
+    """
+    if params.get("deadline") is None:
+        return
+    device_info = registry.device_info() or {}
+    load = dict(
+        queued=await asyncio.to_thread(job_manager.store.count, JobStatus.QUEUED),
+        workers=job_manager.workers,
+        accelerated=device_info.get("device_type", "cpu") != "cpu",
+    )
+    # Only single takes are routed to cheaper settings
+    if params.get("allow_degrade") and settings.degrade_enabled and params.get("num_variations", 1) == 1:
+        estimate = cheapest_estimate(params, **load)
+    else:
+        estimate = estimate_seconds(params, **load)
+    if estimate > params["deadline"]:
+        metrics.incr("deadline_rejected")
+        raise HTTPException(
+            status_code=503,
+            detail=f"Cannot finish within the {params['deadline']:g}s deadline (estimated {estimate:.0f}s with the current queue)"
+        )
 
 
 @router.post("/generate", status_code=201)
@@ -60,9 +178,9 @@ async def create_generation(
 ):
     """Create a new audio generation job"""
     
-    # Rate limiting
+    # Rate limiting: each variation counts as a request
     client_ip = get_client_ip(http_request)
-    allowed, remaining = rate_limiter.is_allowed(client_ip)
+    allowed, remaining = rate_limiter.is_allowed(client_ip, cost=request.num_variations)
     
     if not allowed:
         raise HTTPException(
@@ -71,21 +189,56 @@ async def create_generation(
         )
     
     # Validate model
-    from ml.models import get_available_models
-    available_models = [m["id"] for m in get_available_models()]
-    
-    if request.model not in available_models:
+    await registry.wait_ready()
+    if not registry.is_available(request.model):
         raise HTTPException(
             status_code=400,
-            detail=f"Model '{request.model}' not available. Available: {available_models}"
+            detail=f"Model '{request.model}' not available. Available: {registry.available_ids()}"
         )
     
+    if request.melody_id is not None:
+        if not registry.get(request.model).supports_melody:
+            raise HTTPException(status_code=400, detail=f"Model '{request.model}' does not accept a melody")
+        if get_melody_store().path(request.melody_id) is None:
+            raise HTTPException(status_code=400, detail="Unknown melody_id, upload it to /api/melodies first")
+    
     # Create job
     params = request.model_dump()
-    job = job_manager.create_job(params)
+    if request.num_variations > 1:
+        await check_deadline(params)
+        # Variations: one item per seed, batched into a single model call
+        take_params = {**params, "num_variations": 1, "seeds": None}
+        job = await asyncio.to_thread(
+            job_manager.create_job,
+            {**params, "variations": True},
+            items=[
+                JobItem(index=i, prompt=request.prompt, seed=seed, params={**take_params, "seed": seed})
+                for i, seed in enumerate(request.variation_seeds())
+            ],
+            client_key=get_client_key(http_request),
+        )
+    else:
+        # Popular prompts may already have a pre-generated take waiting
+        pool = get_pregen_pool()
+        key = pregen_key(params) if pool else None
+        take = None
+        if key is not None:
+            # SQLite writes and a file move: kept off the event loop
+            await asyncio.to_thread(pool.record, key, params)
+            take = await asyncio.to_thread(pool.take, key)
+        if take is not None:
+            job = await asyncio.to_thread(
+                job_manager.create_job,
+                {**params, "seed": take.seed, "pregenerated": True},
+                client_key=get_client_key(http_request),
+                result_url=f"/api/files/{take.path.name}",
+            )
+        else:
+            await check_deadline(params)
+            job = await asyncio.to_thread(job_manager.create_job, params, client_key=get_client_key(http_request))
     
     # Estimate time (rough: ~2s per second of audio for small model)
-    estimated_seconds = request.duration * 2
+    estimated_seconds = 0 if job.result_url else request.duration * 2
     
     return {
         "job_id": job.job_id,
@@ -94,3 +247,56 @@ async def create_generation(
         "rate_limit_remaining": remaining
     }
 
+
+
+@router.post("/generate/batch", status_code=201)
+async def create_batch_generation(
+    request: BatchGenerateRequest,
+    http_request: Request
+):
+    """Create one job generating many prompts in model-sized batches"""
+    
+    # Validate items before charging the rate limit
+    items = request.resolve_items()
+    
+    # Rate limiting: a batch costs one request per prompt
+    client_ip = get_client_ip(http_request)
+    allowed, remaining = rate_limiter.is_allowed(client_ip, cost=len(items))
+    
+    if not allowed:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Rate limit exceeded. Maximum {settings.rate_limit_per_hour} requests per hour."
+        )
+    
+    # Validate model
+    await registry.wait_ready()
+    if not registry.is_available(request.model):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Model '{request.model}' not available. Available: {registry.available_ids()}"
+        )
+    
+    # Create parent job with one item per prompt
+    params = {"batch": True, **request.model_dump(exclude={"items"})}
+    job = await asyncio.to_thread(
+        job_manager.create_job,
+        params,
+        items=[
+            JobItem(index=i, prompt=item.prompt, params=item.model_dump())
+            for i, item in enumerate(items)
+        ],
+        client_key=get_client_key(http_request),
+    )
+    
+    # Estimate time (rough: ~2s per second of audio for small model)
+    estimated_seconds = sum(item.duration for item in items) * 2
+    
+    return {
+        "job_id": job.job_id,
+        "status": job.status,
+        "items": len(items),
+        "estimated_seconds": estimated_seconds,
+        "rate_limit_remaining": remaining,
+        "events_url": f"/api/jobs/{job.job_id}/events",
+    }
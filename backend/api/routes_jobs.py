@@ -1,19 +1,22 @@
-from fastapi import APIRouter, HTTPException
-from core.jobs import job_manager, Job
+from fastapi import APIRouter, HTTPException, Query
+from core.jobs import job_manager, Job, JobStatus, FINAL_STATUSES
 from core.sse import create_sse_response
 from fastapi import Request
+from datetime import datetime
+import asyncio
+from typing import Optional
+from api.routes_generate import get_client_key
 
 router = APIRouter(prefix="/api", tags=["jobs"])
 
+# Longest a long-poll request is held open
+MAX_WAIT_SECONDS = 60
+# Jobs one multiplexed event stream may watch
+MAX_WATCHED_JOBS = 100
 
-@router.get("/jobs/{job_id}")
-async def get_job_status(job_id: str):
-    """Get job status and progress"""
-    job = job_manager.get_job(job_id)
-    
-    if job is None:
-        raise HTTPException(status_code=404, detail="Job not found")
-    
+
+def serialize_job(job: Job) -> dict:
+    """Public representation of a job"""
     return {
         "job_id": job.job_id,
         "status": job.status,
@@ -22,19 +25,92 @@ async def get_job_status(job_id: str):
         "result_url": job.result_url,
         "error": job.error,
         "params": job.params,
+        "routing": job.routing,
+        "items": [item.model_dump() for item in job.items],
         "created_at": job.created_at.isoformat(),
         "started_at": job.started_at.isoformat() if job.started_at else None,
         "completed_at": job.completed_at.isoformat() if job.completed_at else None,
+        "version": job.version,
     }
 
 
+@router.get("/jobs")
+async def list_jobs(
+    request: Request,
+    status: Optional[JobStatus] = None,
+    model: Optional[str] = None,
+    since: Optional[datetime] = Query(default=None, description="Created at or after"),
+    until: Optional[datetime] = Query(default=None, description="Created at or before"),
+    cursor: Optional[int] = Query(default=None, ge=1, description="next_cursor of the previous page"),
+    limit: int = Query(default=20, ge=1, le=100),
+):
+    """List the caller's jobs (X-Client-Key or client IP), newest first, with cursor-based pagination"""
+    # Job store queries may wait on a worker's write lock: kept off the event loop
+    jobs, next_cursor = await asyncio.to_thread(
+        job_manager.list_jobs,
+        client_key=get_client_key(request),
+        status=status,
+        model=model,
+        since=since,
+        until=until,
+        cursor=cursor,
+        limit=limit,
+    )
+    return {
+        "jobs": [serialize_job(job) for job in jobs],
+        "next_cursor": next_cursor,
+    }
+
+
+@router.get("/jobs/events")
+async def stream_jobs_events(
+    request: Request,
+    ids: str = Query(..., description="Comma-separated job ids"),
+):
+    """Stream the progress of many jobs over one Server-Sent Events connection"""
+    job_ids = list(dict.fromkeys(job_id.strip() for job_id in ids.split(",") if job_id.strip()))
+    
+    if not job_ids:
+        raise HTTPException(status_code=400, detail="No job ids given")
+    if len(job_ids) > MAX_WATCHED_JOBS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_WATCHED_JOBS} jobs per stream")
+    
+    return create_sse_response(job_ids, request)
+
+
+@router.get("/jobs/{job_id}")
+async def get_job_status(
+    job_id: str,
+    wait: float = Query(default=0, ge=0, le=MAX_WAIT_SECONDS, description="Seconds to wait for a change"),
+    version: Optional[int] = Query(default=None, description="Last version seen, defaults to the current one"),
+):
+    """
+    Get job status and progress.
+    With `wait`, the response is held until the job's version differs from
+    `version` (or the wait expires), so clients get updates without polling.
+    """
+    job = await asyncio.to_thread(job_manager.get_job, job_id)
+    
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    if version is None:
+        version = job.version
+    if wait > 0 and job.version == version and job.status not in FINAL_STATUSES:
+        changed = await job_manager.watch({job_id: version}, timeout=wait)
+        if changed:
+            job = changed[0]
+    
+    return serialize_job(job)
+
+
 @router.get("/jobs/{job_id}/events")
 async def stream_job_events(job_id: str, request: Request):
     """Stream job progress via Server-Sent Events"""
-    job = job_manager.get_job(job_id)
+    job = await asyncio.to_thread(job_manager.get_job, job_id)
     
     if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    return create_sse_response(job_id, request)
+    return create_sse_response([job_id], request)
 
@@ -0,0 +1,35 @@
+from fastapi import APIRouter, File, HTTPException, Response, UploadFile
+from core.melodies import MelodyError, get_melody_store
+from core.settings import settings
+import asyncio
+
+router = APIRouter(prefix="/api", tags=["melodies"])
+
+UPLOAD_CHUNK = 1024 * 1024
+
+
+@router.post("/melodies", status_code=201)
+async def upload_melody(response: Response, file: UploadFile = File(..., description="Reference track (wav, flac, ogg, mp3)")):
+    """
+    Upload a reference melody for musicgen-melody.
+    Stored by content hash: uploading the same track again returns the same
+    melody_id (200 instead of 201), and its chroma features are reused.
+    """
+    # Read in chunks, so an oversized upload is rejected without buffering it
+    limit = settings.melody_max_mb * 1024 * 1024
+    chunks, size = [], 0
+    while chunk := await file.read(UPLOAD_CHUNK):
+        size += len(chunk)
+        if size > limit:
+            raise HTTPException(status_code=400, detail=f"File exceeds maximum of {settings.melody_max_mb} MB")
+        chunks.append(chunk)
+    data = b"".join(chunks)
+    
+    try:
+        melody = await asyncio.to_thread(get_melody_store().add, data)
+    except MelodyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if not melody["created"]:
+        response.status_code = 200
+    return melody
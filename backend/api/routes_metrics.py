@@ -0,0 +1,10 @@
+from fastapi import APIRouter
+from core.metrics import metrics
+
+router = APIRouter(prefix="/api", tags=["metrics"])
+
+
+@router.get("/metrics")
+async def get_metrics():
+    """Service counters and cache statistics"""
+    return metrics.snapshot()
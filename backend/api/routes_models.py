@@ -1,5 +1,6 @@
 from fastapi import APIRouter
 from ml.models import get_available_models
+from ml.registry import registry
 
 router = APIRouter(prefix="/api", tags=["models"])
 
@@ -7,6 +8,7 @@ router = APIRouter(prefix="/api", tags=["models"])
 @router.get("/models")
 async def list_models():
     """List available models with metadata"""
+    await registry.wait_ready()
     models = get_available_models()
     return {"models": models}
 
@@ -0,0 +1,228 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+import itertools
+import logging
+import os
+import threading
+from core.settings import settings
+
+logger = logging.getLogger(__name__)
+
+NUMA_SYSFS = Path("/sys/devices/system/node")
+
+# Slot assigned to the current generation thread (if any)
+_local = threading.local()
+
+
+@dataclass
+class CPUSlot:
+    """A set of cores reserved for one concurrent generation"""
+    index: int
+    cpus: List[int]
+    threads: int
+    numa_node: Optional[int] = None
+
+
+@dataclass
+class CPUPlan:
+    """Partition of the available cores into generation slots"""
+    slots: List[CPUSlot]
+    interop_threads: int = 1
+    pin: bool = True
+
+    @property
+    def size(self) -> int:
+        return len(self.slots)
+
+
+def parse_cpulist(text: str) -> List[int]:
+    """Parse a kernel cpulist string such as '0-3,8,10-11'"""
+    cpus: List[int] = []
+    for part in text.strip().split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def available_cpus() -> List[int]:
+    """CPUs this process is allowed to run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def numa_topology(cpus: List[int]) -> Dict[int, List[int]]:
+    """
+    Map NUMA node -> usable CPUs, restricted to `cpus`.
+    Returns an empty dict when the topology is not exposed (non-Linux, containers).
+    """
+    allowed = set(cpus)
+    nodes: Dict[int, List[int]] = {}
+    try:
+        for node_dir in sorted(NUMA_SYSFS.glob("node[0-9]*")):
+            node_cpus = [c for c in parse_cpulist((node_dir / "cpulist").read_text()) if c in allowed]
+            if node_cpus:
+                nodes[int(node_dir.name[4:])] = sorted(node_cpus)
+    except (OSError, ValueError) as e:
+        logger.debug(f"NUMA topology not available: {e}")
+        return {}
+    return nodes
+
+
+def plan_cpu_slots(
+    cpus: List[int],
+    slots: int = 0,
+    threads_per_slot: int = 0,
+    numa: Optional[Dict[int, List[int]]] = None,
+    interop_threads: int = 1,
+    pin: bool = True,
+) -> CPUPlan:
+    """
+    Split `cpus` into generation slots with a fixed intra-op thread count.
+
+    With slots=0 the slot count is derived from threads_per_slot (or 1 slot using
+    every core). Slots are carved out of a single NUMA node whenever the node is
+    large enough, so a generation never has its threads spread across sockets.
+    """
+    cpus = sorted(cpus) or [0]
+    if slots <= 0:
+        slots = max(1, len(cpus) // threads_per_slot) if threads_per_slot > 0 else 1
+    threads = threads_per_slot if threads_per_slot > 0 else max(1, len(cpus) // slots)
+
+    # Carve whole slots out of each NUMA node, then pool the leftovers
+    groups: List[tuple[List[int], Optional[int]]] = []
+    leftovers: List[int] = []
+    for node, node_cpus in sorted((numa or {}).items()):
+        full = len(node_cpus) - len(node_cpus) % threads
+        for i in range(0, full, threads):
+            groups.append((node_cpus[i:i + threads], node))
+        leftovers.extend(node_cpus[full:])
+    if not numa:
+        leftovers = list(cpus)
+    for i in range(0, len(leftovers) - threads + 1, threads):
+        groups.append((leftovers[i:i + threads], None))
+
+    if len(groups) < slots:
+        # Oversubscribed configuration: share cores round-robin rather than fail
+        logger.warning(
+            f"{slots} slots x {threads} threads exceeds {len(cpus)} available CPUs, "
+            f"slots will share cores"
+        )
+        groups = [
+            ([cpus[(s * threads + j) % len(cpus)] for j in range(threads)], None)
+            for s in range(slots)
+        ]
+
+    plan_slots = [
+        CPUSlot(index=i, cpus=group, threads=threads, numa_node=node)
+        for i, (group, node) in enumerate(groups[:slots])
+    ]
+    return CPUPlan(slots=plan_slots, interop_threads=max(1, interop_threads), pin=pin)
+
+
+def _uses_cpu() -> bool:
+    """Whether generations will run on the CPU"""
+    if settings.device == "cpu":
+        return True
+    if settings.device == "auto":
+        import torch
+        return not torch.cuda.is_available()
+    return False
+
+
+def plan_from_settings() -> CPUPlan:
+    """Build the execution plan described by Settings"""
+    cpus = available_cpus()
+    if not _uses_cpu():
+        # Accelerator: cores only feed the device, keep the requested concurrency unpinned
+        return plan_cpu_slots(cpus, slots=max(1, settings.generation_slots), pin=False)
+
+    return plan_cpu_slots(
+        cpus,
+        slots=settings.generation_slots,
+        threads_per_slot=settings.cpu_threads_per_slot,
+        numa=numa_topology(cpus),
+        interop_threads=settings.cpu_interop_threads,
+        pin=settings.cpu_pinning,
+    )
+
+
+class GenerationExecutor(ThreadPoolExecutor):
+    """Thread pool with one thread per slot, each pinned to its slot's cores"""
+
+    def __init__(self, plan: CPUPlan):
+        self.plan = plan
+        self._slot_ids = itertools.count()
+        super().__init__(
+            max_workers=plan.size,
+            thread_name_prefix="generation",
+            initializer=self._init_slot,
+        )
+
+    def _init_slot(self):
+        slot = self.plan.slots[next(self._slot_ids) % self.plan.size]
+        _local.slot = slot
+
+        if self.plan.pin and hasattr(os, "sched_setaffinity"):
+            try:
+                # pid 0 targets the calling thread; OpenMP workers inherit the mask
+                os.sched_setaffinity(0, slot.cpus)
+            except OSError as e:
+                logger.warning(f"Could not pin slot {slot.index} to CPUs {slot.cpus}: {e}")
+
+        logger.info(
+            f"Generation slot {slot.index}: {slot.threads} threads on CPUs "
+            f"{slot.cpus[0]}-{slot.cpus[-1]}"
+            + (f" (NUMA node {slot.numa_node})" if slot.numa_node is not None else "")
+        )
+
+
+def current_slot() -> Optional[CPUSlot]:
+    """Slot of the calling generation thread, None outside the executor"""
+    return getattr(_local, "slot", None)
+
+
+_executor: Optional[GenerationExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_generation_executor() -> GenerationExecutor:
+    """Get (or lazily create) the process-wide generation executor"""
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            plan = plan_from_settings()
+            import torch
+            # Thread counts are process-wide in torch: every slot runs with the same
+            # intra-op count (plan_cpu_slots gives all slots the same size)
+            torch.set_num_threads(plan.slots[0].threads)
+            try:
+                # Must happen before any inter-op parallel work, so only once per process
+                torch.set_num_interop_threads(plan.interop_threads)
+            except RuntimeError as e:
+                logger.debug(f"Inter-op threads already configured: {e}")
+            _executor = GenerationExecutor(plan)
+            logger.info(
+                f"Generation executor: {plan.size} slot(s), "
+                f"{plan.slots[0].threads} intra-op threads each"
+            )
+        return _executor
+
+
+def shutdown_generation_executor():
+    """Stop the generation executor if it was started"""
+    global _executor
+
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
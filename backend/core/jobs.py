@@ -1,11 +1,17 @@
 from enum import Enum
-from typing import Dict, Optional, Callable, Any
-from datetime import datetime
+from typing import Dict, List, Optional, Callable, Any, Set, TYPE_CHECKING
+from datetime import datetime, timedelta
 from collections import defaultdict
 import uuid
 import asyncio
+import time
 from pydantic import BaseModel
 import logging
+from core.metrics import metrics
+from core.settings import settings
+
+if TYPE_CHECKING:
+    from core.store import JobStore
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +21,26 @@ class JobStatus(str, Enum):
     RUNNING = "running"
     DONE = "done"
     ERROR = "error"
+    EXPIRED = "expired"  # deadline passed before a worker got to it
+
+
+# Jobs in these states never change again
+FINAL_STATUSES = (JobStatus.DONE, JobStatus.ERROR, JobStatus.EXPIRED)
+
+
+class JobItem(BaseModel):
+    """One result of a multi-item job (batch or variations)"""
+    index: int
+    prompt: str
+    status: JobStatus = JobStatus.QUEUED
+    progress: int = 0  # 0-100
+    seed: Optional[int] = None  # reproduces this item on its own
+    result_url: Optional[str] = None
+    error: Optional[str] = None
+    params: Dict[str, Any] = {}
+    
+    class Config:
+        use_enum_values = True
 
 
 class Job(BaseModel):
@@ -25,6 +51,14 @@ class Job(BaseModel):
     result_url: Optional[str] = None
     error: Optional[str] = None
     params: Dict[str, Any] = {}
+    items: List[JobItem] = []
+    client_key: Optional[str] = None  # X-Client-Key header or client IP
+    seq: int = 0  # creation order, used as the pagination cursor
+    version: int = 0  # incremented on every update, lets clients wait for changes
+    routing: Optional[Dict[str, Any]] = None  # settings actually used when degraded under load
+    worker: Optional[str] = None  # host:pid:token of the process running the job
+    claim: Optional[str] = None  # token of the current claim, updates made under an older one are dropped
+    deadline_at: Optional[datetime] = None  # result is useless to the client after this
     created_at: datetime
     started_at: Optional[datetime] = None
     completed_at: Optional[datetime] = None
@@ -34,32 +68,83 @@ class Job(BaseModel):
 
 
 class JobManager:
-    """Manages job queue and execution"""
+    """Manages job queue and execution on top of a JobStore"""
     
-    def __init__(self):
-        self.jobs: Dict[str, Job] = {}
-        self.queue: asyncio.Queue = asyncio.Queue()
+    def __init__(self, store: Optional["JobStore"] = None):
+        # Deferred: core.store imports the job models from this module
+        from core.store import create_job_store
+        
+        self.store: "JobStore" = store or create_job_store()
         self.workers: int = 1
+        # Jobs being processed by this process's workers
+        self.active_jobs: int = 0
+        self._running: Set[str] = set()
         self.progress_callbacks: Dict[str, list[Callable]] = defaultdict(list)
-        self._worker_task: Optional[asyncio.Task] = None
+        self._worker_tasks: list[asyncio.Task] = []
+        self._lease_task: Optional[asyncio.Task] = None
+        self._expiry_task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        # Events of clients waiting on each job (touched on the event loop only)
+        self._watchers: Dict[str, Set[asyncio.Event]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+    
+    def start_worker(self, process_fn: Callable, workers: Optional[int] = None):
+        """Start background workers that process jobs concurrently"""
+        if workers is not None:
+            self.workers = workers
+        self._loop = asyncio.get_running_loop()
+        self._worker_tasks = [t for t in self._worker_tasks if not t.done()]
+        while len(self._worker_tasks) < self.workers:
+            self._worker_tasks.append(asyncio.create_task(self._worker_loop(process_fn)))
+        if self.store.shared and (self._lease_task is None or self._lease_task.done()):
+            self._lease_task = asyncio.create_task(self._lease_loop())
+        if self._expiry_task is None or self._expiry_task.done():
+            self._expiry_task = asyncio.create_task(self._expiry_loop())
+        logger.info(f"{len(self._worker_tasks)} job worker(s) started")
+    
+    async def _lease_loop(self):
+        """
+        Renew the leases of this process's running jobs and requeue jobs whose
+        lease expired: their worker is gone, possibly with its host (a recreated
+        container comes back under a new hostname).
+        """
+        while True:
+            await asyncio.sleep(settings.job_lease_seconds / 3)
+            try:
+                await asyncio.to_thread(self.store.heartbeat, list(self._running))
+                await asyncio.to_thread(self.recover_interrupted)
+            except Exception as e:
+                logger.error(f"Lease renewal failed: {e}", exc_info=True)
     
-    def start_worker(self, process_fn: Callable):
-        """Start background worker that processes jobs"""
-        if self._worker_task is None or self._worker_task.done():
-            self._worker_task = asyncio.create_task(self._worker_loop(process_fn))
-            logger.info("Job worker started")
+    async def _next_job(self) -> Job:
+        """
+        Wait for a job to claim.
+        Jobs created in this process wake the workers immediately; jobs created by
+        other processes are picked up on the next poll of a shared store.
+        """
+        while True:
+            self._wakeup.clear()
+            job = await asyncio.to_thread(self.store.claim)
+            if job is not None:
+                self._wake_watchers(job.job_id)
+                return job
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.job_poll_interval)
+            except asyncio.TimeoutError:
+                pass
     
     async def _worker_loop(self, process_fn: Callable):
         """Background worker loop"""
         while True:
             try:
-                job_id = await self.queue.get()
-                job = self.jobs[job_id]
-                
-                # Update status to running
-                job.status = JobStatus.RUNNING
-                job.started_at = datetime.now()
-                self.update_job(job)
+                # Claiming marks the job running
+                job = await self._next_job()
+                job_id = job.job_id
+                if job.deadline_at is not None and datetime.now() >= job.deadline_at:
+                    await asyncio.to_thread(self._expire, job)
+                    continue
+                self.active_jobs += 1
+                self._running.add(job_id)
                 
                 try:
                     # Process job with callback for progress
@@ -79,46 +164,193 @@ class JobManager:
                     job.progress = 100
                     job.result_url = result
                     job.completed_at = datetime.now()
-                    self.update_job(job)
+                    await asyncio.to_thread(self.update_job, job)
+                    if job.deadline_at is not None and job.completed_at > job.deadline_at:
+                        metrics.incr("deadline_missed")
                     
                 except Exception as e:
                     logger.error(f"Job {job_id} failed: {e}", exc_info=True)
                     job.status = JobStatus.ERROR
                     job.error = str(e)
                     job.completed_at = datetime.now()
-                    self.update_job(job)
+                    await asyncio.to_thread(self.update_job, job)
                 
                 finally:
+                    self.active_jobs -= 1
+                    self._running.discard(job_id)
                     # Cleanup callbacks
                     if job_id in self.progress_callbacks:
                         del self.progress_callbacks[job_id]
-                    self.queue.task_done()
             
             except Exception as e:
                 logger.error(f"Worker error: {e}", exc_info=True)
                 await asyncio.sleep(1)
     
-    def create_job(self, params: Dict[str, Any]) -> Job:
-        """Create a new job and add to queue"""
+    def _expire(self, job: Job):
+        """Finish a claimed job whose deadline passed while it was queued, without running it"""
+        from core.store import _mark_expired
+        
+        logger.info(f"Job {job.job_id} expired in the queue (deadline {job.deadline_at:%H:%M:%S})")
+        _mark_expired(job)
+        self.update_job(job)
+        metrics.incr("deadline_expired")
+    
+    async def _expiry_loop(self):
+        """
+        Expire overdue queued jobs without waiting for a worker to reach them, so
+        they stop counting as queued in deadline and routing estimates.
+        """
+        while True:
+            await asyncio.sleep(settings.job_poll_interval)
+            try:
+                expired = await asyncio.to_thread(self.store.expire_overdue, datetime.now())
+            except Exception as e:
+                logger.error(f"Expiring overdue jobs failed: {e}", exc_info=True)
+                continue
+            for job in expired:
+                logger.info(f"Job {job.job_id} expired in the queue (deadline {job.deadline_at:%H:%M:%S})")
+                self._wake_watchers(job.job_id)
+            if expired:
+                metrics.incr("deadline_expired", len(expired))
+    
+    def create_job(
+        self,
+        params: Dict[str, Any],
+        items: Optional[List[JobItem]] = None,
+        client_key: Optional[str] = None,
+        result_url: Optional[str] = None,
+    ) -> Job:
+        """Create a new job and add to queue (or record it as done when its result already exists)"""
         job_id = str(uuid.uuid4())
+        now = datetime.now()
         job = Job(
             job_id=job_id,
             status=JobStatus.QUEUED,
             params=params,
-            created_at=datetime.now()
+            items=items or [],
+            client_key=client_key,
+            created_at=now
         )
-        self.jobs[job_id] = job
-        self.queue.put_nowait(job_id)
+        if params.get("deadline") is not None:
+            job.deadline_at = now + timedelta(seconds=params["deadline"])
+        if result_url is not None:
+            job.status = JobStatus.DONE
+            job.progress = 100
+            job.result_url = result_url
+            job.started_at = job.completed_at = now
+        self.store.add(job)
+        if result_url is None:
+            self._wake_workers()
         logger.info(f"Created job {job_id}")
         return job
     
     def get_job(self, job_id: str) -> Optional[Job]:
         """Get job by ID"""
-        return self.jobs.get(job_id)
+        return self.store.get(job_id)
     
     def update_job(self, job: Job):
-        """Update job state"""
-        self.jobs[job.job_id] = job
+        """Update job state (may be called from generation threads)"""
+        job.version += 1
+        self.store.save(job)
+        if job.job_id in self._watchers and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake_watchers, job.job_id)
+    
+    def _wake_workers(self):
+        """Wake idle workers of this process (safe from any thread)"""
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if self._loop is not None and not on_loop and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        else:
+            self._wakeup.set()
+    
+    def _wake_watchers(self, job_id: str):
+        for event in self._watchers.get(job_id, ()):
+            event.set()
+    
+    async def watch(self, versions: Dict[str, int], timeout: float) -> List[Job]:
+        """
+        Wait until any of the jobs moves past the version the caller has seen.
+        Returns the changed jobs, or an empty list after `timeout` seconds.
+        Updates made in this process wake the caller immediately; a shared store
+        is also polled for updates made by other processes.
+        """
+        self._loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        for job_id in versions:
+            self._watchers.setdefault(job_id, set()).add(event)
+        deadline = self._loop.time() + timeout
+        
+        try:
+            while True:
+                event.clear()
+                # Store reads may wait on a writer's lock: kept off the event loop
+                jobs = await asyncio.to_thread(lambda: [self.get_job(job_id) for job_id in versions])
+                changed = [
+                    job for job in jobs
+                    if job is not None and job.version != versions[job.job_id]
+                ]
+                remaining = deadline - self._loop.time()
+                if changed or remaining <= 0:
+                    return changed
+                if self.store.shared:
+                    remaining = min(remaining, settings.job_poll_interval)
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for job_id in versions:
+                watchers = self._watchers.get(job_id)
+                if watchers is not None:
+                    watchers.discard(event)
+                    if not watchers:
+                        del self._watchers[job_id]
+    
+    def recover_interrupted(self) -> List[Job]:
+        """
+        Requeue jobs left running by a worker process that is gone (crash,
+        restart, recycled worker), or whose lease expired in a shared store.
+        Long-form jobs resume from their checkpoint.
+        """
+        from core.store import worker_alive
+        
+        recovered = self.store.requeue_orphans(
+            lambda job: not worker_alive(job.worker),
+            stale_before=time.time() - settings.job_lease_seconds,
+        )
+        for job in recovered:
+            logger.info(f"Requeued interrupted job {job.job_id}")
+        if recovered:
+            self._wake_workers()
+        return recovered
+    
+    def list_jobs(
+        self,
+        client_key: Optional[str] = None,
+        status: Optional[JobStatus] = None,
+        model: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        cursor: Optional[int] = None,
+        limit: int = 20,
+    ) -> tuple[List[Job], Optional[int]]:
+        """
+        One page of jobs, newest first.
+        Returns the jobs and the cursor of the next page (None on the last page).
+        """
+        filters = {
+            name: value
+            for name, value in (("client_key", client_key), ("status", status), ("model", model))
+            if value is not None
+        }
+        # One extra job tells whether there is a next page
+        page = self.store.list(filters, since=since, until=until, before=cursor, limit=limit + 1)
+        if len(page) > limit:
+            return page[:limit], page[limit - 1].seq
+        return page, None
 
 
 # Global job manager instance
@@ -0,0 +1,87 @@
+"""
+Reference melodies for melody-conditioned generation.
+
+Uploads are stored once under their content hash, so the same track uploaded
+again maps to the same melody id (and to the chroma features already cached
+for it by ml.chroma).
+"""
+from pathlib import Path
+from typing import Any, Dict, Optional
+import hashlib
+import io
+import logging
+import os
+import re
+import threading
+from core.settings import settings
+
+logger = logging.getLogger(__name__)
+
+MELODY_ID = re.compile(r"^[0-9a-f]{64}$")
+
+
+class MelodyError(ValueError):
+    """Upload that is not usable as a reference melody"""
+
+
+def _probe(data: bytes) -> Dict[str, Any]:
+    """Format details of an audio upload (raises MelodyError if it does not decode)"""
+    import soundfile as sf
+
+    try:
+        info = sf.info(io.BytesIO(data))
+    except Exception as e:
+        raise MelodyError(f"Unsupported or corrupted audio file: {e}")
+    if info.frames == 0 or info.samplerate <= 0:
+        raise MelodyError("Audio file is empty")
+    return {
+        "format": info.format.lower(),
+        "duration": round(info.frames / info.samplerate, 3),
+        "sample_rate": info.samplerate,
+        "channels": info.channels,
+    }
+
+
+class MelodyStore:
+    """Uploaded reference tracks, content-addressed by SHA-256"""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def add(self, data: bytes) -> Dict[str, Any]:
+        """Store an upload (once per content), returns its id and format details"""
+        if len(data) > settings.melody_max_mb * 1024 * 1024:
+            raise MelodyError(f"File exceeds maximum of {settings.melody_max_mb} MB")
+        info = _probe(data)
+        if info["duration"] > settings.melody_max_duration:
+            raise MelodyError(f"Melody exceeds maximum of {settings.melody_max_duration} seconds")
+
+        melody_id = hashlib.sha256(data).hexdigest()
+        path = self.directory / f"{melody_id}.{info['format']}"
+        created = not path.exists()
+        if created:
+            tmp_path = self.directory / f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+            logger.info(f"Stored melody {melody_id[:12]} ({info['duration']}s {info['format']})")
+        return {"melody_id": melody_id, "created": created, **info}
+
+    def path(self, melody_id: str) -> Optional[Path]:
+        """Stored file of a melody, None if unknown"""
+        if not MELODY_ID.match(melody_id):
+            return None
+        return next(self.directory.glob(f"{melody_id}.*"), None)
+
+
+_store: Optional[MelodyStore] = None
+_store_lock = threading.Lock()
+
+
+def get_melody_store() -> MelodyStore:
+    global _store
+
+    with _store_lock:
+        if _store is None or _store.directory != Path(settings.melody_dir):
+            _store = MelodyStore(settings.melody_dir)
+        return _store
@@ -0,0 +1,33 @@
+from collections import defaultdict
+from typing import Any, Callable, Dict
+import threading
+
+
+class Metrics:
+    """In-process counters plus snapshot providers registered by subsystems"""
+    
+    def __init__(self):
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._sources: Dict[str, Callable[[], Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+    
+    def incr(self, name: str, value: float = 1):
+        """Increment a counter"""
+        with self._lock:
+            self._counters[name] += value
+    
+    def register(self, name: str, source: Callable[[], Dict[str, Any]]):
+        """Register a callable returning a stats dict, reported under `name`"""
+        self._sources[name] = source
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Current counters and provider stats"""
+        with self._lock:
+            data: Dict[str, Any] = {"counters": dict(self._counters)}
+        for name, source in list(self._sources.items()):
+            data[name] = source()
+        return data
+
+
+# Global metrics instance
+metrics = Metrics()
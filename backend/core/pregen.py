@@ -0,0 +1,278 @@
+"""
+Idle-time pre-generation of popular prompts.
+
+API processes record the popularity of eligible requests (default model, no
+seed) and serve them from a pool of ready-made takes when one is stocked.
+Workers refill the pool while the queue has been empty for a while.
+Popularity and the pool live in one SQLite database, so every process on the
+host shares them; taking a take is a DELETE ... RETURNING, so no take is ever
+served twice.
+"""
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import sqlite3
+import threading
+import time
+import unicodedata
+from core.metrics import metrics
+from core.settings import settings
+from core.storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+# Generation parameters a take must share with the request it serves
+KEY_PARAMS = (
+    "model", "duration", "temperature", "top_k", "top_p",
+    "cfg_coef", "stereo", "sample_rate", "format",
+)
+# Seconds between idle checks of the pre-generation service
+POLL_SECONDS = 5.0
+
+
+def normalize_for_match(prompt: str) -> str:
+    """Loose canonical form used to match prompts: NFKC, case-folded, single spaces"""
+    return " ".join(unicodedata.normalize("NFKC", prompt).casefold().split())
+
+
+def pregen_key(params: Dict[str, Any]) -> Optional[str]:
+    """
+    Pool key of a request, None when it cannot be served from the pool
+    (explicit seed, variations, long-form, melody, or not the default model).
+    """
+    seed = params.get("seed")
+    if seed is not None and seed >= 0:
+        return None
+    if params.get("long_form") or params.get("num_variations", 1) != 1 or params.get("melody_id"):
+        return None
+    if params.get("model") != settings.model_default:
+        return None
+    shape = [normalize_for_match(params["prompt"])] + [params.get(name) for name in KEY_PARAMS]
+    return hashlib.sha1(json.dumps(shape).encode("utf-8")).hexdigest()
+
+
+@dataclass
+class Take:
+    path: Path
+    seed: int
+
+
+class PregenPool:
+    """Decayed request counts per key plus the stocked takes"""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.takes_dir = self.directory / "takes"
+        self.takes_dir.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._connect().executescript("""
+            CREATE TABLE IF NOT EXISTS popularity (
+                key TEXT PRIMARY KEY,
+                params TEXT NOT NULL,
+                score REAL NOT NULL,
+                updated REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS takes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                seed INTEGER NOT NULL,
+                bytes INTEGER NOT NULL,
+                created REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS takes_key ON takes (key, id);
+        """)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.directory / "pregen.sqlite", timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.create_function("decay", 2, _decay)
+            self._local.conn = conn
+        return conn
+
+    def record(self, key: str, params: Dict[str, Any]):
+        """Count one request; the latest request's params become the key's representative"""
+        now = time.time()
+        self._connect().execute(
+            """
+            INSERT INTO popularity (key, params, score, updated) VALUES (?, ?, 1, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                params = excluded.params,
+                score = decay(score, excluded.updated - updated) + 1,
+                updated = excluded.updated
+            """,
+            (key, json.dumps(params), now),
+        )
+
+    def take(self, key: str) -> Optional[Take]:
+        """Remove the oldest take of `key` from the pool and commit it to the output storage"""
+        row = self._connect().execute(
+            "DELETE FROM takes WHERE id = (SELECT id FROM takes WHERE key = ? ORDER BY id LIMIT 1) "
+            "RETURNING filename, seed",
+            (key,),
+        ).fetchone()
+        if row is None:
+            metrics.incr("pregen_misses")
+            return None
+        filename, seed = row
+        stored = get_storage().commit(self.takes_dir / filename)
+        metrics.incr("pregen_hits")
+        return Take(path=stored.path, seed=seed)
+
+    @staticmethod
+    def _sidecars(path: Path) -> List[Path]:
+        from ml.peaks import sidecar_path
+        sidecar = sidecar_path(path)
+        return [sidecar] if sidecar.exists() else []
+
+    def targets(self) -> List[Dict[str, Any]]:
+        """Most popular keys (above the minimum) that are short of takes, most popular first"""
+        rows = self._connect().execute(
+            """
+            SELECT p.key, p.params, decay(p.score, ? - p.updated) AS current,
+                   (SELECT COUNT(*) FROM takes t WHERE t.key = p.key) AS stocked
+            FROM popularity p
+            WHERE ROUND(current, 2) >= ?
+            ORDER BY current DESC
+            LIMIT ?
+            """,
+            (time.time(), settings.pregen_min_requests, settings.pregen_top_prompts),
+        ).fetchall()
+        return [
+            {"key": key, "params": json.loads(params), "score": score}
+            for key, params, score, stocked in rows
+            if stocked < settings.pregen_takes_per_prompt
+        ]
+
+    def add(self, key: str, path: Path, seed: int):
+        """Move a generated file from the output storage into the pool, then evict to stay within the disk budget"""
+        target = get_storage().detach(path.name, self.takes_dir)
+        size = sum(source.stat().st_size for source in [target, *self._sidecars(target)])
+        self._connect().execute(
+            "INSERT INTO takes (key, filename, seed, bytes, created) VALUES (?, ?, ?, ?, ?)",
+            (key, target.name, seed, size, time.time()),
+        )
+        self._enforce_budget()
+
+    def _enforce_budget(self):
+        """Drop takes of the least popular keys until the pool fits in the disk budget"""
+        conn = self._connect()
+        budget = settings.pregen_disk_mb * 1024 * 1024
+        while True:
+            total = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM takes").fetchone()[0]
+            if total <= budget:
+                return
+            row = conn.execute(
+                """
+                DELETE FROM takes WHERE id = (
+                    SELECT t.id FROM takes t LEFT JOIN popularity p ON p.key = t.key
+                    ORDER BY COALESCE(decay(p.score, ? - p.updated), 0), t.id DESC LIMIT 1
+                ) RETURNING filename
+                """,
+                (time.time(),),
+            ).fetchone()
+            if row is None:
+                return
+            path = self.takes_dir / row[0]
+            for victim in [path, *self._sidecars(path)]:
+                victim.unlink(missing_ok=True)
+            metrics.incr("pregen_evictions")
+
+    def stats(self) -> Dict[str, Any]:
+        takes, size = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM takes"
+        ).fetchone()
+        return {
+            "takes": takes,
+            "disk_mb": round(size / 1024 / 1024, 1),
+            "budget_mb": settings.pregen_disk_mb,
+            "stocked_prompts": self._connect().execute(
+                "SELECT COUNT(DISTINCT key) FROM takes"
+            ).fetchone()[0],
+        }
+
+
+def _decay(score: Optional[float], elapsed: Optional[float]) -> Optional[float]:
+    """Request count decayed with the configured half-life"""
+    if score is None:
+        return None
+    half_life = settings.pregen_half_life_hours * 3600
+    return score * math.pow(0.5, max(elapsed or 0.0, 0.0) / half_life)
+
+
+class PregenService:
+    """Fills the pool while this worker and the queue have been idle"""
+
+    def __init__(self, pool: PregenPool):
+        self.pool = pool
+
+    async def run(self):
+        from core.jobs import job_manager, JobStatus
+
+        idle_since: Optional[float] = None
+        while True:
+            await asyncio.sleep(POLL_SECONDS)
+            try:
+                busy = job_manager.active_jobs > 0 or await asyncio.to_thread(job_manager.store.count, JobStatus.QUEUED) > 0
+                if busy:
+                    idle_since = None
+                    continue
+                idle_since = idle_since or time.monotonic()
+                if time.monotonic() - idle_since < settings.pregen_idle_seconds:
+                    continue
+                targets = await asyncio.to_thread(self.pool.targets)
+                if targets:
+                    await self._generate(targets[0])
+            except Exception as e:
+                logger.warning(f"Pre-generation failed: {e}", exc_info=True)
+
+    async def _generate(self, target: Dict[str, Any]):
+        from core.executor import get_generation_executor
+        from ml.generate import generate_audio
+        from ml.sampling import random_seed
+
+        params = target["params"]
+        seed = random_seed()
+        logger.info(f"Pre-generating '{params['prompt']}' ({params.get('duration')}s)")
+        loop = asyncio.get_event_loop()
+        path = await loop.run_in_executor(
+            get_generation_executor(),
+            lambda: generate_audio(
+                model_name=params["model"],
+                prompt=params["prompt"],
+                duration=params.get("duration", 10),
+                seed=seed,
+                temperature=params.get("temperature", 1.0),
+                top_k=params.get("top_k", 250),
+                top_p=params.get("top_p", 0.0),
+                cfg_coef=params.get("cfg_coef", 3.0),
+                stereo=params.get("stereo", True),
+                sample_rate=params.get("sample_rate", 32000),
+            )
+        )
+        await asyncio.to_thread(self.pool.add, target["key"], Path(path), seed)
+        metrics.incr("pregen_generated")
+
+
+_pool: Optional[PregenPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pregen_pool() -> Optional[PregenPool]:
+    """Process-wide pool, None when pre-generation is disabled"""
+    global _pool
+
+    if not settings.pregen_enabled:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = PregenPool(settings.pregen_dir)
+            metrics.register("pregen", _pool.stats)
+        return _pool
@@ -13,9 +13,9 @@ class TokenBucket:
         self.tokens: Dict[str, float] = defaultdict(lambda: max_tokens)
         self.last_refill: Dict[str, float] = defaultdict(time.time)
     
-    def is_allowed(self, key: str) -> tuple[bool, int]:
+    def is_allowed(self, key: str, cost: float = 1.0) -> tuple[bool, int]:
         """
-        Check if request is allowed for key
+        Check if request costing `cost` tokens is allowed for key
         Returns (is_allowed, tokens_remaining)
         """
         now = time.time()
@@ -33,8 +33,8 @@ class TokenBucket:
             self.last_refill[key] = now
         
         # Check if token available
-        if self.tokens[key] >= 1.0:
-            self.tokens[key] -= 1.0
+        if self.tokens[key] >= cost:
+            self.tokens[key] -= cost
             return True, int(self.tokens[key])
         else:
             return False, int(self.tokens[key])
@@ -48,10 +48,10 @@ class IPRateLimiter:
         self.bucket = TokenBucket(max_tokens=requests_per_hour, refill_period_seconds=3600)
         self.request_times: Dict[str, list[float]] = defaultdict(list)
     
-    def is_allowed(self, ip: str) -> tuple[bool, int]:
+    def is_allowed(self, ip: str, cost: int = 1) -> tuple[bool, int]:
         """
-        Check if IP is allowed to make request
+        Check if IP is allowed to make request (a batch of N prompts costs N)
         Returns (is_allowed, requests_remaining)
         """
-        return self.bucket.is_allowed(ip)
+        return self.bucket.is_allowed(ip, cost)
 
@@ -11,11 +11,61 @@ class Settings(BaseSettings):
     
     # Generation limits
     max_duration: int = 30
+    longform_max_duration: int = 600  # long-form (windowed) requests
+    longform_window: int = 20  # seconds generated per window, capped by the model's max_duration
+    longform_overlap: float = 5.0  # seconds of each window's tail used as continuation context
+    longform_pipeline_depth: int = 2  # windows buffered between sampling and decode/write
+    longform_checkpoint_interval: float = 30.0  # seconds between checkpoints of long-form jobs, 0 disables
+    longform_checkpoint_dir: str = str(Path(__file__).parent.parent.parent / "data" / "checkpoints")
     output_dir: str = os.getenv("OUTPUT_DIR", str(Path(__file__).parent.parent.parent / "data" / "outputs"))
     
+    # Batch jobs
+    batch_max_items: int = 500  # prompts per /api/generate/batch request
+    max_batch_size: int = 0  # prompts per model call, 0 = model default
+    max_variations: int = 8  # takes per variations request
+    
+    # Job queue
+    job_store: str = "memory"  # memory (this process only) | sqlite (shared by API replicas and workers)
+    job_store_path: str = str(Path(__file__).parent.parent.parent / "data" / "jobs.sqlite")
+    inline_workers: bool = True  # run generation workers inside the API process
+    job_poll_interval: float = 1.0  # seconds between polls of the queue for jobs from other processes
+    job_lease_seconds: float = 60.0  # a shared-store job not renewed for this long is requeued (its host is gone)
+    
+    # Load-adaptive degradation (only for requests with allow_degrade=true)
+    degrade_enabled: bool = False
+    degrade_target_seconds: float = 120.0  # acceptable time to clear a job and the queue behind it
+    degrade_min_duration_ratio: float = 0.5  # shortest duration a degraded job may get, relative to the request
+    
+    # Idle-time pre-generation of popular prompts (default model, no seed)
+    pregen_enabled: bool = False
+    pregen_dir: str = str(Path(__file__).parent.parent.parent / "data" / "pregen")
+    pregen_disk_mb: int = 2048  # disk budget of the pool, least popular takes evicted first
+    pregen_idle_seconds: float = 30.0  # queue and workers idle this long before pre-generating
+    pregen_top_prompts: int = 20  # most popular prompts kept stocked
+    pregen_takes_per_prompt: int = 2
+    pregen_min_requests: float = 3.0  # decayed request count before a prompt is pre-generated
+    pregen_half_life_hours: float = 24.0  # popularity decay
+    
+    # Semantic cache: reuse a clip of a near-identical prompt (only for requests with allow_similar=true)
+    semantic_cache_enabled: bool = False
+    semantic_cache_threshold: float = 0.95  # cosine similarity of the prompt embeddings
+    semantic_cache_max_entries: int = 5000
+    
     # Rate limiting
     rate_limit_per_hour: int = 20
     
+    # Generation concurrency (CPU execution planning)
+    generation_slots: int = 0  # concurrent generations, 0 = derive from cpu_threads_per_slot
+    cpu_threads_per_slot: int = 0  # intra-op threads per generation, 0 = split cores evenly
+    cpu_interop_threads: int = 1
+    cpu_pinning: bool = True  # pin each slot to its own core set (Linux only)
+    
+    # Memory-aware admission
+    memory_admission: bool = True  # admit generate calls only when their estimated peak fits in free memory
+    memory_headroom: float = 0.9  # fraction of free memory admitted calls may use
+    memory_wait_timeout: float = 300.0  # seconds to wait for memory before running anyway
+    memory_model_path: str = str(Path(__file__).parent.parent.parent / "data" / "memory_model.json")
+    
     # CORS
     allow_origins: str = "http://localhost:3000"
     
@@ -26,6 +76,21 @@ class Settings(BaseSettings):
     host: str = "0.0.0.0"
     port: int = 8000
     
+    # Models
+    max_loaded_models: int = 2  # models kept loaded, least recently used evicted first
+    artifacts_dir: str = str(Path(__file__).parent.parent.parent / "data" / "models")  # python -m ml.artifacts
+    
+    # Text-conditioning cache (T5 embeddings of repeated prompts)
+    conditioning_cache_mb: int = 256  # memory cap, 0 disables the cache
+    conditioning_cache_dir: Optional[str] = None  # persist embeddings as memory-mapped .npy files
+    
+    # Reference melodies (musicgen-melody)
+    melody_dir: str = str(Path(__file__).parent.parent.parent / "data" / "melodies")
+    melody_max_mb: int = 20  # upload size limit
+    melody_max_duration: float = 30.0  # seconds of a reference kept for conditioning
+    chroma_cache_entries: int = 256  # chroma features kept in memory, 0 disables the cache
+    chroma_cache_dir: Optional[str] = str(Path(__file__).parent.parent.parent / "data" / "chroma")
+    
     # Hugging Face authentication
     huggingface_token: Optional[str] = None
     huggingface_offline: bool = False  # Use only local cache, no online checks
@@ -1,54 +1,62 @@
 from sse_starlette.sse import EventSourceResponse
 from fastapi import Request
-from typing import AsyncGenerator
+from typing import Any, AsyncGenerator, Dict, List
 import asyncio
 import json
 import logging
-from core.jobs import job_manager, Job
+from core.jobs import job_manager, Job, FINAL_STATUSES
 
 logger = logging.getLogger(__name__)
 
+# Seconds between disconnect checks while no job changes
+WATCH_TIMEOUT = 15.0
 
-async def job_event_generator(job_id: str, request: Request) -> AsyncGenerator[str, None]:
-    """Generate SSE events for job progress"""
-    last_progress = -1
+
+def job_event_data(job: Job) -> Dict[str, Any]:
+    """Payload of a progress event"""
+    event_data = {
+        "job_id": job.job_id,
+        "status": job.status,
+        "progress": job.progress,
+        "message": job.message,
+        "result_url": job.result_url,
+        "error": job.error,
+        "version": job.version,
+        "routing": job.routing,
+    }
+    if job.items:
+        # Batch jobs: per-item progress in the same stream
+        event_data["items"] = [item.model_dump() for item in job.items]
+    return event_data
+
+
+async def job_event_generator(job_ids: List[str], request: Request) -> AsyncGenerator[Dict[str, str], None]:
+    """
+    Generate SSE events for the progress of one or more jobs.
+    Each job's current state is sent first, then one event per change; the
+    stream ends once every job is done or failed.
+    """
+    versions: Dict[str, int] = {}
+    for job_id in job_ids:
+        if await asyncio.to_thread(job_manager.get_job, job_id) is None:
+            yield {"event": "error", "data": json.dumps({"job_id": job_id, "error": "Job not found"})}
+        else:
+            versions[job_id] = -1  # forces an initial event
     
-    while True:
+    while versions:
         # Check if client disconnected
         if await request.is_disconnected():
-            logger.info(f"Client disconnected for job {job_id}")
-            break
-        
-        # Get current job state
-        job = job_manager.get_job(job_id)
-        
-        if job is None:
-            yield f"event: error\ndata: {json.dumps({'error': 'Job not found'})}\n\n"
+            logger.info(f"Client disconnected from events of {len(versions)} job(s)")
             break
         
-        # Send update if progress changed
-        if job.progress != last_progress or job.status != "queued":
-            event_data = {
-                "job_id": job.job_id,
-                "status": job.status,
-                "progress": job.progress,
-                "message": job.message,
-                "result_url": job.result_url,
-                "error": job.error
-            }
-            
-            yield f"event: progress\ndata: {json.dumps(event_data)}\n\n"
-            last_progress = job.progress
-        
-        # If job is done or error, send final event and close
-        if job.status in ["done", "error"]:
-            await asyncio.sleep(0.5)  # Small delay to ensure final event is sent
-            break
-        
-        await asyncio.sleep(0.5)  # Poll every 500ms
+        for job in await job_manager.watch(versions, timeout=WATCH_TIMEOUT):
+            yield {"event": "progress", "data": json.dumps(job_event_data(job))}
+            if job.status in FINAL_STATUSES:
+                del versions[job.job_id]
+            else:
+                versions[job.job_id] = job.version
 
 
-def create_sse_response(job_id: str, request: Request) -> EventSourceResponse:
+def create_sse_response(job_ids: List[str], request: Request) -> EventSourceResponse:
     """Create SSE response for job events"""
-    return EventSourceResponse(job_event_generator(job_id, request))
-
+    return EventSourceResponse(job_event_generator(job_ids, request))
@@ -0,0 +1,233 @@
+"""
+Storage of generated files.
+
+Files live in a hash-sharded tree (output_dir/ab/cd/<file_id>.<ext>) so no
+directory grows unbounded, and are recorded in a SQLite index (name -> path,
+size, format, sha256, created). Lookups go through the index only; a file is
+indexed after it was renamed into place, so a partially written file is never
+served. Generation writes into output_dir/.staging and commits the result.
+
+    python -m core.storage migrate [--dry-run]   # shard and index a flat output_dir
+    python -m core.storage stats
+"""
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import argparse
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from core.settings import settings
+
+logger = logging.getLogger(__name__)
+
+STAGING_DIR = ".staging"
+INDEX_FILE = "index.sqlite"
+# Generated files the index serves; their peaks sidecars travel with them
+AUDIO_SUFFIXES = (".wav", ".mp3")
+SIDECAR_SUFFIX = ".peaks.json"
+
+
+@dataclass
+class StoredFile:
+    name: str  # public file name (<file_id>.<ext>)
+    path: Path
+    size: int
+    format: str
+    sha256: str
+    created: float
+    has_peaks: bool = False  # a peaks sidecar sits next to the file
+
+    @property
+    def file_id(self) -> str:
+        return self.name.rsplit(".", 1)[0]
+
+
+def shard_of(file_id: str) -> str:
+    """Two-level shard directory of a file id"""
+    digest = hashlib.sha1(file_id.encode("utf-8")).hexdigest()
+    return f"{digest[:2]}/{digest[2:4]}"
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FileStorage:
+    """Sharded output tree plus its index"""
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.staging_dir = self.root / STAGING_DIR
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._connect().executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                name TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                format TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                created REAL NOT NULL,
+                peaks INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS files_file_id ON files (file_id);
+        """)
+        columns = {row[1] for row in self._connect().execute("PRAGMA table_info(files)")}
+        if "peaks" not in columns:
+            # Index created before sidecars were recorded: look them up once
+            self._connect().execute("ALTER TABLE files ADD COLUMN peaks INTEGER NOT NULL DEFAULT 0")
+            for name, path in self._connect().execute("SELECT name, path FROM files").fetchall():
+                sidecar = self.root / Path(path).parent / f"{Path(path).stem}{SIDECAR_SUFFIX}"
+                if sidecar.exists():
+                    self._connect().execute("UPDATE files SET peaks = 1 WHERE name = ?", (name,))
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.root / INDEX_FILE, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def staging_path(self, file_id: str, suffix: str = ".wav") -> Path:
+        """Where a file is written before it is committed"""
+        return self.staging_dir / f"{file_id}{suffix}"
+
+    def commit(self, path: Path) -> StoredFile:
+        """
+        Move a finished file (and its peaks sidecar) into its shard and index it.
+        Renames stay on one filesystem, so the file appears complete or not at all.
+        """
+        path = Path(path)
+        name = path.name
+        file_id = path.stem
+        target_dir = self.root / shard_of(file_id)
+        target_dir.mkdir(parents=True, exist_ok=True)
+
+        stored = StoredFile(
+            name=name,
+            path=target_dir / name,
+            size=path.stat().st_size,
+            format=path.suffix.lstrip("."),
+            sha256=_sha256(path),
+            created=time.time(),
+        )
+        sidecar = path.parent / f"{file_id}{SIDECAR_SUFFIX}"
+        if sidecar.exists():
+            _move(sidecar, target_dir / sidecar.name)
+            stored.has_peaks = True
+        _move(path, stored.path)
+        self._connect().execute(
+            "INSERT OR REPLACE INTO files (name, file_id, path, size, format, sha256, created, peaks) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                name, file_id, str(stored.path.relative_to(self.root)), stored.size, stored.format,
+                stored.sha256, stored.created, int(stored.has_peaks),
+            ),
+        )
+        return stored
+
+    def get(self, name: str) -> Optional[StoredFile]:
+        """Indexed file by public name (<file_id>.<ext>) or bare file id"""
+        row = self._connect().execute(
+            "SELECT name, path, size, format, sha256, created, peaks FROM files WHERE name = ? OR file_id = ? LIMIT 1",
+            (name, name),
+        ).fetchone()
+        if row is None:
+            return None
+        name, path, size, format, sha256, created, peaks = row
+        return StoredFile(name, self.root / path, size, format, sha256, created, bool(peaks))
+
+    def detach(self, name: str, directory: Path) -> Optional[Path]:
+        """Move a file (and its sidecar) out of the storage into `directory`, unindexed"""
+        stored = self.get(name)
+        if stored is None:
+            return None
+        self._connect().execute("DELETE FROM files WHERE name = ?", (stored.name,))
+        directory.mkdir(parents=True, exist_ok=True)
+        sidecar = stored.path.parent / f"{stored.file_id}{SIDECAR_SUFFIX}"
+        for source in (stored.path, sidecar):
+            if source.exists():
+                _move(source, directory / source.name)
+        return directory / stored.name
+
+    def stats(self) -> Dict[str, Any]:
+        files, size = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files"
+        ).fetchone()
+        return {"files": files, "bytes": size}
+
+    def migrate(self, dry_run: bool = False) -> List[str]:
+        """Shard and index the audio files found flat in the root (pre-index layout)"""
+        migrated = []
+        for path in sorted(self.root.iterdir()):
+            if not path.is_file() or path.suffix not in AUDIO_SUFFIXES:
+                continue
+            migrated.append(path.name)
+            if not dry_run:
+                self.commit(path)
+        return migrated
+
+
+def _move(source: Path, target: Path):
+    """Atomic rename; across filesystems, copy next to the target first and rename that"""
+    try:
+        os.replace(source, target)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        tmp_path = target.parent / f".{target.name}.{os.getpid()}.tmp"
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, target)
+        source.unlink()
+
+
+_storages: Dict[str, FileStorage] = {}
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> FileStorage:
+    """Storage of the configured output directory"""
+    with _storage_lock:
+        storage = _storages.get(settings.output_dir)
+        if storage is None:
+            storage = _storages[settings.output_dir] = FileStorage(settings.output_dir)
+        return storage
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m core.storage", description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = commands.add_parser("migrate", help="move flat output files into the sharded layout")
+    migrate_parser.add_argument("--dry-run", action="store_true", help="only list the files to migrate")
+    commands.add_parser("stats", help="show the number and size of indexed files")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    storage = get_storage()
+
+    if args.command == "migrate":
+        migrated = storage.migrate(dry_run=args.dry_run)
+        for name in migrated:
+            print(name)
+        print(f"{len(migrated)} file(s) {'to migrate' if args.dry_run else 'migrated'} in {storage.root}")
+    else:
+        stats = storage.stats()
+        print(f"{stats['files']} file(s), {stats['bytes'] / 1e6:.1f} MB in {storage.root}")
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
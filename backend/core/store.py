@@ -0,0 +1,490 @@
+from collections import defaultdict, deque
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, List, Optional
+import bisect
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from core.jobs import Job, JobStatus
+from core.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class JobStore:
+    """
+    Where jobs and their queue live.
+    `claim` must hand each queued job to exactly one worker; any backend doing
+    that (SQLite, a networked broker) can share jobs between processes.
+    """
+    
+    # Whether other processes see the same jobs (API replicas, standalone workers)
+    shared: bool = False
+    
+    def add(self, job: Job) -> int:
+        """Store and enqueue a new job, returns its sequence number"""
+        raise NotImplementedError
+    
+    def get(self, job_id: str) -> Optional[Job]:
+        raise NotImplementedError
+    
+    def save(self, job: Job):
+        """Persist the current state of a job (dropped if the job was requeued or claimed again since)"""
+        raise NotImplementedError
+    
+    def claim(self) -> Optional[Job]:
+        """Take the oldest queued job and mark it running, None if the queue is empty"""
+        raise NotImplementedError
+    
+    def list(
+        self,
+        filters: Dict[str, Any],
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        before: Optional[int] = None,
+        limit: int = 20,
+    ) -> List[Job]:
+        """Jobs matching all filters (status, model, client_key), newest first, with seq < `before`"""
+        raise NotImplementedError
+    
+    def count(self, status: JobStatus) -> int:
+        """Number of jobs in a status"""
+        raise NotImplementedError
+    
+    def requeue_orphans(
+        self,
+        is_orphan: Callable[[Job], bool],
+        stale_before: Optional[float] = None,
+    ) -> List[Job]:
+        """
+        Put running jobs whose worker is gone back at the head of the queue.
+        In a shared store, jobs whose lease was last renewed before the
+        `stale_before` timestamp count as orphans too.
+        """
+        raise NotImplementedError
+    
+    def heartbeat(self, job_ids: List[str]):
+        """Renew the lease of running jobs (only shared stores have leases)"""
+    
+    def expire_overdue(self, now: datetime) -> List[Job]:
+        """Finish queued jobs whose deadline has passed, without running them"""
+        raise NotImplementedError
+    
+    def close(self):
+        pass
+
+
+# Identity of this process as the owner of the jobs it claims
+_token = uuid.uuid4().hex[:8]
+
+
+def worker_id() -> str:
+    """host:pid:token of this process (the token tells apart processes that reused a pid)"""
+    return f"{socket.gethostname()}:{os.getpid()}:{_token}"
+
+
+def worker_alive(worker: Optional[str]) -> bool:
+    """
+    Whether the process that claimed a job may still be running it.
+    Only processes on this host can be checked; others are assumed alive
+    (jobs of other hosts are recovered when their lease expires).
+    """
+    try:
+        host, pid, token = worker.rsplit(":", 2)
+        pid = int(pid)
+    except (AttributeError, ValueError):
+        return False
+    if host != socket.gethostname():
+        return True
+    if pid == os.getpid():
+        return token == _token
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _mark_running(job: Job):
+    job.status = JobStatus.RUNNING
+    job.started_at = datetime.now()
+    job.worker = worker_id()
+    job.claim = uuid.uuid4().hex
+    job.version += 1
+
+
+def _mark_requeued(job: Job):
+    job.status = JobStatus.QUEUED
+    job.worker = None
+    job.claim = None
+    job.message = "Interrupted, waiting to resume..."
+    job.version += 1
+
+
+def _mark_expired(job: Job):
+    """Final state of a job whose deadline passed before a worker started it"""
+    job.status = JobStatus.EXPIRED
+    job.error = "Deadline passed before the job could start"
+    job.worker = None
+    job.started_at = None
+    job.completed_at = datetime.now()
+    job.version += 1
+
+
+class JobIndex:
+    """
+    Secondary indexes over jobs, maintained on create/update.
+    Each index maps a key (status, model, client) to the sorted sequence numbers
+    of its jobs, so a filtered page is found by bisection instead of a scan.
+    """
+    
+    def __init__(self):
+        self.by_seq: List[str] = []  # job ids, position = seq - 1
+        self.created: List[float] = []  # creation timestamps, non-decreasing
+        self.indexes: Dict[str, Dict[Any, List[int]]] = {
+            "status": defaultdict(list),
+            "model": defaultdict(list),
+            "client_key": defaultdict(list),
+        }
+        self._status: Dict[str, str] = {}  # status each job is indexed under
+    
+    def add(self, job: Job) -> int:
+        """Index a new job, returns its sequence number"""
+        self.by_seq.append(job.job_id)
+        created = job.created_at.timestamp()
+        self.created.append(max(created, self.created[-1]) if self.created else created)
+        seq = len(self.by_seq)
+        # New jobs always have the highest seq, so appending keeps lists sorted
+        self.indexes["status"][job.status].append(seq)
+        self.indexes["model"][job.params.get("model")].append(seq)
+        self.indexes["client_key"][job.client_key].append(seq)
+        self._status[job.job_id] = job.status
+        return seq
+    
+    def update(self, job: Job):
+        """Move a job between status indexes when its status changed"""
+        previous = self._status.get(job.job_id)
+        if previous is None or previous == job.status:
+            return
+        old = self.indexes["status"][previous]
+        del old[bisect.bisect_left(old, job.seq)]
+        bisect.insort(self.indexes["status"][job.status], job.seq)
+        self._status[job.job_id] = job.status
+    
+    def query(
+        self,
+        filters: Dict[str, Any],
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        before: Optional[int] = None,
+    ):
+        """Yield job ids matching all filters, newest first, with seq < `before`"""
+        # Time range -> seq range (creation timestamps are sorted by seq)
+        low = bisect.bisect_left(self.created, since.timestamp()) + 1 if since else 1
+        high = bisect.bisect_right(self.created, until.timestamp()) if until else len(self.by_seq)
+        if before is not None:
+            high = min(high, before - 1)
+        if low > high:
+            return
+        
+        # Walk the most selective index, check the others by membership
+        candidates = [self.indexes[name].get(value, []) for name, value in filters.items()]
+        if not candidates:
+            for seq in range(high, low - 1, -1):
+                yield self.by_seq[seq - 1]
+            return
+        candidates.sort(key=len)
+        walk, others = candidates[0], candidates[1:]
+        start = bisect.bisect_left(walk, low)
+        for position in range(bisect.bisect_right(walk, high) - 1, start - 1, -1):
+            seq = walk[position]
+            if all(_contains(index, seq) for index in others):
+                yield self.by_seq[seq - 1]
+
+
+def _contains(sorted_seqs: List[int], seq: int) -> bool:
+    position = bisect.bisect_left(sorted_seqs, seq)
+    return position < len(sorted_seqs) and sorted_seqs[position] == seq
+
+
+class MemoryJobStore(JobStore):
+    """Jobs in process memory: fastest, but only visible to this process"""
+    
+    def __init__(self):
+        self._jobs: Dict[str, Job] = {}
+        self._queue: Deque[str] = deque()
+        self._index = JobIndex()
+        self._lock = threading.Lock()
+    
+    def add(self, job: Job) -> int:
+        with self._lock:
+            job.seq = self._index.add(job)
+            self._jobs[job.job_id] = job
+            if job.status == JobStatus.QUEUED:
+                self._queue.append(job.job_id)
+        return job.seq
+    
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+    
+    def save(self, job: Job):
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._index.update(job)
+    
+    def claim(self) -> Optional[Job]:
+        with self._lock:
+            while self._queue:
+                job = self._jobs[self._queue.popleft()]
+                if job.status == JobStatus.QUEUED:
+                    _mark_running(job)
+                    self._index.update(job)
+                    return job
+        return None
+    
+    def count(self, status: JobStatus) -> int:
+        return len(self._index.indexes["status"].get(status, ()))
+    
+    def requeue_orphans(self, is_orphan: Callable[[Job], bool], stale_before: Optional[float] = None) -> List[Job]:
+        # Jobs of this process only: its workers' liveness is known, no lease needed
+        with self._lock:
+            orphans = [
+                job for job in self._jobs.values()
+                if job.status == JobStatus.RUNNING and is_orphan(job)
+            ]
+            for job in sorted(orphans, key=lambda job: job.seq, reverse=True):
+                _mark_requeued(job)
+                self._index.update(job)
+                self._queue.appendleft(job.job_id)
+        return orphans
+    
+    def expire_overdue(self, now: datetime) -> List[Job]:
+        with self._lock:
+            expired = []
+            for job_id in self._queue:
+                job = self._jobs[job_id]
+                if job.status == JobStatus.QUEUED and job.deadline_at is not None and job.deadline_at <= now:
+                    _mark_expired(job)
+                    self._index.update(job)
+                    expired.append(job)
+            if expired:
+                self._queue = deque(job_id for job_id in self._queue if self._jobs[job_id].status == JobStatus.QUEUED)
+        return expired
+    
+    def list(self, filters, since=None, until=None, before=None, limit=20) -> List[Job]:
+        with self._lock:
+            page = []
+            for job_id in self._index.query(filters, since=since, until=until, before=before):
+                if len(page) == limit:
+                    break
+                page.append(self._jobs[job_id])
+            return page
+
+
+class SQLiteJobStore(JobStore):
+    """
+    Jobs in a SQLite database shared by every process on the host.
+    WAL mode lets API processes read while workers write; claims run in an
+    immediate transaction so two workers never take the same job.
+    """
+    
+    shared = True
+    
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._connect().executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL UNIQUE,
+                status TEXT NOT NULL,
+                model TEXT,
+                client_key TEXT,
+                created_at REAL NOT NULL,
+                data TEXT NOT NULL,
+                heartbeat REAL,  -- lease of a running job, renewed by its worker
+                deadline REAL,  -- queued jobs past it are expired
+                claim TEXT  -- token of the current claim, only its holder may save the job
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, seq);
+            CREATE INDEX IF NOT EXISTS jobs_model ON jobs (model, seq);
+            CREATE INDEX IF NOT EXISTS jobs_client_key ON jobs (client_key, seq);
+            CREATE INDEX IF NOT EXISTS jobs_created_at ON jobs (created_at);
+        """)
+        columns = {row[1] for row in self._connect().execute("PRAGMA table_info(jobs)")}
+        for column, kind in (("heartbeat", "REAL"), ("deadline", "REAL"), ("claim", "TEXT")):
+            if column not in columns:
+                self._connect().execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        self._connect().execute("CREATE INDEX IF NOT EXISTS jobs_deadline ON jobs (status, deadline)")
+    
+    def _connect(self) -> sqlite3.Connection:
+        """One connection per thread (generation threads save progress directly)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
+    @staticmethod
+    def _load(seq: int, data: str) -> Job:
+        job = Job.model_validate_json(data)
+        job.seq = seq
+        return job
+    
+    def add(self, job: Job) -> int:
+        cursor = self._connect().execute(
+            "INSERT INTO jobs (job_id, status, model, client_key, created_at, data, deadline) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                job.job_id, JobStatus(job.status).value, job.params.get("model"),
+                job.client_key, job.created_at.timestamp(), job.model_dump_json(),
+                job.deadline_at.timestamp() if job.deadline_at else None,
+            ),
+        )
+        job.seq = cursor.lastrowid
+        return job.seq
+    
+    def get(self, job_id: str) -> Optional[Job]:
+        row = self._connect().execute(
+            "SELECT seq, data FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        return self._load(*row) if row else None
+    
+    def save(self, job: Job):
+        # A worker whose lease expired must not overwrite the requeued or reclaimed job
+        cursor = self._connect().execute(
+            "UPDATE jobs SET status = ?, data = ? WHERE job_id = ? AND claim IS ?",
+            (JobStatus(job.status).value, job.model_dump_json(), job.job_id, job.claim),
+        )
+        if cursor.rowcount == 0:
+            logger.warning(f"Dropped a stale update of job {job.job_id}: it was requeued or claimed again")
+    
+    def claim(self) -> Optional[Job]:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT seq, data FROM jobs WHERE status = ? ORDER BY seq LIMIT 1",
+                (JobStatus.QUEUED.value,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            job = self._load(*row)
+            _mark_running(job)
+            conn.execute(
+                "UPDATE jobs SET status = ?, data = ?, heartbeat = ?, claim = ? WHERE seq = ?",
+                (JobStatus.RUNNING.value, job.model_dump_json(), time.time(), job.claim, job.seq),
+            )
+            conn.execute("COMMIT")
+            return job
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    
+    def list(self, filters, since=None, until=None, before=None, limit=20) -> List[Job]:
+        clauses, args = [], []
+        for name, value in filters.items():
+            clauses.append(f"{name} = ?")
+            args.append(JobStatus(value).value if name == "status" else value)
+        if since is not None:
+            clauses.append("created_at >= ?")
+            args.append(since.timestamp())
+        if until is not None:
+            clauses.append("created_at <= ?")
+            args.append(until.timestamp())
+        if before is not None:
+            clauses.append("seq < ?")
+            args.append(before)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._connect().execute(
+            f"SELECT seq, data FROM jobs {where} ORDER BY seq DESC LIMIT ?", (*args, limit)
+        ).fetchall()
+        return [self._load(*row) for row in rows]
+    
+    def count(self, status: JobStatus) -> int:
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = ?", (JobStatus(status).value,)
+        ).fetchone()[0]
+    
+    def requeue_orphans(self, is_orphan: Callable[[Job], bool], stale_before: Optional[float] = None) -> List[Job]:
+        # Checked and updated in one transaction, so a job claimed meanwhile is left alone
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT seq, data, heartbeat FROM jobs WHERE status = ?", (JobStatus.RUNNING.value,)
+            ).fetchall()
+            orphans = []
+            for seq, data, heartbeat in rows:
+                job = self._load(seq, data)
+                # No heartbeat: claimed before leases existed, only the liveness check applies
+                expired = stale_before is not None and heartbeat is not None and heartbeat < stale_before
+                if expired or is_orphan(job):
+                    orphans.append(job)
+            for job in orphans:
+                _mark_requeued(job)
+                conn.execute(
+                    "UPDATE jobs SET status = ?, data = ?, heartbeat = NULL, claim = NULL WHERE seq = ?",
+                    (JobStatus.QUEUED.value, job.model_dump_json(), job.seq),
+                )
+            conn.execute("COMMIT")
+            return orphans
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    
+    def expire_overdue(self, now: datetime) -> List[Job]:
+        # Checked and updated in one transaction, so a job claimed meanwhile is left alone
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT seq, data FROM jobs WHERE status = ? AND deadline <= ?",
+                (JobStatus.QUEUED.value, now.timestamp()),
+            ).fetchall()
+            expired = [self._load(*row) for row in rows]
+            for job in expired:
+                _mark_expired(job)
+                conn.execute(
+                    "UPDATE jobs SET status = ?, data = ? WHERE seq = ?",
+                    (JobStatus.EXPIRED.value, job.model_dump_json(), job.seq),
+                )
+            conn.execute("COMMIT")
+            return expired
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    
+    def heartbeat(self, job_ids: List[str]):
+        if not job_ids:
+            return
+        self._connect().execute(
+            f"UPDATE jobs SET heartbeat = ? WHERE status = ? AND job_id IN ({', '.join('?' * len(job_ids))})",
+            (time.time(), JobStatus.RUNNING.value, *job_ids),
+        )
+    
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def create_job_store() -> JobStore:
+    """Job store selected by the JOB_STORE setting"""
+    if settings.job_store == "sqlite":
+        logger.info(f"Using SQLite job store at {settings.job_store_path}")
+        return SQLiteJobStore(settings.job_store_path)
+    if settings.job_store != "memory":
+        raise ValueError(f"Unknown job store '{settings.job_store}' (memory|sqlite)")
+    return MemoryJobStore()
@@ -0,0 +1,316 @@
+"""
+Prepared model artifacts: weights converted once to safetensors and loaded via mmap.
+
+Loading a prepared model pages weights in lazily from the page cache instead of
+deserializing the Hugging Face checkpoint, so model swaps are cheap and worker
+processes on one host share the same physical pages.
+
+    python -m ml.artifacts convert [model ...]   # from the Hugging Face cache
+    python -m ml.artifacts verify [model ...]
+    python -m ml.artifacts list
+"""
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from core.settings import settings
+from ml.registry import ModelSpec, registry
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+# Parts of an AudioCraft model, each saved as <part>.safetensors + <part>.yaml
+PARTS = ("lm", "compression")
+
+
+class ArtifactError(Exception):
+    """Missing, incomplete or corrupted artifact"""
+
+
+def artifact_dir(model_id: str) -> Path:
+    return Path(settings.artifacts_dir) / model_id
+
+
+def read_manifest(model_id: str) -> Optional[Dict[str, Any]]:
+    """Manifest of a prepared model, None if it was never converted"""
+    path = artifact_dir(model_id) / MANIFEST
+    if not path.exists():
+        return None
+    try:
+        manifest = json.loads(path.read_text())
+    except ValueError as e:
+        raise ArtifactError(f"Unreadable manifest {path}: {e}")
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ArtifactError(f"{model_id}: unsupported artifact format {manifest.get('format_version')}")
+    return manifest
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _checkpoint(part: str, spec: ModelSpec) -> Dict[str, Any]:
+    """AudioCraft checkpoint package ({'xp.cfg', 'best_state'} or {'pretrained'})"""
+    from audiocraft.models import loaders
+
+    if part == "lm":
+        return loaders.load_lm_model_ckpt(spec.pretrained)
+    return loaders.load_compression_model_ckpt(spec.pretrained)
+
+
+def convert(spec: ModelSpec, force: bool = False) -> Path:
+    """
+    Convert a registered model to the artifact format.
+    Files are written to a temporary directory and renamed into place, so a
+    partially converted model is never picked up by load_model.
+    """
+    import torch
+    from omegaconf import OmegaConf
+    from safetensors.torch import save_file
+
+    target = artifact_dir(spec.id)
+    if target.exists() and not force:
+        logger.info(f"{spec.id}: already converted ({target})")
+        return target
+
+    tmp_dir = target.parent / f".{spec.id}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    files: Dict[str, Dict[str, Any]] = {}
+    parts: Dict[str, Dict[str, Any]] = {}
+
+    try:
+        for part in PARTS:
+            pkg = _checkpoint(part, spec)
+            if "pretrained" in pkg:
+                # Compression model referenced by name (e.g. a stock EnCodec)
+                parts[part] = {"pretrained": pkg["pretrained"]}
+                continue
+
+            cfg = OmegaConf.create(pkg["xp.cfg"])
+            (tmp_dir / f"{part}.yaml").write_text(OmegaConf.to_yaml(cfg))
+            # safetensors rejects tensors sharing storage, store each one on its own
+            state = {
+                name: tensor.detach().to("cpu").contiguous().clone()
+                for name, tensor in pkg["best_state"].items()
+            }
+            save_file(state, str(tmp_dir / f"{part}.safetensors"))
+            parts[part] = {"weights": f"{part}.safetensors", "config": f"{part}.yaml"}
+            del pkg, state
+
+        for path in sorted(tmp_dir.iterdir()):
+            files[path.name] = {"size": path.stat().st_size, "sha256": _sha256(path)}
+
+        manifest = {
+            "format_version": FORMAT_VERSION,
+            "model_id": spec.id,
+            "family": spec.family,
+            "pretrained": spec.pretrained,
+            "torch_version": torch.__version__,
+            "created_at": time.time(),
+            "parts": parts,
+            "files": files,
+        }
+        (tmp_dir / MANIFEST).write_text(json.dumps(manifest, indent=2))
+
+        if target.exists():
+            shutil.rmtree(target)
+        os.replace(tmp_dir, target)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    logger.info(f"{spec.id}: converted to {target}")
+    return target
+
+
+def verify(model_id: str, full: bool = True) -> Dict[str, Any]:
+    """Check every file against the manifest (sizes only unless `full`)"""
+    manifest = read_manifest(model_id)
+    if manifest is None:
+        raise ArtifactError(f"{model_id}: not converted")
+    directory = artifact_dir(model_id)
+    for name, expected in manifest["files"].items():
+        path = directory / name
+        if not path.exists():
+            raise ArtifactError(f"{model_id}: missing {name}")
+        if path.stat().st_size != expected["size"]:
+            raise ArtifactError(f"{model_id}: {name} has the wrong size")
+        if full and _sha256(path) != expected["sha256"]:
+            raise ArtifactError(f"{model_id}: {name} does not match its checksum")
+    return manifest
+
+
+# Builders are patched while an LM is built on the meta device
+_build_lock = threading.Lock()
+
+
+def _build_lm_on_meta(cfg: Any) -> Any:
+    """
+    LM module whose parameters live on the meta device: no memory is allocated
+    and no random init runs before the artifact's weights are assigned.
+    Conditioners still build on the CPU, since their frozen encoders (T5,
+    Demucs) are loaded from their own checkpoints rather than from the artifact.
+    """
+    from audiocraft.models import builders
+
+    original = builders.get_conditioner_provider
+
+    def get_conditioner_provider(output_dim: int, conditioner_cfg: Any) -> Any:
+        conditioner_cfg = conditioner_cfg.copy()
+        conditioner_cfg.device = "cpu"
+        return original(output_dim, conditioner_cfg)
+
+    meta_cfg = cfg.copy()
+    meta_cfg.device = "meta"
+    with _build_lock:
+        builders.get_conditioner_provider = get_conditioner_provider
+        try:
+            return builders.get_lm_model(meta_cfg)
+        finally:
+            builders.get_conditioner_provider = original
+
+
+def _load_part(part: str, info: Dict[str, Any], directory: Path, device: Any) -> Any:
+    """
+    Build one model part and assign its weights from the memory-mapped file.
+    With assign=True the module keeps the mmap-backed tensors (on CPU) instead
+    of copying them, so pages are read on first use and shared between processes.
+    """
+    from omegaconf import OmegaConf
+    from safetensors.torch import load_file
+    from audiocraft.models import builders, loaders
+    from audiocraft.models.encodec import CompressionModel
+
+    if "pretrained" in info:
+        return CompressionModel.get_pretrained(info["pretrained"], device=device)
+
+    cfg = OmegaConf.create((directory / info["config"]).read_text())
+    # Same adjustments as audiocraft.models.loaders
+    cfg.device = "cpu"
+    if part == "lm":
+        cfg.dtype = "float32" if device.type == "cpu" else "float16"
+        for param in (
+            "conditioners.self_wav.chroma_stem.cache_path",
+            "conditioners.args.merge_text_conditions_p",
+            "conditioners.args.drop_desc_p",
+        ):
+            loaders._delete_param(cfg, param)
+        module = _build_lm_on_meta(cfg)
+    else:
+        module = builders.get_compression_model(cfg)
+
+    reference = module.state_dict()
+    state = load_file(str(directory / info["weights"]), device="cpu")
+    # Keep the dtype the builder chose; only mismatching tensors are copied
+    state = {
+        name: tensor if name not in reference or tensor.dtype == reference[name].dtype
+        else tensor.to(reference[name].dtype)
+        for name, tensor in state.items()
+    }
+    del reference
+    module.load_state_dict(state, assign=True)
+    # Non-persistent buffers are not in the artifact and would stay unmaterialized
+    unassigned = [
+        name for name, tensor in [*module.named_parameters(), *module.named_buffers()] if tensor.is_meta
+    ]
+    if unassigned:
+        raise ArtifactError(f"{part}: tensors missing from the artifact: {', '.join(unassigned[:5])}")
+    cfg.device = str(device)
+    module.cfg = cfg
+    return module.to(device).eval()
+
+
+def load_artifact(spec: ModelSpec, device: Any) -> Any:
+    """Load a prepared model (raises ArtifactError if it is missing or incomplete)"""
+    manifest = verify(spec.id, full=False)
+    if manifest["pretrained"] != spec.pretrained:
+        raise ArtifactError(f"{spec.id}: artifact was converted from {manifest['pretrained']}")
+    directory = artifact_dir(spec.id)
+
+    start = time.monotonic()
+    lm = _load_part("lm", manifest["parts"]["lm"], directory, device)
+    compression_model = _load_part("compression", manifest["parts"]["compression"], directory, device)
+
+    if spec.family == "musicgen":
+        from audiocraft.models import MusicGen
+
+        if "self_wav" in lm.condition_provider.conditioners:
+            lm.condition_provider.conditioners["self_wav"].match_len_on_eval = True
+        model = MusicGen(spec.pretrained, compression_model, lm)
+    else:
+        from audiocraft.models import AudioGen
+
+        model = AudioGen(spec.pretrained, compression_model, lm)
+
+    logger.info(f"Loaded {spec.id} from artifacts in {time.monotonic() - start:.1f}s")
+    return model
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m ml.artifacts", description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert_parser = commands.add_parser("convert", help="convert models from the Hugging Face cache")
+    convert_parser.add_argument("models", nargs="*", help="model ids (default: all registered)")
+    convert_parser.add_argument("--force", action="store_true", help="convert again even if present")
+    verify_parser = commands.add_parser("verify", help="check artifacts against their checksums")
+    verify_parser.add_argument("models", nargs="*", help="model ids (default: all converted)")
+    commands.add_parser("list", help="show the artifact state of every registered model")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    unknown = [model_id for model_id in getattr(args, "models", []) if registry.get(model_id) is None]
+    if unknown:
+        parser.error(f"unknown model(s): {', '.join(unknown)}")
+
+    failures = 0
+    if args.command == "convert":
+        for model_id in args.models or list(registry.specs):
+            try:
+                convert(registry.get(model_id), force=args.force)
+            except Exception as e:
+                logger.error(f"{model_id}: conversion failed: {e}")
+                failures += 1
+
+    elif args.command == "verify":
+        model_ids = args.models or [
+            model_id for model_id in registry.specs if (artifact_dir(model_id) / MANIFEST).exists()
+        ]
+        for model_id in model_ids:
+            try:
+                verify(model_id)
+                print(f"{model_id}: ok")
+            except ArtifactError as e:
+                print(f"{model_id}: FAILED ({e})")
+                failures += 1
+
+    else:
+        for model_id in registry.specs:
+            try:
+                manifest = read_manifest(model_id)
+            except ArtifactError as e:
+                print(f"{model_id}: invalid ({e})")
+                continue
+            if manifest is None:
+                print(f"{model_id}: not converted")
+            else:
+                size = sum(f["size"] for f in manifest["files"].values())
+                print(f"{model_id}: {size / 1e9:.2f} GB in {artifact_dir(model_id)}")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import logging
+from typing import Any, Callable, Dict, List, Optional
+from core.settings import settings
+from ml.registry import registry
+
+logger = logging.getLogger(__name__)
+
+# Parameters that must be identical for items to share one model.generate call
+# (seeds are per item, see ml.sampling)
+BATCH_KEY_PARAMS = (
+    "model", "duration", "temperature", "top_k", "top_p",
+    "cfg_coef", "stereo", "sample_rate", "melody_id",
+)
+
+
+def batch_size_for(model_name: str) -> int:
+    """Maximum number of prompts per model.generate call"""
+    if settings.max_batch_size > 0:
+        return settings.max_batch_size
+    spec = registry.get(model_name)
+    return spec.batch_size if spec else 1
+
+
+def plan_batches(items: List[Dict[str, Any]]) -> List[List[int]]:
+    """
+    Group item indices into model-sized batches.
+    Items are grouped by their generation parameters, keeping submission order.
+    """
+    groups: Dict[tuple, List[int]] = {}
+    for index, params in enumerate(items):
+        key = tuple(params.get(name) for name in BATCH_KEY_PARAMS)
+        groups.setdefault(key, []).append(index)
+
+    batches = []
+    for indices in groups.values():
+        size = batch_size_for(items[indices[0]]["model"])
+        batches.extend(indices[i:i + size] for i in range(0, len(indices), size))
+    return batches
+
+
+def run_batch(
+    items: List[Dict[str, Any]],
+    progress_callback: Optional[Callable[[int, str], None]] = None,
+    item_callback: Optional[Callable[..., None]] = None,
+) -> List[Optional[str]]:
+    """
+    Generate every item of a batch job.
+
+    `item_callback(index, status=..., progress=..., path=..., error=...)` reports
+    per-item state changes. A failing batch only fails its own items.
+    Returns paths (None for failed items).
+    """
+    from ml.generate import generate_batch
+    from ml.sampling import random_seed
+
+    results: List[Optional[str]] = [None] * len(items)
+    batches = plan_batches(items)
+    done = 0
+
+    for number, indices in enumerate(batches, start=1):
+        params = items[indices[0]]
+        seeds = []
+        for i in indices:
+            seed = items[i].get("seed")
+            seeds.append(seed if seed is not None and seed >= 0 else random_seed())
+            if item_callback:
+                item_callback(i, seed=seeds[-1])
+
+        def batch_progress(progress: int, message: str):
+            if item_callback:
+                for i in indices:
+                    item_callback(i, status="running", progress=progress)
+            if progress_callback:
+                overall = int(100 * (done + len(indices) * progress / 100) / len(items))
+                progress_callback(min(99, overall), f"Batch {number}/{len(batches)}: {message}")
+
+        try:
+            paths = generate_batch(
+                model_name=params["model"],
+                prompts=[items[i]["prompt"] for i in indices],
+                duration=params.get("duration", 10),
+                seeds=seeds,
+                temperature=params.get("temperature", 1.0),
+                top_k=params.get("top_k", 250),
+                top_p=params.get("top_p", 0.0),
+                cfg_coef=params.get("cfg_coef", 3.0),
+                stereo=params.get("stereo", True),
+                sample_rate=params.get("sample_rate", 32000),
+                progress_callback=batch_progress,
+                melody_id=params.get("melody_id"),
+            )
+        except Exception as e:
+            logger.error(f"Batch {number}/{len(batches)} failed: {e}")
+            for i in indices:
+                if item_callback:
+                    item_callback(i, status="error", error=str(e))
+        else:
+            for i, path in zip(indices, paths):
+                results[i] = path
+                if item_callback:
+                    item_callback(i, status="done", progress=100, path=path)
+        done += len(indices)
+
+    return results
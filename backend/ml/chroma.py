@@ -0,0 +1,171 @@
+"""
+Cache of chroma conditioning features of reference melodies.
+
+Extracting chroma runs source separation (Demucs) on the whole reference,
+which costs more than a short generation. Features are cached per model and
+melody content: in memory (LRU) and as .npy files read back memory-mapped, so
+they survive restarts and are shared by worker processes.
+"""
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import logging
+import os
+import threading
+import numpy as np
+import torch
+from core.metrics import metrics
+from core.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def load_melody(path: Path, max_duration: float) -> Tuple[torch.Tensor, int]:
+    """Reference track as a (channels, samples) float tensor and its sample rate"""
+    import soundfile as sf
+
+    with sf.SoundFile(str(path)) as f:
+        frames = min(f.frames, int(max_duration * f.samplerate))
+        wav = f.read(frames, dtype="float32", always_2d=True)
+        return torch.from_numpy(wav.T.copy()), f.samplerate
+
+
+def wav_key(wav: torch.Tensor, length: Any) -> str:
+    """Content hash of one conditioning waveform (what the chroma is computed from)"""
+    digest = hashlib.sha1(wav.detach().to("cpu", torch.float32).contiguous().numpy().tobytes())
+    digest.update(str(int(length)).encode())
+    return digest.hexdigest()
+
+
+class ChromaCache:
+    """LRU of chroma features keyed by (model, waveform hash), optionally persisted"""
+
+    def __init__(self, max_entries: int, cache_dir: Optional[str] = None):
+        self.max_entries = max_entries
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self._entries: "OrderedDict[Tuple[str, str], torch.Tensor]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _disk_path(self, key: Tuple[str, str]) -> Optional[Path]:
+        if self.cache_dir is None:
+            return None
+        return self.cache_dir / f"{key[0]}-{key[1]}.npy"
+
+    def get(self, key: Tuple[str, str]) -> Optional[torch.Tensor]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        path = self._disk_path(key)
+        if path is not None and path.exists():
+            try:
+                # Copy-on-write mapping: writable for torch, pages stay shared until written
+                entry = torch.from_numpy(np.load(path, mmap_mode="c"))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Discarding unreadable chroma cache file {path}: {e}")
+                path.unlink(missing_ok=True)
+            else:
+                self._insert(key, entry)
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                return entry
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: Tuple[str, str], features: torch.Tensor):
+        features = features.detach().to("cpu").contiguous()
+        self._insert(key, features)
+
+        path = self._disk_path(key)
+        if path is not None and not path.exists():
+            tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            try:
+                with open(tmp_path, "wb") as f:
+                    np.save(f, features.float().numpy())
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning(f"Could not persist chroma features: {e}")
+                tmp_path.unlink(missing_ok=True)
+
+    def _insert(self, key: Tuple[str, str], features: torch.Tensor):
+        with self._lock:
+            self._entries[key] = features
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def _item(condition: Any, index: int) -> Any:
+    """One batch item of a WavCondition (a named tuple of batched tensors and lists)"""
+    return type(condition)(*[field[index:index + 1] for field in condition])
+
+
+def _wrap_chroma_conditioner(conditioner: Any, cache: ChromaCache, model_name: str):
+    """Patch a chroma conditioner in place so each reference is analysed once"""
+    original = conditioner._get_wav_embedding
+
+    def get_wav_embedding(x: Any) -> torch.Tensor:
+        features: List[torch.Tensor] = []
+        for index in range(x.wav.shape[0]):
+            item = _item(x, index)
+            key = (model_name, wav_key(item.wav, item.length[0]))
+            cached = cache.get(key)
+            if cached is None:
+                cached = original(item)[0]
+                cache.put(key, cached)
+            features.append(cached.to(x.wav.device))
+        return torch.stack(features)
+
+    conditioner._get_wav_embedding = get_wav_embedding
+
+
+_cache: Optional[ChromaCache] = None
+
+
+def get_chroma_cache() -> Optional[ChromaCache]:
+    """Process-wide chroma cache, None when disabled"""
+    global _cache
+
+    if _cache is None and settings.chroma_cache_entries > 0:
+        _cache = ChromaCache(settings.chroma_cache_entries, settings.chroma_cache_dir)
+        metrics.register("chroma_cache", _cache.stats)
+    return _cache
+
+
+def install_chroma_cache(model: Any, model_name: str):
+    """Route the melody (chroma) conditioner of a loaded model through the cache"""
+    cache = get_chroma_cache()
+    if cache is None:
+        return
+    try:
+        conditioner = model.lm.condition_provider.conditioners["self_wav"]
+    except (AttributeError, KeyError):
+        return
+    if hasattr(conditioner, "_get_wav_embedding"):
+        _wrap_chroma_conditioner(conditioner, cache, model_name)
+        logger.info(f"Chroma cache enabled for {model_name}")
@@ -0,0 +1,224 @@
+import hashlib
+import logging
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+import torch
+from core.metrics import metrics
+from core.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(text: Optional[str]) -> str:
+    """Canonical form of a prompt: NFC, trimmed, single spaces (case is kept, T5 is cased)"""
+    if not text:
+        return ""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class ConditioningCache:
+    """
+    LRU cache of text-conditioning embeddings keyed by (model, attribute, prompt).
+
+    Entries are stored unpadded on the CPU and accounted by size against
+    `max_bytes`. With `cache_dir` set, every computed embedding is also written
+    as a .npy file and later read back memory-mapped, so the cache survives
+    restarts and worker processes share its pages. Entries are only read.
+    """
+
+    def __init__(self, max_bytes: int, cache_dir: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self._entries: "OrderedDict[Tuple[str, str, str], torch.Tensor]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _disk_path(self, key: Tuple[str, str, str]) -> Optional[Path]:
+        if self.cache_dir is None:
+            return None
+        digest = hashlib.sha256("\0".join(key).encode("utf-8")).hexdigest()
+        return self.cache_dir / f"{digest}.npy"
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[torch.Tensor]:
+        """Cached embedding of shape (tokens, dim), or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        path = self._disk_path(key)
+        if path is not None and path.exists():
+            try:
+                # Copy-on-write mapping: writable for torch, pages stay shared until written
+                entry = torch.from_numpy(np.load(path, mmap_mode="c"))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Discarding unreadable conditioning cache file {path}: {e}")
+                path.unlink(missing_ok=True)
+            else:
+                self._insert(key, entry)
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                return entry
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: Tuple[str, str, str], embedding: torch.Tensor):
+        """Store an embedding (tokens, dim)"""
+        embedding = embedding.detach().to("cpu").contiguous()
+        self._insert(key, embedding)
+
+        path = self._disk_path(key)
+        if path is not None and not path.exists():
+            tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            try:
+                with open(tmp_path, "wb") as f:
+                    np.save(f, embedding.float().numpy())
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning(f"Could not persist conditioning embedding: {e}")
+                tmp_path.unlink(missing_ok=True)
+
+    def _insert(self, key: Tuple[str, str, str], embedding: torch.Tensor):
+        size = embedding.numel() * embedding.element_size()
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.numel() * previous.element_size()
+            self._entries[key] = embedding
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.numel() * evicted.element_size()
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit-rate and occupancy metrics"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class _TokenizedText(dict):
+    """Tokenizer output that remembers the prompts it was built from"""
+
+    def __init__(self, inputs: Any, texts: List[Optional[str]]):
+        super().__init__(inputs)
+        self.texts = texts
+
+
+def _wrap_text_conditioner(conditioner: Any, cache: ConditioningCache, model_name: str, attribute: str):
+    """
+    Patch a T5 text conditioner in place so forward() only encodes prompts
+    missing from the cache. Duplicate prompts in a batch are encoded once.
+    """
+    original_tokenize = conditioner.tokenize
+    original_forward = conditioner.forward
+
+    def tokenize(x: List[Optional[str]]):
+        return _TokenizedText(original_tokenize(x), list(x))
+
+    def forward(inputs: Any):
+        if not isinstance(inputs, _TokenizedText):
+            return original_forward(inputs)
+
+        mask = inputs["attention_mask"]
+        keys = [(model_name, attribute, normalize_prompt(text)) for text in inputs.texts]
+
+        embeddings: Dict[Tuple[str, str, str], torch.Tensor] = {}
+        missing: Dict[Tuple[str, str, str], Optional[str]] = {}
+        for key, text in zip(keys, inputs.texts):
+            if key in embeddings or key in missing:
+                continue
+            cached = cache.get(key)
+            if cached is not None:
+                embeddings[key] = cached
+            else:
+                missing[key] = text
+
+        if missing:
+            miss_keys = list(missing)
+            miss_inputs = original_tokenize([missing[k] for k in miss_keys])
+            miss_embeds, miss_mask = original_forward(miss_inputs)
+            for i, key in enumerate(miss_keys):
+                length = int(miss_mask[i].sum().item())
+                embeddings[key] = miss_embeds[i, :length].detach().to("cpu")
+                cache.put(key, embeddings[key])
+
+        # Re-pad to the tokenizer's batch length: padded positions still take part
+        # in cross-attention, so the padded shape must match the uncached path
+        dim = next(iter(embeddings.values())).shape[-1]
+        embeds = torch.zeros(
+            (len(keys), mask.shape[1], dim),
+            dtype=conditioner.output_proj.weight.dtype,
+            device=mask.device,
+        )
+        for i, key in enumerate(keys):
+            entry = embeddings[key]
+            embeds[i, :entry.shape[0]] = entry.to(embeds)
+        return embeds, mask
+
+    conditioner.tokenize = tokenize
+    conditioner.forward = forward
+
+
+_cache: Optional[ConditioningCache] = None
+
+
+def get_conditioning_cache() -> Optional[ConditioningCache]:
+    """Process-wide conditioning cache, None when disabled"""
+    global _cache
+
+    if _cache is None and settings.conditioning_cache_mb > 0:
+        _cache = ConditioningCache(
+            max_bytes=settings.conditioning_cache_mb * 1024 * 1024,
+            cache_dir=settings.conditioning_cache_dir,
+        )
+        metrics.register("conditioning_cache", _cache.stats)
+    return _cache
+
+
+def install_conditioning_cache(model: Any, model_name: str):
+    """Route the text conditioners of a loaded model through the cache"""
+    cache = get_conditioning_cache()
+    if cache is None:
+        return
+
+    try:
+        conditioners = model.lm.condition_provider.conditioners
+    except AttributeError:
+        logger.warning(f"Model {model_name} has no condition provider, conditioning cache not installed")
+        return
+
+    for attribute, conditioner in conditioners.items():
+        # T5 text conditioners expose their tokenizer; chroma/wav conditioners don't
+        if hasattr(conditioner, "t5_tokenizer"):
+            _wrap_text_conditioner(conditioner, cache, model_name, attribute)
+            logger.info(f"Conditioning cache enabled for {model_name}/{attribute}")
@@ -1,50 +1,51 @@
 import os
+import time
 import uuid
 import torch
 import logging
+import numpy as np
 from pathlib import Path
-from typing import Callable, Optional, Dict, Any
+from typing import Callable, Optional, Dict, Any, List
 from core.settings import settings
-from ml.models import load_model, get_device
+from core.metrics import metrics
+from core.storage import get_storage
+from ml.memory import (
+    device_free_memory,
+    get_memory_admission,
+    is_oom,
+    measure_peak,
+    memory_key,
+    prior_for,
+    release_cached_memory,
+)
+from ml.models import generation_view, load_model, get_device
+from ml.peaks import PeaksBuilder, write_sidecar
+from ml.resample import resample
+from ml.sampling import per_item_seeds, random_seed
 
 logger = logging.getLogger(__name__)
 
+# Shortest window worth falling back to when an item does not fit in memory
+MIN_FALLBACK_WINDOW = 2.0
 
-def generate_audio(
-    model_name: str,
-    prompt: str,
-    duration: int = 10,
-    seed: Optional[int] = None,
-    temperature: float = 1.0,
-    top_k: int = 250,
-    top_p: float = 0.0,
-    cfg_coef: float = 3.0,
-    stereo: bool = True,
-    sample_rate: int = 32000,
-    progress_callback: Optional[Callable[[int, str], None]] = None,
-) -> str:
+
+def _set_generation_params(
+    model: Any,
+    is_audiogen: bool,
+    duration: float,
+    temperature: float,
+    top_k: int,
+    top_p: float,
+    cfg_coef: float,
+):
     """
-    Generate audio from text prompt
+    Apply generation parameters to the model
     
-    Returns path to generated audio file
+    Models always generate at their native sample rate (model.sample_rate);
+    other output rates are produced by the resampling stage.
     """
-    device = get_device()
-    
-    # Progress: 0-10% - Loading model
-    if progress_callback:
-        progress_callback(5, "Loading model...")
-    
-    model = load_model(model_name, device)
-    
-    # Progress: 10-15% - Setting generation parameters
-    if progress_callback:
-        progress_callback(10, "Preparing generation...")
-    
-    # Set generation parameters - AudioGen has different API than MusicGen
-    is_audiogen = model_name.startswith("audiogen")
-    
     if is_audiogen:
-        # AudioGen has fixed sample rate of 16000 and doesn't support all MusicGen params
+        # AudioGen doesn't support all MusicGen params
         # Build params dict conditionally to avoid passing None values
         audiogen_params = {
             "duration": duration,
@@ -58,8 +59,6 @@ def generate_audio(
         
         try:
             model.set_generation_params(**audiogen_params)
-            # AudioGen uses 16kHz sample rate by default
-            audio_sample_rate = 16000
         except Exception as e:
             logger.warning(f"Some AudioGen params not supported: {e}")
             # Minimal fallback for AudioGen
@@ -69,24 +68,20 @@ def generate_audio(
                     temperature=temperature,
                     cfg_coef=cfg_coef,
                 )
-                audio_sample_rate = 16000
             except Exception as e2:
                 logger.error(f"Failed to set AudioGen params: {e2}")
-                audio_sample_rate = 16000
     else:
-        # MusicGen supports more parameters including sample_rate
+        # MusicGen supports more parameters
         try:
             model.set_generation_params(
                 duration=duration,
                 temperature=temperature,
                 top_k=top_k,
-                top_p=top_p if top_p > 0 else None,
+                top_p=top_p if top_p > 0 else 0.0,
                 cfg_coef=cfg_coef,
                 two_step_cfg=False,
                 use_sampling=True,
-                sample_rate=sample_rate,
             )
-            audio_sample_rate = sample_rate
         except Exception as e:
             logger.warning(f"Some params not supported, using defaults: {e}")
             # Fallback to basic params
@@ -95,32 +90,131 @@ def generate_audio(
                     duration=duration,
                     temperature=temperature,
                     cfg_coef=cfg_coef,
-                    sample_rate=sample_rate,
                 )
-                audio_sample_rate = sample_rate
             except Exception as e:
                 logger.warning(f"Using minimal params: {e}")
-                audio_sample_rate = sample_rate
-    
-    # Set seed if provided
-    if seed is not None and seed >= 0:
-        torch.manual_seed(seed)
-        if device.type == "cuda":
-            torch.cuda.manual_seed_all(seed)
-        elif device.type == "xpu":
-            # Intel GPU seed handling
-            import intel_extension_for_pytorch as ipex
-            ipex.xpu.manual_seed_all(seed)
-    else:
-        # Generate random seed
-        seed = torch.randint(0, 2**32, (1,)).item()
-        torch.manual_seed(seed)
-        if device.type == "cuda":
-            torch.cuda.manual_seed_all(seed)
-        elif device.type == "xpu":
-            # Intel GPU seed handling
-            import intel_extension_for_pytorch as ipex
-            ipex.xpu.manual_seed_all(seed)
+
+
+def generate_audio(
+    model_name: str,
+    prompt: str,
+    duration: int = 10,
+    seed: Optional[int] = None,
+    temperature: float = 1.0,
+    top_k: int = 250,
+    top_p: float = 0.0,
+    cfg_coef: float = 3.0,
+    stereo: bool = True,
+    sample_rate: int = 32000,
+    long_form: bool = False,
+    progress_callback: Optional[Callable[[int, str], None]] = None,
+    checkpoint_key: Optional[str] = None,
+    melody_id: Optional[str] = None,
+    timing: Optional[Dict[str, float]] = None,
+) -> str:
+    """
+    Generate audio from text prompt
+    
+    Long-form generations with a `checkpoint_key` (the job id) are checkpointed
+    and resume where an interrupted run with the same key stopped.
+    
+    `timing`, if given, receives "compute_seconds": the generation time without
+    loading the model (what throughput estimates learn from).
+    
+    Returns path to generated audio file
+    """
+    return generate_batch(
+        model_name=model_name,
+        prompts=[prompt],
+        duration=duration,
+        seed=seed,
+        temperature=temperature,
+        top_k=top_k,
+        top_p=top_p,
+        cfg_coef=cfg_coef,
+        stereo=stereo,
+        sample_rate=sample_rate,
+        long_form=long_form,
+        progress_callback=progress_callback,
+        checkpoint_key=checkpoint_key,
+        melody_id=melody_id,
+        timing=timing,
+    )[0]
+
+
+def generate_batch(
+    model_name: str,
+    prompts: List[str],
+    duration: int = 10,
+    seed: Optional[int] = None,
+    temperature: float = 1.0,
+    top_k: int = 250,
+    top_p: float = 0.0,
+    cfg_coef: float = 3.0,
+    stereo: bool = True,
+    sample_rate: int = 32000,
+    long_form: bool = False,
+    progress_callback: Optional[Callable[[int, str], None]] = None,
+    seeds: Optional[List[int]] = None,
+    checkpoint_key: Optional[str] = None,
+    melody_id: Optional[str] = None,
+    timing: Optional[Dict[str, float]] = None,
+) -> List[str]:
+    """
+    Generate audio for several prompts sharing the same parameters
+    in a single batched model call
+    
+    Each item samples from its own RNG (seeds[i], or `seed` for every item),
+    so a take is reproducible from its seed alone.
+    
+    With `melody_id`, every item follows that uploaded reference melody
+    (models with supports_melody only; no windowed generation).
+    
+    `timing` receives "compute_seconds", as for generate_audio.
+    
+    Returns paths to generated audio files, in prompt order
+    """
+    device = get_device()
+    
+    # Progress: 0-10% - Loading model
+    if progress_callback:
+        progress_callback(5, "Loading model...")
+    
+    # Slots sharing a model generate concurrently, each with its own generation params
+    model = generation_view(load_model(model_name, device))
+    compute_start = time.monotonic()
+    
+    # Progress: 10-15% - Setting generation parameters
+    if progress_callback:
+        progress_callback(10, "Preparing generation...")
+    
+    # Set generation parameters - AudioGen has different API than MusicGen
+    is_audiogen = model_name.startswith("audiogen")
+    
+    def set_params(gen_duration: float):
+        _set_generation_params(
+            model, is_audiogen, gen_duration, temperature, top_k, top_p, cfg_coef
+        )
+    
+    set_params(duration)
+    
+    # Models generate at their native rate, the resampling stage converts to the requested one
+    native_sample_rate = model.sample_rate
+    audio_sample_rate = sample_rate
+    
+    # Per-item seeds; items without one get a fresh random seed
+    if seeds is None:
+        seeds = [seed if seed is not None and seed >= 0 else random_seed() for _ in prompts]
+    
+    # Seed the global RNGs too, for anything sampled outside the token loop
+    seed = seeds[0]
+    torch.manual_seed(seed)
+    if device.type == "cuda":
+        torch.cuda.manual_seed_all(seed)
+    elif device.type == "xpu":
+        # Intel GPU seed handling
+        import intel_extension_for_pytorch as ipex
+        ipex.xpu.manual_seed_all(seed)
     
     # Progress: 15-20% - Generating
     if progress_callback:
@@ -134,100 +228,169 @@ def generate_audio(
             generation_progress["step"] = min(95, generation_progress["step"] + delta)
             progress_callback(generation_progress["step"], message)
     
-    try:
-        # Generate audio
-        # Note: AudioCraft doesn't expose fine-grained progress, so we simulate
-        update_progress(5, "Sampling audio...")
+    def postprocess(wav: np.ndarray) -> np.ndarray:
+        """Native-rate (channels, samples) window -> saved layout at the output rate"""
+        wav = resample(torch.from_numpy(wav), native_sample_rate, audio_sample_rate).numpy()
+        return _to_output_array(wav, stereo, is_audiogen)
+    
+    melody = None
+    if melody_id is not None:
+        from core.melodies import get_melody_store
+        from ml.chroma import load_melody
         
-        with torch.no_grad():
-            wav = model.generate(
-                descriptions=[prompt],
-                progress=True if progress_callback else False
+        melody_path = get_melody_store().path(melody_id)
+        if melody_path is None:
+            raise ValueError(f"Unknown melody: {melody_id}")
+        melody = load_melody(melody_path, settings.melody_max_duration)
+    
+    memory = get_memory_admission()
+    memory_config = memory_key(model_name, model, device)
+    memory_prior = prior_for(model)
+    # Window used when a single item does not fit in memory in one pass
+    fallback_window = min(settings.longform_window, duration / 2)
+    can_window = fallback_window >= MIN_FALLBACK_WINDOW and melody is None
+    
+    def run_long_form(prompt: str, item_seed: int, window: Optional[float] = None) -> str:
+        """Windowed continuation: memory stays constant regardless of duration"""
+        from ml.longform import Checkpoint, generate_long_form
+        
+        def window_progress(fraction: float, message: str):
+            if progress_callback:
+                progress_callback(15 + int(75 * fraction), message)
+        
+        window_seconds = min(window or settings.longform_window, duration)
+        estimate = memory.model.estimate(memory_config, window_seconds, memory_prior)
+        checkpoint = None
+        if checkpoint_key and settings.longform_checkpoint_interval > 0:
+            # Stable names, so a restarted job finds its partial file and state
+            filepath = get_storage().staging_path(checkpoint_key, ".wav")
+            checkpoint = Checkpoint(Path(settings.longform_checkpoint_dir) / f"{checkpoint_key}.pt")
+        else:
+            filepath = _new_output_path()
+        peaks = PeaksBuilder(audio_sample_rate)
+        with memory.reserve(device, estimate), per_item_seeds([item_seed]):
+            generate_long_form(
+                model=model,
+                prompt=prompt,
+                duration=duration,
+                set_duration=set_params,
+                sample_rate=audio_sample_rate,
+                postprocess=postprocess,
+                output_path=filepath,
+                progress_callback=window_progress,
+                peaks=peaks,
+                window=window,
+                checkpoint=checkpoint,
             )
+        _write_peaks(peaks, filepath)
+        return str(_finalize_format(filepath))
+    
+    def run_chunk(chunk_prompts: List[str], chunk_seeds: List[int]) -> List[str]:
+        """One model.generate call, admitted against free memory"""
+        item_seconds = len(chunk_prompts) * duration
+        estimate = memory.model.estimate(memory_config, item_seconds, memory_prior)
+        with memory.reserve(device, estimate) as reservation, measure_peak(device) as peak:
+            with torch.no_grad(), per_item_seeds(chunk_seeds):
+                if melody is not None:
+                    melody_wav, melody_rate = melody
+                    wav = model.generate_with_chroma(
+                        descriptions=list(chunk_prompts),
+                        melody_wavs=[melody_wav] * len(chunk_prompts),
+                        melody_sample_rate=melody_rate,
+                        progress=True if progress_callback else False
+                    )
+                else:
+                    wav = model.generate(
+                        descriptions=list(chunk_prompts),
+                        progress=True if progress_callback else False
+                    )
+        # A device-wide peak only describes this call if nothing ran alongside it
+        if peak["bytes"] is not None and not reservation.shared:
+            memory.model.observe(memory_config, item_seconds, peak["bytes"])
         
         update_progress(10, "Processing output...")
         
-        # Convert to numpy and handle stereo
-        import numpy as np
-        
+        # Resample the whole batch on the generation device, then convert to numpy:
+        # (batch, channels, samples)
         if isinstance(wav, torch.Tensor):
-            wav = wav.cpu().numpy()
-        
-        # Handle shape: (batch, channels, samples) -> (samples, channels)
-        if len(wav.shape) == 3:
-            wav = wav[0]  # Take first batch item
-            if wav.shape[0] == 1:  # Mono
-                wav = wav[0]
-            elif wav.shape[0] == 2:  # Stereo
-                wav = wav.T  # Transpose to (samples, channels)
+            wav = resample(wav, native_sample_rate, audio_sample_rate).cpu().numpy()
         
-        # Ensure output is stereo if requested
-        # AudioGen generates mono, MusicGen can generate stereo
-        if stereo and len(wav.shape) == 1:
-            # Duplicate mono to stereo
-            wav = np.stack([wav, wav], axis=1)
-        elif not stereo and len(wav.shape) == 2:
-            # Convert stereo to mono (average channels)
-            wav = wav.mean(axis=1)
-        
-        # AudioGen always outputs mono at 16kHz, so force mono if it's AudioGen
-        if is_audiogen and len(wav.shape) == 2:
-            # If somehow we got stereo from AudioGen, convert to mono
-            wav = wav.mean(axis=1) if wav.shape[1] == 2 else wav
-            # Then duplicate to stereo if requested
-            if stereo:
-                wav = np.stack([wav, wav], axis=1)
-        
-        # Progress: 85-95% - Saving file
+        # Progress: 85-95% - Saving files
         if progress_callback:
-            progress_callback(90, "Saving audio file...")
+            progress_callback(90, "Saving audio file..." if len(prompts) == 1 else "Saving audio files...")
         
-        # Ensure output directory exists
-        output_dir = Path(settings.output_dir)
-        output_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Generate filename
-        file_id = str(uuid.uuid4())
-        if settings.audio_format == "mp3":
-            filename = f"{file_id}.wav"  # Save as WAV first, convert to MP3
-        else:
-            filename = f"{file_id}.wav"
-        
-        filepath = output_dir / filename
+        paths = []
+        for item in wav[:len(chunk_prompts)]:
+            filepath = _new_output_path()
+            item = _to_output_array(item, stereo, is_audiogen)
+            _save_wav(item, filepath, audio_sample_rate)
+            _write_peaks(PeaksBuilder(audio_sample_rate).add(item), filepath)
+            paths.append(str(_finalize_format(filepath)))
+        return paths
+    
+    def run_items(item_prompts: List[str], item_seeds: List[int]) -> List[str]:
+        """
+        Generate items in the largest batches that fit in memory.
+        On OOM the batch is split in halves; a single item that still does
+        not fit falls back to windowed generation.
+        """
+        size = memory.fit_batch(memory_config, device, len(item_prompts), duration, memory_prior)
+        if size == 0 and can_window:
+            logger.info(f"{duration}s does not fit in memory in one pass, generating in {fallback_window:.0f}s windows")
+            metrics.incr("memory_windowed_fallbacks")
+            return [run_long_form(p, s, fallback_window) for p, s in zip(item_prompts, item_seeds)]
+        size = max(size, 1)
         
-        # Save as WAV using torchaudio or scipy
-        try:
-            import torchaudio
-            # Convert to tensor with correct shape
-            if len(wav.shape) == 1:
-                wav_tensor = torch.from_numpy(wav).unsqueeze(0)  # (1, samples)
-            else:
-                wav_tensor = torch.from_numpy(wav).T  # (channels, samples)
+        paths = []
+        for start in range(0, len(item_prompts), size):
+            chunk_prompts = item_prompts[start:start + size]
+            chunk_seeds = item_seeds[start:start + size]
+            try:
+                paths.extend(run_chunk(chunk_prompts, chunk_seeds))
+            except Exception as e:
+                if not is_oom(e) or (len(chunk_prompts) == 1 and not can_window):
+                    raise
+                release_cached_memory(device)
+                memory.model.observe_oom(
+                    memory_config,
+                    len(chunk_prompts) * duration,
+                    device_free_memory(device),
+                    memory.model.estimate(memory_config, len(chunk_prompts) * duration, memory_prior),
+                )
+                metrics.incr("oom_recoveries")
+                if len(chunk_prompts) > 1:
+                    half = len(chunk_prompts) // 2
+                    logger.warning(f"Out of memory with {len(chunk_prompts)} items, retrying in halves")
+                    paths.extend(run_items(chunk_prompts[:half], chunk_seeds[:half]))
+                    paths.extend(run_items(chunk_prompts[half:], chunk_seeds[half:]))
+                else:
+                    logger.warning(f"Out of memory for {duration}s, retrying in {fallback_window:.0f}s windows")
+                    paths.append(run_long_form(chunk_prompts[0], chunk_seeds[0], fallback_window))
+        return paths
+    
+    try:
+        if long_form and duration > settings.longform_window and len(prompts) == 1 and melody is None:
+            path = run_long_form(prompts[0], seeds[0])
             
-            torchaudio.save(str(filepath), wav_tensor, audio_sample_rate)
+            if progress_callback:
+                progress_callback(100, "Complete!")
+            if timing is not None:
+                timing["compute_seconds"] = time.monotonic() - compute_start
             
-        except Exception as e:
-            logger.warning(f"torchaudio save failed: {e}, using scipy")
-            from scipy.io import wavfile
-            wavfile.write(str(filepath), audio_sample_rate, wav)
+            return [path]
         
-        # Convert to MP3 if requested
-        if settings.audio_format == "mp3":
-            try:
-                from pydub import AudioSegment
-                mp3_path = output_dir / f"{file_id}.mp3"
-                audio = AudioSegment.from_wav(str(filepath))
-                audio.export(str(mp3_path), format="mp3")
-                os.remove(filepath)  # Remove WAV file
-                filepath = mp3_path
-                
-            except Exception as e:
-                logger.warning(f"MP3 conversion failed: {e}, keeping WAV")
+        # Generate audio
+        # Note: AudioCraft doesn't expose fine-grained progress, so we simulate
+        update_progress(5, "Sampling audio...")
+        
+        paths = run_items(list(prompts), seeds)
         
         if progress_callback:
             progress_callback(100, "Complete!")
+        if timing is not None:
+            timing["compute_seconds"] = time.monotonic() - compute_start
         
-        return str(filepath)
+        return paths
     
     except torch.cuda.OutOfMemoryError as e:
         error_msg = f"Out of memory. Try a smaller model or shorter duration."
@@ -245,3 +408,85 @@ def generate_audio(
         logger.error(f"Generation failed: {e}", exc_info=True)
         raise RuntimeError(f"Audio generation failed: {str(e)}")
 
+
+def _to_output_array(wav: np.ndarray, stereo: bool, is_audiogen: bool) -> np.ndarray:
+    """
+    Convert model output (channels, samples) to the saved layout:
+    (samples,) for mono or (samples, channels) for stereo
+    """
+    if len(wav.shape) == 2:
+        if wav.shape[0] == 1:  # Mono
+            wav = wav[0]
+        elif wav.shape[0] == 2:  # Stereo
+            wav = wav.T  # Transpose to (samples, channels)
+    
+    # Ensure output is stereo if requested
+    # AudioGen generates mono, MusicGen can generate stereo
+    if stereo and len(wav.shape) == 1:
+        # Duplicate mono to stereo
+        wav = np.stack([wav, wav], axis=1)
+    elif not stereo and len(wav.shape) == 2:
+        # Convert stereo to mono (average channels)
+        wav = wav.mean(axis=1)
+    
+    # AudioGen always outputs mono at 16kHz, so force mono if it's AudioGen
+    if is_audiogen and len(wav.shape) == 2:
+        # If somehow we got stereo from AudioGen, convert to mono
+        wav = wav.mean(axis=1) if wav.shape[1] == 2 else wav
+        # Then duplicate to stereo if requested
+        if stereo:
+            wav = np.stack([wav, wav], axis=1)
+    
+    return wav
+
+
+def _new_output_path() -> Path:
+    """Fresh WAV path in the staging area of the output storage"""
+    # Generate filename (MP3 is converted from the WAV afterwards)
+    file_id = str(uuid.uuid4())
+    return get_storage().staging_path(file_id, ".wav")
+
+
+def _save_wav(wav: np.ndarray, filepath: Path, sample_rate: int):
+    """Save (samples,) or (samples, channels) audio as WAV"""
+    # Save as WAV using torchaudio or scipy
+    try:
+        import torchaudio
+        # Convert to tensor with correct shape
+        if len(wav.shape) == 1:
+            wav_tensor = torch.from_numpy(wav).unsqueeze(0)  # (1, samples)
+        else:
+            wav_tensor = torch.from_numpy(wav).T  # (channels, samples)
+        
+        torchaudio.save(str(filepath), wav_tensor, sample_rate)
+        
+    except Exception as e:
+        logger.warning(f"torchaudio save failed: {e}, using scipy")
+        from scipy.io import wavfile
+        wavfile.write(str(filepath), sample_rate, wav)
+
+
+def _write_peaks(peaks: PeaksBuilder, filepath: Path):
+    """Store the waveform peaks/metadata sidecar; a failure never fails the generation"""
+    try:
+        write_sidecar(peaks.finish(), filepath)
+    except Exception as e:
+        logger.warning(f"Could not write peaks sidecar for {filepath.name}: {e}")
+
+
+def _finalize_format(filepath: Path) -> Path:
+    """Convert the WAV to the configured output format and commit it to storage, returns the final path"""
+    # Convert to MP3 if requested
+    if settings.audio_format == "mp3":
+        try:
+            from pydub import AudioSegment
+            mp3_path = filepath.with_suffix(".mp3")
+            audio = AudioSegment.from_wav(str(filepath))
+            audio.export(str(mp3_path), format="mp3")
+            os.remove(filepath)  # Remove WAV file
+            filepath = mp3_path
+            
+        except Exception as e:
+            logger.warning(f"MP3 conversion failed: {e}, keeping WAV")
+    
+    return get_storage().commit(filepath).path
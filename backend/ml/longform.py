@@ -0,0 +1,378 @@
+import logging
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+import numpy as np
+import torch
+from core.settings import settings
+from ml.peaks import PeaksBuilder
+from ml.sampling import restore_rng_state, rng_state
+
+logger = logging.getLogger(__name__)
+
+
+class WavAppender:
+    """WAV file written incrementally, one chunk at a time (float32 samples)"""
+
+    def __init__(self, path: Path, sample_rate: int, peaks: Optional[PeaksBuilder] = None):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.peaks = peaks
+        self.frames = 0
+        self._file = None
+
+    def write(self, wav: np.ndarray):
+        """Append (samples,) or (samples, channels) audio"""
+        if len(wav) == 0:
+            return
+        if self._file is None:
+            import soundfile as sf
+            channels = 1 if wav.ndim == 1 else wav.shape[1]
+            self._file = sf.SoundFile(
+                str(self.path), mode="w", samplerate=self.sample_rate,
+                channels=channels, format="WAV", subtype="FLOAT",
+            )
+        self._file.write(np.ascontiguousarray(wav, dtype=np.float32))
+        self.frames += len(wav)
+        if self.peaks is not None:
+            self.peaks.add(wav)
+
+    def resume(self, frames: int):
+        """Reopen a partially written file, dropping anything written after `frames`"""
+        import soundfile as sf
+        self._file = sf.SoundFile(str(self.path), mode="r+")
+        self._file.truncate(frames)
+        if self.peaks is not None:
+            self._file.seek(0)
+            for block in self._file.blocks(blocksize=1 << 16, dtype="float32", frames=frames):
+                self.peaks.add(block)
+        self._file.seek(0, sf.SEEK_END)
+        self.frames = frames
+
+    def flush(self):
+        """Write buffered frames and the header through to disk (libsndfile syncs the file)"""
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Checkpoint:
+    """
+    Resumable state of one long-form generation, saved between windows: frames
+    written, the held-back tail, the continuation context and the RNG state.
+    A restarted job resumes after its last checkpointed window.
+    """
+
+    def __init__(self, path: Path, interval: Optional[float] = None):
+        self.path = Path(path)
+        self.interval = settings.longform_checkpoint_interval if interval is None else interval
+        self._saved_at = time.monotonic()
+
+    def load(self, config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Saved state, None if there is none or it belongs to other settings"""
+        if not self.path.exists():
+            return None
+        try:
+            state = torch.load(self.path, weights_only=True)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable checkpoint {self.path}: {e}")
+            return None
+        if state.get("config") != config:
+            logger.info(f"Ignoring checkpoint {self.path.name}: generation settings changed")
+            return None
+        return state
+
+    def due(self) -> bool:
+        return time.monotonic() - self._saved_at >= self.interval
+
+    def save(self, state: Dict[str, Any]):
+        """Write atomically, so a crash mid-save leaves the previous checkpoint"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.parent / f"{self.path.name}.{os.getpid()}.tmp"
+        torch.save(state, tmp_path)
+        os.replace(tmp_path, self.path)
+        self._saved_at = time.monotonic()
+
+    def remove(self):
+        self.path.unlink(missing_ok=True)
+
+
+def crossfade(tail: np.ndarray, head: np.ndarray) -> np.ndarray:
+    """Linear crossfade from `tail` into `head` (both cover the same audio span)"""
+    n = min(len(tail), len(head))
+    fade = np.linspace(0.0, 1.0, n, dtype=np.float32)
+    if tail.ndim == 2:
+        fade = fade[:, None]
+    return tail[:n] * (1.0 - fade) + head[:n] * fade
+
+
+class _StitchStage(threading.Thread):
+    """
+    Consumer stage of the long-form pipeline: decodes each window, post-processes
+    it, crossfades it with the previous tail and appends it to the file, while
+    the producer samples the next window. The bounded queue caps how many
+    windows can be waiting in memory.
+    """
+
+    def __init__(
+        self,
+        decode: Callable[[torch.Tensor], torch.Tensor],
+        postprocess: Callable[[np.ndarray], np.ndarray],
+        out: WavAppender,
+        total: int,
+        overlap: int,
+        depth: int,
+        checkpoint: Optional[Checkpoint] = None,
+        config: Optional[Dict[str, Any]] = None,
+        pending: Optional[np.ndarray] = None,
+    ):
+        super().__init__(name="longform-stitch", daemon=True)
+        self.decode = decode
+        self.postprocess = postprocess
+        self.out = out
+        self.total = total
+        self.overlap = overlap
+        self.checkpoint = checkpoint
+        self.config = config
+        self.pending = pending
+        self.queue: queue.Queue = queue.Queue(maxsize=max(1, depth))
+        self.error: Optional[BaseException] = None
+
+    def run(self):
+        try:
+            pending = self.pending
+            while True:
+                item = self.queue.get()
+                if item is _DONE:
+                    break
+                item, resume_state = item
+                with torch.no_grad():
+                    wav = self.decode(item)
+                chunk = self.postprocess(wav[0].cpu().numpy())
+
+                if pending is not None:
+                    n = min(len(pending), len(chunk))
+                    chunk = np.concatenate([crossfade(pending[:n], chunk[:n]), chunk[n:]])
+
+                # Hold back the tail: the next window re-renders it
+                keep = max(0, len(chunk) - self.overlap)
+                self._write(chunk[:keep])
+                pending = chunk[keep:]
+
+                if self.checkpoint is not None and self.checkpoint.due():
+                    self.out.flush()
+                    self.checkpoint.save({
+                        **resume_state,
+                        "config": self.config,
+                        "frames": self.out.frames,
+                        "pending": torch.from_numpy(np.ascontiguousarray(pending)),
+                    })
+
+            if pending is not None:
+                self._write(pending)
+        except BaseException as e:
+            self.error = e
+
+    def _write(self, chunk: np.ndarray):
+        self.out.write(chunk[:max(0, self.total - self.out.frames)])
+
+    def submit(self, item: Any):
+        """Queue a (window, resume state) pair, blocking while the queue is full"""
+        while True:
+            if self.error is not None:
+                raise self.error
+            try:
+                self.queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def finish(self):
+        """Flush the remaining windows and wait for the stage to exit"""
+        self.submit(_DONE)
+        self.join()
+        if self.error is not None:
+            raise self.error
+
+    def abort(self):
+        """Stop without processing queued windows (producer failed)"""
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        try:
+            self.queue.put_nowait(_DONE)
+        except queue.Full:
+            pass
+        self.join(timeout=30)
+
+
+_DONE = object()
+
+
+def generate_long_form(
+    model: Any,
+    prompt: str,
+    duration: float,
+    set_duration: Callable[[float], Any],
+    sample_rate: int,
+    postprocess: Callable[[np.ndarray], np.ndarray],
+    output_path: Path,
+    progress_callback: Optional[Callable[[float, str], None]] = None,
+    peaks: Optional[PeaksBuilder] = None,
+    window: Optional[float] = None,
+    checkpoint: Optional[Checkpoint] = None,
+) -> int:
+    """
+    Generate `duration` seconds in overlapping windows.
+
+    Each window after the first continues from the tail of the previous one.
+    The continuation re-renders that tail, so the held-back tail of window N is
+    crossfaded with the head of window N+1 before being appended to the file.
+
+    When the model exposes token-level generation, windows continue from the
+    previous window's tokens, so sampling window N+1 does not wait for window N
+    to be decoded: decoding, post-processing and file writes run on a separate
+    stage thread. Otherwise windows continue from decoded audio.
+
+    `postprocess` maps a raw window (channels, samples) to the saved layout at
+    `sample_rate`. Peaks of the written audio are accumulated into `peaks`.
+    `window` overrides the configured window length (seconds).
+
+    With a `checkpoint`, the state after each written window is saved
+    periodically and an earlier run of the same generation is resumed from it.
+    A failure removes the checkpoint and the file; an interruption (anything
+    that is not an Exception, or the process dying) keeps both for the resume.
+    Returns the number of frames written.
+    """
+    model_rate = model.sample_rate
+    frame_rate = getattr(model, "frame_rate", None)
+    token_level = bool(frame_rate) and all(
+        hasattr(model, name)
+        for name in ("_prepare_tokens_and_attributes", "_generate_tokens", "generate_audio")
+    )
+
+    window = window or settings.longform_window
+    window = min(window, getattr(model, "max_duration", window))
+    # Continuation needs some context, and each window must add new audio
+    overlap = min(max(settings.longform_overlap, 0.5), window / 2)
+    if token_level:
+        context_len = int(overlap * frame_rate)
+        overlap = context_len / frame_rate
+    else:
+        context_len = int(overlap * model_rate)
+        overlap = context_len / model_rate
+
+    # A checkpoint only applies to the exact same windowing and output
+    config = {
+        "prompt": prompt,
+        "duration": float(duration),
+        "window": float(window),
+        "overlap": float(overlap),
+        "sample_rate": sample_rate,
+        "token_level": token_level,
+        "output": str(output_path),
+    }
+    resumed = None
+    if checkpoint is not None and Path(output_path).exists():
+        resumed = checkpoint.load(config)
+
+    out = WavAppender(output_path, sample_rate, peaks)
+    if resumed is not None:
+        out.resume(resumed["frames"])
+    stage = _StitchStage(
+        decode=model.generate_audio if token_level else (lambda wav: wav),
+        postprocess=postprocess,
+        out=out,
+        total=int(duration * sample_rate),
+        overlap=int(round(overlap * sample_rate)),
+        depth=settings.longform_pipeline_depth,
+        checkpoint=checkpoint,
+        config=config,
+        pending=resumed["pending"].numpy() if resumed is not None else None,
+    )
+    stage.start()
+
+    context: Optional[torch.Tensor] = None
+    attributes = None
+    produced = 0.0
+    window_index = 0
+    if resumed is not None:
+        context = resumed["context"].to(getattr(model, "device", "cpu"))
+        produced = resumed["produced"]
+        window_index = resumed["window_index"]
+        restore_rng_state(resumed["rng"])
+        logger.info(f"Resuming long-form generation after window {window_index} ({produced:.1f}/{duration}s)")
+
+    try:
+        while produced < duration:
+            window_index += 1
+            if progress_callback:
+                progress_callback(produced / duration, f"Generating window {window_index}...")
+
+            if context is None:
+                set_duration(min(window, duration))
+            else:
+                set_duration(min(window, overlap + duration - produced))
+            context_frames = 0 if context is None else context.shape[-1]
+
+            with torch.no_grad():
+                if token_level:
+                    if attributes is None:
+                        attributes, _ = model._prepare_tokens_and_attributes([prompt], None)
+                    window_out = model._generate_tokens(attributes, context, progress=False)
+                    added = (window_out.shape[-1] - context_frames) / frame_rate
+                elif context is None:
+                    window_out = model.generate(descriptions=[prompt], progress=False)[:1]
+                    added = window_out.shape[-1] / model_rate
+                else:
+                    window_out = model.generate_continuation(
+                        context, model_rate, descriptions=[prompt], progress=False
+                    )[:1]
+                    added = (window_out.shape[-1] - context_frames) / model_rate
+
+            context = window_out[..., -context_len:]
+            produced += max(added, 0.0)
+            resume_state = None
+            if checkpoint is not None:
+                resume_state = {
+                    "context": context.detach().cpu().clone(),
+                    "produced": produced,
+                    "window_index": window_index,
+                    "rng": rng_state(),
+                }
+            stage.submit((window_out, resume_state))
+
+            # A window that did not extend the audio would loop forever
+            if added <= 0:
+                break
+
+        stage.finish()
+        out.close()
+        if checkpoint is not None:
+            checkpoint.remove()
+        logger.info(f"Long-form generation: {window_index} windows, {out.frames} frames")
+        return out.frames
+
+    except BaseException as e:
+        stage.abort()
+        out.close()
+        if isinstance(e, Exception):
+            if checkpoint is not None:
+                checkpoint.remove()
+            Path(output_path).unlink(missing_ok=True)
+        raise
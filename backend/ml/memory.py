@@ -0,0 +1,351 @@
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import logging
+import os
+import threading
+import time
+import numpy as np
+from core.metrics import metrics
+from core.settings import settings
+
+logger = logging.getLogger(__name__)
+
+MiB = 1024 * 1024
+
+# Observations kept per key for the fit (oldest dropped first)
+MAX_OBSERVATIONS = 64
+# Safety margin applied to fitted estimates
+ESTIMATE_MARGIN = 1.2
+# Fallback prior when the model does not expose its transformer shape
+DEFAULT_PRIOR = (256 * MiB, 64 * MiB)
+
+_OOM_MARKERS = ("out of memory", "out_of_memory", "can't allocate memory")
+# Seconds between samples of the process RSS while a CPU generation runs
+RSS_SAMPLE_INTERVAL = 0.05
+
+
+def is_oom(error: BaseException) -> bool:
+    """Whether an exception is an out-of-memory failure on any device"""
+    if isinstance(error, MemoryError):
+        return True
+    try:
+        import torch
+        if isinstance(error, torch.cuda.OutOfMemoryError):
+            return True
+    except (ImportError, AttributeError):
+        pass
+    return isinstance(error, RuntimeError) and any(marker in str(error).lower() for marker in _OOM_MARKERS)
+
+
+def device_free_memory(device: Any) -> Optional[int]:
+    """Free bytes on the generation device, None when it cannot be measured"""
+    import torch
+
+    try:
+        if device.type == "cuda":
+            return torch.cuda.mem_get_info(device)[0]
+        if device.type == "xpu" and hasattr(torch, "xpu") and hasattr(torch.xpu, "mem_get_info"):
+            return torch.xpu.mem_get_info(device)[0]
+        if device.type == "cpu":
+            with open("/proc/meminfo") as f:
+                for line in f:
+                    if line.startswith("MemAvailable:"):
+                        return int(line.split()[1]) * 1024
+    except (OSError, RuntimeError, ValueError) as e:
+        logger.debug(f"Free memory unavailable on {device}: {e}")
+    return None
+
+
+def release_cached_memory(device: Any):
+    """Return cached allocator blocks after an OOM so the retry starts clean"""
+    import torch
+
+    if device.type == "cuda":
+        torch.cuda.empty_cache()
+    elif device.type == "xpu" and hasattr(torch, "xpu"):
+        torch.xpu.empty_cache()
+
+
+def memory_key(model_name: str, model: Any, device: Any) -> str:
+    """Estimates are learned per model, device type and precision"""
+    dtype = "float32"
+    lm = getattr(model, "lm", None)
+    if lm is not None:
+        try:
+            dtype = str(next(lm.parameters()).dtype).replace("torch.", "")
+        except (StopIteration, AttributeError, TypeError):
+            pass
+    return f"{model_name}:{device.type}:{dtype}"
+
+
+def prior_for(model: Any) -> Tuple[float, float]:
+    """
+    Rough (base, bytes per item-second) before anything was measured.
+    Derived from the KV cache of the language model (doubled for classifier-free
+    guidance), with room for activations and decoding.
+    """
+    lm = getattr(model, "lm", None)
+    try:
+        layers = len(lm.transformer.layers)
+        dim = lm.dim
+        itemsize = next(lm.parameters()).element_size()
+        frame_rate = model.frame_rate
+    except (AttributeError, TypeError, StopIteration):
+        return DEFAULT_PRIOR
+    kv_cache = frame_rate * 2 * layers * dim * itemsize * 2
+    return DEFAULT_PRIOR[0], 4 * kv_cache
+
+
+class MemoryModel:
+    """
+    Peak working memory (beyond the loaded weights) of one generate call,
+    modelled per key as base + slope * batch_size * duration.
+    Fitted to observed peaks and persisted, so estimates improve across restarts.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = Path(path) if path else None
+        self._observations: Dict[str, List[Tuple[float, float]]] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            data = json.loads(self.path.read_text())
+            self._observations = {
+                key: [tuple(point) for point in points] for key, points in data.get("models", {}).items()
+            }
+            logger.info(f"Loaded memory model for {len(self._observations)} configuration(s)")
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable memory model {self.path}: {e}")
+
+    def _save(self):
+        if self.path is None:
+            return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.parent / f"{self.path.name}.{os.getpid()}.tmp"
+            tmp_path.write_text(json.dumps({"version": 1, "models": self._observations}))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save memory model: {e}")
+
+    def fit(self, key: str) -> Optional[Tuple[float, float]]:
+        """Fitted (base, slope), None without observations"""
+        points = self._observations.get(key)
+        if not points:
+            return None
+        x = np.array([p[0] for p in points])
+        y = np.array([p[1] for p in points])
+        if len(set(x)) < 2:
+            return None
+        slope, base = np.polyfit(x, y, 1)
+        return max(base, 0.0), max(slope, 0.0)
+
+    def estimate(self, key: str, item_seconds: float, prior: Tuple[float, float]) -> int:
+        """Estimated peak bytes of a call generating `item_seconds` (batch size x duration)"""
+        with self._lock:
+            fitted = self.fit(key)
+            points = self._observations.get(key, [])
+        base, slope = fitted or prior
+        estimate = base + slope * item_seconds
+        if fitted is None and points:
+            # Too few distinct sizes to fit: scale the prior to the observations
+            scale = max(y / (prior[0] + prior[1] * x) for x, y in points)
+            estimate *= scale
+        # Never below what the same or a smaller call was seen to need
+        floor = max((y for x, y in points if x <= item_seconds), default=0.0)
+        return int(max(estimate * ESTIMATE_MARGIN, floor))
+
+    def observe(self, key: str, item_seconds: float, peak_bytes: float):
+        """Record a measured peak"""
+        with self._lock:
+            points = self._observations.setdefault(key, [])
+            points.append((float(item_seconds), float(peak_bytes)))
+            del points[:-MAX_OBSERVATIONS]
+            self._save()
+
+    def observe_oom(self, key: str, item_seconds: float, available_bytes: Optional[float], estimate: float):
+        """An OOM proves the call needed more than what was available"""
+        needed = max(available_bytes or 0.0, estimate) * 1.25
+        self.observe(key, item_seconds, needed)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            keys = list(self._observations)
+            fits = {key: self.fit(key) for key in keys}
+            counts = {key: len(self._observations[key]) for key in keys}
+        return {
+            key: {
+                "observations": counts[key],
+                "base_mb": round(fits[key][0] / MiB, 1) if fits[key] else None,
+                "mb_per_item_second": round(fits[key][1] / MiB, 2) if fits[key] else None,
+            }
+            for key in keys
+        }
+
+
+class Reservation:
+    """Memory reserved by one running generate call"""
+
+    def __init__(self, nbytes: int):
+        self.nbytes = nbytes
+        # Set when another call ran at the same time: the device-wide peak is then not ours alone
+        self.shared = False
+
+
+class MemoryAdmission:
+    """
+    Admits generate calls only when their estimated peak fits in free memory.
+    Memory reserved by running calls is subtracted from the free memory, so
+    concurrent generation slots do not all admit against the same headroom.
+    """
+
+    def __init__(self, model: MemoryModel):
+        self.model = model
+        self._active: List[Reservation] = []
+        self._cond = threading.Condition()
+
+    def _available(self, device: Any) -> Optional[float]:
+        free = device_free_memory(device)
+        if free is None:
+            return None
+        return free * settings.memory_headroom - sum(r.nbytes for r in self._active)
+
+    def fit_batch(self, key: str, device: Any, batch_size: int, duration: float, prior: Tuple[float, float]) -> int:
+        """
+        Largest number of items (up to `batch_size`) whose call fits now.
+        0 means a single item does not fit even on an idle device.
+        """
+        if not settings.memory_admission:
+            return batch_size
+        free = device_free_memory(device)
+        if free is None:
+            return batch_size
+        with self._cond:
+            busy = bool(self._active)
+        # Sized against memory free now; reserve() waits for running calls when needed
+        available = free * settings.memory_headroom
+        for size in range(batch_size, 0, -1):
+            if self.model.estimate(key, size * duration, prior) <= available:
+                return size
+        return 1 if busy else 0
+
+    @contextmanager
+    def reserve(self, device: Any, nbytes: int):
+        """Wait until `nbytes` fit (or nothing else runs), hold them while the call runs"""
+        reservation = Reservation(nbytes)
+        deadline = time.monotonic() + settings.memory_wait_timeout
+        with self._cond:
+            while settings.memory_admission and self._active:
+                available = self._available(device)
+                remaining = deadline - time.monotonic()
+                if available is None or nbytes <= available or remaining <= 0:
+                    break
+                metrics.incr("memory_admission_waits")
+                self._cond.wait(timeout=min(remaining, 5.0))
+            for other in self._active:
+                other.shared = True
+            reservation.shared = bool(self._active)
+            self._active.append(reservation)
+        try:
+            yield reservation
+        finally:
+            with self._cond:
+                self._active.remove(reservation)
+                self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            reserved = sum(r.nbytes for r in self._active)
+            running = len(self._active)
+        return {
+            "running": running,
+            "reserved_mb": round(reserved / MiB, 1),
+            "models": self.model.stats(),
+        }
+
+
+def process_rss() -> Optional[int]:
+    """Resident set size of this process, None where /proc is unavailable"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+@contextmanager
+def _sample_rss(result: Dict[str, Optional[int]]):
+    """Peak RSS growth of the enclosed block, sampled from a background thread"""
+    before = process_rss()
+    if before is None:
+        yield result
+        return
+    peak = [before]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(RSS_SAMPLE_INTERVAL):
+            peak[0] = max(peak[0], process_rss() or 0)
+
+    sampler = threading.Thread(target=sample, name="rss-sampler", daemon=True)
+    sampler.start()
+    try:
+        yield result
+    finally:
+        done.set()
+        sampler.join()
+        peak[0] = max(peak[0], process_rss() or 0)
+        # No growth says nothing: the block reused memory the process already held
+        result["bytes"] = peak[0] - before if peak[0] > before else None
+
+
+@contextmanager
+def measure_peak(device: Any):
+    """
+    Measure the peak allocation of the enclosed block, beyond what was already
+    allocated. Yields a dict whose "bytes" is set on exit (None if unsupported).
+    On the CPU this is the growth of the process RSS, sampled while the block
+    runs, so concurrent work in the process is counted too.
+    """
+    import torch
+
+    result: Dict[str, Optional[int]] = {"bytes": None}
+    backend = None
+    if device.type == "cuda":
+        backend = torch.cuda
+    elif device.type == "xpu" and hasattr(torch, "xpu") and hasattr(torch.xpu, "max_memory_allocated"):
+        backend = torch.xpu
+    elif device.type == "cpu":
+        with _sample_rss(result):
+            yield result
+        return
+
+    if backend is None:
+        yield result
+        return
+
+    before = backend.memory_allocated(device)
+    backend.reset_peak_memory_stats(device)
+    yield result
+    result["bytes"] = backend.max_memory_allocated(device) - before
+
+
+_admission: Optional[MemoryAdmission] = None
+_admission_lock = threading.Lock()
+
+
+def get_memory_admission() -> MemoryAdmission:
+    """Get (or lazily create) the process-wide admission controller"""
+    global _admission
+
+    with _admission_lock:
+        if _admission is None:
+            _admission = MemoryAdmission(MemoryModel(settings.memory_model_path))
+            metrics.register("memory", _admission.stats)
+        return _admission
@@ -1,8 +1,14 @@
+import copy
 import os
-import torch
 import logging
-from typing import Optional, Dict, Any
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, TYPE_CHECKING
 from core.settings import settings
+from ml.registry import registry
+
+if TYPE_CHECKING:
+    import torch
 
 # Configure Hugging Face token if available
 if settings.huggingface_token:
@@ -10,19 +16,23 @@ if settings.huggingface_token:
 
 logger = logging.getLogger(__name__)
 
-# Global model cache
-_model_cache: Dict[str, Any] = {}
-_device: Optional[torch.device] = None
+# Global model cache, least recently used first
+_model_cache: "OrderedDict[str, Any]" = OrderedDict()
+_model_lock = threading.Lock()  # guards the dicts; loads hold a per-model lock
+_load_locks: Dict[str, threading.Lock] = {}
+_device: Optional["torch.device"] = None
 
 
 
-def get_device() -> torch.device:
+def get_device() -> "torch.device":
     """Get the appropriate device (GPU or CPU)"""
     global _device
     
     if _device is not None:
         return _device
     
+    import torch
+    
     if settings.device == "cpu":
         _device = torch.device("cpu")
         logger.info("Using CPU device")
@@ -43,47 +53,108 @@ def get_device() -> torch.device:
     return _device
 
 
-def load_model(model_name: str, device: Optional[torch.device] = None) -> Any:
+def load_model(model_name: str, device: Optional["torch.device"] = None) -> Any:
     """
     Load an AudioCraft model with caching
     Supports: musicgen-small, musicgen-medium, audiogen-medium
+    
+    Up to `max_loaded_models` models stay loaded; the least recently used one is
+    evicted when another model is needed.
     """
     if device is None:
         device = get_device()
     
     cache_key = f"{model_name}:{device}"
     
-    if cache_key in _model_cache:
-        logger.info(f"Using cached model: {model_name}")
-        return _model_cache[cache_key]
+    with _model_lock:
+        if cache_key in _model_cache:
+            logger.info(f"Using cached model: {model_name}")
+            _model_cache.move_to_end(cache_key)
+            return _model_cache[cache_key]
+        load_lock = _load_locks.setdefault(cache_key, threading.Lock())
+    
+    # Loading takes minutes on CPU: only callers of the same model wait for it
+    with load_lock:
+        with _model_lock:
+            if cache_key in _model_cache:
+                _model_cache.move_to_end(cache_key)
+                return _model_cache[cache_key]
+        
+        model = _load_uncached(model_name, device)
+        
+        # Serve repeated prompts and reference melodies from the conditioning caches
+        from ml.conditioning import install_conditioning_cache
+        from ml.chroma import install_chroma_cache
+        install_conditioning_cache(model, model_name)
+        install_chroma_cache(model, model_name)
+        
+        # Cache the model
+        with _model_lock:
+            _model_cache[cache_key] = model
+            evicted = _evict_models()
+        logger.info(f"Model {model_name} loaded and cached")
+        if evicted:
+            _release_memory(device)
+        
+        return model
+
+
+def _evict_models() -> bool:
+    """Drop least recently used models beyond the cache budget (caller holds _model_lock)"""
+    evicted = False
+    while len(_model_cache) > max(1, settings.max_loaded_models):
+        cache_key, _ = _model_cache.popitem(last=False)
+        logger.info(f"Evicted model {cache_key} from the model cache")
+        evicted = True
+    return evicted
+
+
+def _release_memory(device: "torch.device"):
+    """Free the memory of evicted models"""
+    import gc
+    gc.collect()
+    if device.type == "cuda":
+        import torch
+        torch.cuda.empty_cache()
+
+
+def generation_view(model: Any) -> Any:
+    """
+    Per-call shallow copy of a cached model: set_generation_params rebinds
+    attributes of the copy only, the LM and compression weights stay shared
+    """
+    return copy.copy(model)
+
+
+def _load_uncached(model_name: str, device: "torch.device") -> Any:
+    """Load a model from its prepared artifact if there is one, else from Hugging Face"""
+    spec = registry.get(model_name)
     
     try:
         logger.info(f"Loading model: {model_name} on {device}")
         
-        if model_name.startswith("musicgen"):
+        if spec is None:
+            raise ValueError(f"Unknown model: {model_name}")
+        
+        pretrained_name = spec.pretrained
+        
+        # Prepared artifacts (python -m ml.artifacts convert) load via mmap
+        from ml.artifacts import ArtifactError, load_artifact, read_manifest
+        try:
+            if read_manifest(model_name) is not None:
+                return load_artifact(spec, device)
+        except ArtifactError as e:
+            logger.warning(f"Ignoring model artifact: {e}")
+        
+        if spec.family == "musicgen":
             from audiocraft.models import MusicGen
             
-            # Map model names to pretrained model identifiers
-            model_map = {
-                "musicgen-small": "facebook/musicgen-small",
-                "musicgen-medium": "facebook/musicgen-medium",
-                "musicgen-large": "facebook/musicgen-large",
-            }
-            
-            pretrained_name = model_map.get(model_name, "facebook/musicgen-small")
             model = MusicGen.get_pretrained(pretrained_name, device=device)
             
-        elif model_name.startswith("audiogen"):
+        elif spec.family == "audiogen":
             try:
                 from audiocraft.models import AudioGen
                 
-                model_map = {
-                    "audiogen-medium": "facebook/audiogen-medium",
-                    "audiogen-small": "facebook/audiogen-small",
-                }
-                
-                pretrained_name = model_map.get(model_name, "facebook/audiogen-medium")
-                
                 # Try loading model - first attempt without auth (may work if cached)
                 try:
                     # Try without forcing auth first - might work with local cache
@@ -135,10 +206,6 @@ def load_model(model_name: str, device: Optional[torch.device] = None) -> Any:
         else:
             raise ValueError(f"Unknown model: {model_name}")
         
-        # Cache the model
-        _model_cache[cache_key] = model
-        logger.info(f"Model {model_name} loaded and cached")
-        
         return model
     
     except Exception as e:
@@ -147,76 +214,5 @@ def load_model(model_name: str, device: Optional[torch.device] = None) -> Any:
 
 
 def get_available_models() -> list[Dict[str, Any]]:
-    """Get list of available models with metadata"""
-    device = get_device()
-    is_cuda = device.type == "cuda"
-    
-    models = [
-        {
-            "id": "musicgen-small",
-            "name": "MusicGen Small",
-            "type": "music",
-            "description": "Fast generation, low VRAM (~2GB)",
-            "supports_stereo": True,
-            "sample_rate": 32000,
-            "requires_gpu": False,
-        },
-        {
-            "id": "musicgen-medium",
-            "name": "MusicGen Medium",
-            "type": "music",
-            "description": "Better quality, higher VRAM (~4GB GPU recommended)",
-            "supports_stereo": True,
-            "sample_rate": 32000,
-            "requires_gpu": True,
-        },
-        {
-            "id": "musicgen-large",
-            "name": "MusicGen Large",
-            "type": "music",
-            "description": "Best quality, requires high VRAM (~8GB GPU recommended)",
-            "supports_stereo": True,
-            "sample_rate": 32000,
-            "requires_gpu": True,
-        },
-    ]
-    
-    # Try to add AudioGen if available
-    try:
-        from audiocraft.models import AudioGen
-        logger.info("AudioGen is available, adding models")
-        
-        models.append({
-            "id": "audiogen-small",
-            "name": "AudioGen Small (Raccomandato per CPU)",
-            "type": "sfx",
-            "description": "Sound effects (small, fast - 1-3 min for 10s on CPU)",
-            "supports_stereo": False,
-            "sample_rate": 16000,
-            "requires_gpu": False,
-        })
-        
-        models.append({
-            "id": "audiogen-medium",
-            "name": "AudioGen Medium",
-            "type": "sfx",
-            "description": "Sound effects and ambient audio (SLOW on CPU - 10-20+ min for 10s)",
-            "supports_stereo": False,
-            "sample_rate": 16000,
-            "requires_gpu": False,
-        })
-        logger.info(f"Successfully added {len([m for m in models if m['id'].startswith('audiogen')])} AudioGen model(s)")
-    except ImportError as e:
-        logger.warning(f"AudioGen not available (ImportError): {e}")
-        logger.info("This is normal if xformers is not properly configured")
-    except Exception as e:
-        logger.error(f"AudioGen not available (Error): {e}", exc_info=True)
-        logger.info("AudioGen models will not be shown in the UI")
-    
-    # Filter models based on device if needed
-    if not is_cuda:
-        # Still show but mark GPU requirement
-        pass
-    
-    return models
-
+    """Get list of available models with metadata (probed once, then cached)"""
+    return registry.available()
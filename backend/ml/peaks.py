@@ -0,0 +1,130 @@
+import base64
+import json
+import math
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import numpy as np
+
+# Finest level: one min/max pair per 256 samples (8 ms at 32 kHz); each coarser level halves it
+BASE_SAMPLES_PER_PEAK = 256
+PEAK_LEVELS = 6
+SIDECAR_SUFFIX = ".peaks.json"
+
+
+def _to_db(value: float) -> Optional[float]:
+    return round(20 * math.log10(value), 2) if value > 0 else None
+
+
+class PeaksBuilder:
+    """
+    Accumulates waveform peaks and loudness stats while audio is produced,
+    in one vectorized pass per chunk. Chunks of any size can be added.
+    """
+
+    def __init__(self, sample_rate: int, base: int = BASE_SAMPLES_PER_PEAK, levels: int = PEAK_LEVELS):
+        self.sample_rate = sample_rate
+        self.base = base
+        self.levels = levels
+        self.channels = 0
+        self.frames = 0
+        self._sum_squares = 0.0
+        self._peak = 0.0
+        self._mins: List[np.ndarray] = []
+        self._maxs: List[np.ndarray] = []
+        self._carry = np.zeros((0, 2), dtype=np.float32)  # (samples, [min, max]) not yet a full block
+
+    def add(self, wav: np.ndarray) -> "PeaksBuilder":
+        """Add (samples,) or (samples, channels) audio"""
+        if len(wav) == 0:
+            return self
+        wav = np.asarray(wav, dtype=np.float32)
+        if wav.ndim == 1:
+            wav = wav[:, None]
+        self.channels = wav.shape[1]
+        self.frames += len(wav)
+        self._sum_squares += float(np.square(wav, dtype=np.float64).sum())
+        self._peak = max(self._peak, float(np.abs(wav).max()))
+
+        # Channels are merged: the envelope covers the extremes of any channel
+        bounds = np.concatenate(
+            [self._carry, np.stack([wav.min(axis=1), wav.max(axis=1)], axis=1)]
+        )
+        full = len(bounds) - len(bounds) % self.base
+        blocks = bounds[:full].reshape(-1, self.base, 2)
+        self._mins.append(blocks[:, :, 0].min(axis=1))
+        self._maxs.append(blocks[:, :, 1].max(axis=1))
+        self._carry = bounds[full:]
+        return self
+
+    def finish(self) -> Dict[str, Any]:
+        """Metadata plus peak levels, quantized to int8 and base64 encoded"""
+        mins_parts, maxs_parts = list(self._mins), list(self._maxs)
+        if len(self._carry):
+            # Trailing partial block
+            mins_parts.append(self._carry[:, 0].min(keepdims=True))
+            maxs_parts.append(self._carry[:, 1].max(keepdims=True))
+        mins = np.concatenate(mins_parts) if mins_parts else np.zeros(0, np.float32)
+        maxs = np.concatenate(maxs_parts) if maxs_parts else np.zeros(0, np.float32)
+
+        levels = []
+        samples_per_peak = self.base
+        for _ in range(self.levels):
+            interleaved = np.empty(len(mins) * 2, dtype=np.int8)
+            interleaved[0::2] = np.clip(np.round(mins * 127), -127, 127)
+            interleaved[1::2] = np.clip(np.round(maxs * 127), -127, 127)
+            levels.append({
+                "samples_per_peak": samples_per_peak,
+                "length": len(mins),
+                "data": base64.b64encode(interleaved.tobytes()).decode("ascii"),
+            })
+            if len(mins) <= 1:
+                break
+            # Next level: pairwise reduction of this one
+            if len(mins) % 2:
+                mins = np.append(mins, mins[-1])
+                maxs = np.append(maxs, maxs[-1])
+            mins = mins.reshape(-1, 2).min(axis=1)
+            maxs = maxs.reshape(-1, 2).max(axis=1)
+            samples_per_peak *= 2
+
+        rms = math.sqrt(self._sum_squares / (self.frames * self.channels)) if self.frames else 0.0
+        return {
+            "version": 1,
+            "duration": self.frames / self.sample_rate,
+            "frames": self.frames,
+            "sample_rate": self.sample_rate,
+            "channels": self.channels,
+            "peak": round(self._peak, 6),
+            "peak_db": _to_db(self._peak),
+            "rms": round(rms, 6),
+            "rms_db": _to_db(rms),
+            "levels": levels,
+        }
+
+
+def sidecar_path(audio_path: Path) -> Path:
+    """Sidecar location for an audio file: <file_id>.peaks.json next to it"""
+    audio_path = Path(audio_path)
+    return audio_path.parent / f"{audio_path.stem}{SIDECAR_SUFFIX}"
+
+
+def write_sidecar(peaks: Dict[str, Any], audio_path: Path) -> Path:
+    """Write the sidecar atomically (readers never see a partial file)"""
+    path = sidecar_path(audio_path)
+    tmp_path = path.parent / f"{path.name}.{os.getpid()}.tmp"
+    tmp_path.write_text(json.dumps(peaks, separators=(",", ":")))
+    os.replace(tmp_path, path)
+    return path
+
+
+def select_level(peaks: Dict[str, Any], width: int) -> Dict[str, Any]:
+    """Coarsest level with at least `width` peaks (or the finest available), decoded"""
+    levels = peaks["levels"]
+    level = next((lvl for lvl in reversed(levels) if lvl["length"] >= width), levels[0])
+    data = np.frombuffer(base64.b64decode(level["data"]), dtype=np.int8)
+    return {
+        "samples_per_peak": level["samples_per_peak"],
+        "length": level["length"],
+        "peaks": data.tolist(),
+    }
@@ -0,0 +1,240 @@
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List, Optional
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """Static description of a servable model"""
+    id: str
+    name: str
+    type: str
+    description: str
+    family: str  # musicgen|audiogen
+    pretrained: str  # Hugging Face identifier
+    supports_stereo: bool
+    sample_rate: int
+    requires_gpu: bool
+    batch_size: int  # prompts per model.generate call in batch jobs
+    realtime_factor: float  # prior seconds of CPU compute per second of audio, refined by ml.routing
+    supports_melody: bool = False  # accepts a reference melody (chroma conditioning)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Public metadata exposed by /api/models"""
+        data = asdict(self)
+        del data["family"]
+        del data["pretrained"]
+        del data["realtime_factor"]
+        return data
+
+
+MODEL_SPECS: List[ModelSpec] = [
+    ModelSpec(
+        id="musicgen-small",
+        name="MusicGen Small",
+        type="music",
+        description="Fast generation, low VRAM (~2GB)",
+        family="musicgen",
+        pretrained="facebook/musicgen-small",
+        supports_stereo=True,
+        sample_rate=32000,
+        requires_gpu=False,
+        batch_size=8,
+        realtime_factor=2.0,
+    ),
+    ModelSpec(
+        id="musicgen-medium",
+        name="MusicGen Medium",
+        type="music",
+        description="Better quality, higher VRAM (~4GB GPU recommended)",
+        family="musicgen",
+        pretrained="facebook/musicgen-medium",
+        supports_stereo=True,
+        sample_rate=32000,
+        requires_gpu=True,
+        batch_size=4,
+        realtime_factor=6.0,
+    ),
+    ModelSpec(
+        id="musicgen-large",
+        name="MusicGen Large",
+        type="music",
+        description="Best quality, requires high VRAM (~8GB GPU recommended)",
+        family="musicgen",
+        pretrained="facebook/musicgen-large",
+        supports_stereo=True,
+        sample_rate=32000,
+        requires_gpu=True,
+        batch_size=2,
+        realtime_factor=15.0,
+    ),
+    ModelSpec(
+        id="musicgen-melody",
+        name="MusicGen Melody",
+        type="music",
+        description="Follows the melody of a reference track (~5GB GPU recommended)",
+        family="musicgen",
+        pretrained="facebook/musicgen-melody",
+        supports_stereo=True,
+        sample_rate=32000,
+        requires_gpu=True,
+        batch_size=4,
+        realtime_factor=8.0,
+        supports_melody=True,
+    ),
+    ModelSpec(
+        id="audiogen-small",
+        name="AudioGen Small (Raccomandato per CPU)",
+        type="sfx",
+        description="Sound effects (small, fast - 1-3 min for 10s on CPU)",
+        family="audiogen",
+        pretrained="facebook/audiogen-small",
+        supports_stereo=False,
+        sample_rate=16000,
+        requires_gpu=False,
+        batch_size=8,
+        realtime_factor=12.0,
+    ),
+    ModelSpec(
+        id="audiogen-medium",
+        name="AudioGen Medium",
+        type="sfx",
+        description="Sound effects and ambient audio (SLOW on CPU - 10-20+ min for 10s)",
+        family="audiogen",
+        pretrained="facebook/audiogen-medium",
+        supports_stereo=False,
+        sample_rate=16000,
+        requires_gpu=False,
+        batch_size=4,
+        realtime_factor=90.0,
+    ),
+]
+
+
+def _probe_audiogen() -> bool:
+    """AudioGen needs a working xformers install, check it can be imported"""
+    try:
+        from audiocraft.models import AudioGen  # noqa: F401
+        return True
+    except ImportError as e:
+        logger.warning(f"AudioGen not available (ImportError): {e}")
+        logger.info("This is normal if xformers is not properly configured")
+    except Exception as e:
+        logger.error(f"AudioGen not available (Error): {e}", exc_info=True)
+        logger.info("AudioGen models will not be shown in the UI")
+    return False
+
+
+def _probe_device() -> Dict[str, Any]:
+    """Describe the generation device (imports torch)"""
+    import torch
+    from ml.models import get_device
+
+    device = get_device()
+    info: Dict[str, Any] = {
+        "device": str(device),
+        "device_type": device.type,
+        "cuda_available": torch.cuda.is_available() if hasattr(torch, "cuda") else False,
+        "xpu_available": False,
+    }
+
+    try:
+        import intel_extension_for_pytorch as ipex
+        if device.type == "xpu":
+            info["xpu_available"] = True
+            info["xpu_device_name"] = ipex.xpu.get_device_name(0)
+            info["xpu_device_count"] = ipex.xpu.device_count()
+        else:
+            info["xpu_available"] = ipex.xpu.is_available() if hasattr(ipex, "xpu") else False
+    except (ImportError, OSError, Exception):
+        info["xpu_available"] = False
+
+    return info
+
+
+class ModelRegistry:
+    """
+    Registry of servable models.
+    Capabilities (which families import, which device is used) are probed once
+    and cached, so validation is a dict lookup.
+    """
+
+    def __init__(self, specs: List[ModelSpec]):
+        self.specs: Dict[str, ModelSpec] = {spec.id: spec for spec in specs}
+        self._available: Optional[Dict[str, ModelSpec]] = None
+        self._device_info: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._available is not None
+
+    def probe(self):
+        """Probe capabilities once; later calls return immediately"""
+        if self._available is not None:
+            return
+        with self._lock:
+            if self._available is not None:
+                return
+            start = time.monotonic()
+            self._device_info = _probe_device()
+            families = {"musicgen": True, "audiogen": _probe_audiogen()}
+            self._available = {
+                spec.id: spec for spec in self.specs.values() if families.get(spec.family)
+            }
+            logger.info(
+                f"Model registry ready in {time.monotonic() - start:.1f}s: "
+                f"{list(self._available)}"
+            )
+
+    async def wait_ready(self):
+        """
+        Probe from async code: the first probe imports torch and audiocraft, so it
+        runs in a thread instead of blocking the event loop (a request during
+        warm-up waits for the probe already in progress).
+        """
+        if not self.ready:
+            await asyncio.to_thread(self.probe)
+
+    def get(self, model_id: str) -> Optional[ModelSpec]:
+        """Spec for a known model id (available or not)"""
+        return self.specs.get(model_id)
+
+    def is_available(self, model_id: str) -> bool:
+        self.probe()
+        return model_id in self._available
+
+    def available(self) -> List[Dict[str, Any]]:
+        """Metadata of available models, in declaration order"""
+        self.probe()
+        return [spec.to_dict() for spec in self._available.values()]
+
+    def cheaper_variants(self, model_id: str) -> List[ModelSpec]:
+        """Available models of the same family, type and conditioning declared before `model_id`, cheapest last"""
+        spec = self.get(model_id)
+        if spec is None:
+            return []
+        self.probe()
+        variants = []
+        for other in self._available.values():
+            if other.id == model_id:
+                break
+            if (other.family, other.type, other.supports_melody) == (spec.family, spec.type, spec.supports_melody):
+                variants.append(other)
+        return variants[::-1]
+    
+    def available_ids(self) -> List[str]:
+        self.probe()
+        return list(self._available)
+
+    def device_info(self) -> Optional[Dict[str, Any]]:
+        """Cached device description, None until the registry has been probed"""
+        return self._device_info
+
+
+registry = ModelRegistry(MODEL_SPECS)
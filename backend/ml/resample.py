@@ -0,0 +1,35 @@
+import math
+from functools import lru_cache
+from typing import Any
+import torch
+from core.metrics import metrics
+
+
+@lru_cache(maxsize=32)
+def _resampler(old_sr: int, new_sr: int, device: str) -> Any:
+    """Polyphase resampler for a reduced rate ratio; filter kernels are built once per device"""
+    import julius
+    
+    return julius.ResampleFrac(old_sr, new_sr).to(device)
+
+
+def resample(wav: torch.Tensor, src_rate: int, dst_rate: int) -> torch.Tensor:
+    """
+    Resample audio of shape (..., samples) from src_rate to dst_rate.
+    All leading dims (batch, channels) are processed in one call.
+    """
+    if src_rate == dst_rate:
+        return wav
+    # 32000 -> 48000 and 16000 -> 24000 share the same 2:3 kernel
+    g = math.gcd(src_rate, dst_rate)
+    with torch.no_grad():
+        return _resampler(src_rate // g, dst_rate // g, str(wav.device))(wav.float())
+
+
+def resampler_cache_info() -> dict:
+    """Filter-kernel cache statistics"""
+    info = _resampler.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "kernels": info.currsize}
+
+
+metrics.register("resampler", resampler_cache_info)
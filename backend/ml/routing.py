@@ -0,0 +1,178 @@
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+import threading
+from core.metrics import metrics
+from core.settings import settings
+from ml.registry import registry
+
+logger = logging.getLogger(__name__)
+
+# Weight of the newest observation in the throughput averages
+EWMA_ALPHA = 0.3
+# Assumed speedup of accelerators over the CPU priors, until measured
+ACCELERATOR_SPEEDUP = 10.0
+# Guidance scale at which classifier-free guidance has no effect
+CFG_OFF = 1.0
+
+
+class ThroughputTracker:
+    """
+    Exponentially weighted realtime factor (compute seconds per audio second)
+    per (model, guidance on/off), learned from finished jobs.
+    """
+
+    def __init__(self):
+        self._rtf: Dict[Tuple[str, bool], float] = {}
+        self._samples: Dict[Tuple[str, bool], int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, model: str, cfg_coef: float, audio_seconds: float, elapsed: float):
+        if audio_seconds <= 0:
+            return
+        key = (model, cfg_coef != CFG_OFF)
+        rtf = elapsed / audio_seconds
+        with self._lock:
+            previous = self._rtf.get(key)
+            self._rtf[key] = rtf if previous is None else EWMA_ALPHA * rtf + (1 - EWMA_ALPHA) * previous
+            self._samples[key] = self._samples.get(key, 0) + 1
+
+    def realtime_factor(self, model: str, cfg_coef: float, accelerated: bool = False) -> float:
+        """
+        Learned factor, or the model's prior.
+        Disabling guidance is not assumed to be faster (AudioCraft still runs the
+        unconditional branch), so a guidance-off estimate starts from the
+        guidance-on one until it has been measured.
+        """
+        with self._lock:
+            learned = self._rtf.get((model, cfg_coef != CFG_OFF))
+            if learned is None:
+                learned = self._rtf.get((model, True))
+        if learned is not None:
+            return learned
+        spec = registry.get(model)
+        prior = spec.realtime_factor if spec else 1.0
+        return prior / ACCELERATOR_SPEEDUP if accelerated else prior
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                f"{model}:{'cfg' if cfg else 'nocfg'}": {
+                    "realtime_factor": round(rtf, 3),
+                    "samples": self._samples[(model, cfg)],
+                }
+                for (model, cfg), rtf in self._rtf.items()
+            }
+
+
+throughput = ThroughputTracker()
+metrics.register("throughput", throughput.stats)
+
+
+def _options(params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Candidate settings from the requested quality down to the cheapest.
+    Guidance is kept: AudioCraft still runs the unconditional branch at
+    CFG_OFF, so turning it off would lose quality without saving time.
+    """
+    requested = {
+        "model": params["model"],
+        "cfg_coef": params.get("cfg_coef", 3.0),
+        "duration": params.get("duration", 10),
+    }
+    options = [requested]
+    for spec in registry.cheaper_variants(requested["model"]):
+        options.append({**requested, "model": spec.id})
+    cheapest = options[-1]
+    shortest = max(1, int(requested["duration"] * settings.degrade_min_duration_ratio))
+    if shortest < requested["duration"]:
+        options.append({**cheapest, "duration": shortest})
+    return options
+
+
+def estimate_seconds(
+    params: Dict[str, Any],
+    queued: int,
+    workers: int,
+    accelerated: bool = False,
+) -> float:
+    """
+    Time to get through a job and the queue ahead of it if every job ran at
+    its settings: runtime * (1 + queued / workers). Each variation counts as a
+    take of its own (batched takes share little besides conditioning).
+    """
+    rtf = throughput.realtime_factor(params["model"], params.get("cfg_coef", 3.0), accelerated)
+    audio_seconds = params.get("duration", 10) * params.get("num_variations", 1)
+    return rtf * audio_seconds * (1 + queued / max(1, workers))
+
+
+def cheapest_estimate(
+    params: Dict[str, Any],
+    queued: int,
+    workers: int,
+    accelerated: bool = False,
+) -> float:
+    """Estimate of the cheapest option a degradable job may be routed to"""
+    takes = params.get("num_variations", 1)
+    return min(
+        estimate_seconds({**option, "num_variations": takes}, queued, workers, accelerated)
+        for option in _options(params)
+    )
+
+
+def plan_route(
+    params: Dict[str, Any],
+    queued: int,
+    workers: int,
+    accelerated: bool = False,
+    target: Optional[float] = None,
+    deadline: Optional[float] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Pick the best quality whose load fits the latency target.
+
+    The load of an option is its estimate_seconds(). Options are tried from
+    the requested quality down (cheaper model, then shorter duration);
+    the first one within `target` (default DEGRADE_TARGET_SECONDS) wins, or the
+    cheapest when none is. A shortened take keeps the longest duration that
+    fits, down to DEGRADE_MIN_DURATION_RATIO of the request.
+
+    With a `deadline` (seconds left), an option must also finish in time on
+    its own: the jobs queued behind a running job cannot delay it.
+
+    Returns the routing record when the job is degraded, None when it runs as requested.
+    """
+    options = _options(params)
+    if target is None:
+        target = settings.degrade_target_seconds
+
+    def load(option: Dict[str, Any]) -> float:
+        return estimate_seconds(option, queued, workers, accelerated)
+
+    def runtime(option: Dict[str, Any]) -> float:
+        return estimate_seconds(option, 0, workers, accelerated)
+
+    def fits(option: Dict[str, Any]) -> bool:
+        return load(option) <= target and (deadline is None or runtime(option) <= deadline)
+
+    chosen = next((option for option in options if fits(option)), None)
+    if chosen is None:
+        chosen = min(options, key=load)
+    elif chosen["duration"] < options[0]["duration"]:
+        # Only a shorter take fits: keep as much of the requested length as the limits allow
+        longest = int(target / load({**chosen, "duration": 1}))
+        if deadline is not None:
+            longest = min(longest, int(deadline / runtime({**chosen, "duration": 1})))
+        longest = min(options[0]["duration"] - 1, longest)
+        chosen = {**chosen, "duration": max(chosen["duration"], longest)}
+    if chosen == options[0]:
+        return None
+
+    metrics.incr("degraded_jobs")
+    return {
+        "requested": options[0],
+        "used": chosen,
+        "queued": queued,
+        "requested_load_seconds": round(load(options[0]), 1),
+        "used_load_seconds": round(load(chosen), 1),
+        **({"deadline_seconds": round(deadline, 1)} if deadline is not None else {}),
+    }
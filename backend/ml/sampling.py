@@ -0,0 +1,118 @@
+import logging
+import random
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Seeds of the batch being sampled on the current thread (None = shared global RNG)
+_local = threading.local()
+_install_lock = threading.Lock()
+_installed: Optional[bool] = None
+
+
+def random_seed() -> int:
+    """Fresh seed for a take that did not request one"""
+    return random.SystemRandom().randrange(2**32)
+
+
+class _PerItemRNG:
+    """One torch.Generator per batch item, created lazily on the sampling device"""
+
+    def __init__(self, seeds: List[int]):
+        self.seeds = seeds
+        self._generators: Dict[Any, List[Any]] = {}
+
+    def generators(self, device: Any) -> List[Any]:
+        import torch
+
+        if device not in self._generators:
+            self._generators[device] = [
+                torch.Generator(device=device).manual_seed(seed) for seed in self.seeds
+            ]
+        return self._generators[device]
+
+
+def _install() -> bool:
+    """
+    Route audiocraft's token sampling through per-item generators.
+    sample_top_k/sample_top_p/multinomial all call audiocraft.utils.utils.multinomial,
+    so patching that one function covers every sampling mode.
+    """
+    global _installed
+
+    with _install_lock:
+        if _installed is not None:
+            return _installed
+        try:
+            import torch
+            from audiocraft.utils import utils
+        except ImportError as e:
+            logger.warning(f"Per-item seeding unavailable: {e}")
+            _installed = False
+            return _installed
+
+        original = utils.multinomial
+
+        def multinomial(input: "torch.Tensor", num_samples: int, replacement: bool = False, *, generator=None):
+            rng: Optional[_PerItemRNG] = getattr(_local, "rng", None)
+            # Only the generation batch dimension is split; anything else uses the shared RNG
+            if rng is None or generator is not None or input.dim() < 2 or input.shape[0] != len(rng.seeds):
+                return original(input, num_samples, replacement=replacement, generator=generator)
+            return torch.stack([
+                original(row, num_samples, replacement=replacement, generator=item_generator)
+                for row, item_generator in zip(input, rng.generators(input.device))
+            ])
+
+        utils.multinomial = multinomial
+        _installed = True
+        return _installed
+
+
+@contextmanager
+def per_item_seeds(seeds: List[int]):
+    """
+    Sample each batch item from its own RNG seeded with seeds[i], so a take is
+    reproducible from its seed whether it was generated alone or in a batch.
+    """
+    if not _install():
+        yield
+        return
+
+    previous = getattr(_local, "rng", None)
+    _local.rng = _PerItemRNG(seeds)
+    try:
+        yield
+    finally:
+        _local.rng = previous
+
+
+def rng_state() -> Dict[str, Any]:
+    """Snapshot of the global and per-item RNGs of the current thread, to resume sampling later"""
+    import torch
+
+    state: Dict[str, Any] = {"cpu": torch.get_rng_state(), "items": {}}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    rng: Optional[_PerItemRNG] = getattr(_local, "rng", None)
+    if rng is not None:
+        state["items"] = {
+            str(device): [generator.get_state() for generator in generators]
+            for device, generators in rng._generators.items()
+        }
+    return state
+
+
+def restore_rng_state(state: Dict[str, Any]):
+    """Restore a snapshot taken by rng_state (inside the same per_item_seeds context)"""
+    import torch
+
+    torch.set_rng_state(state["cpu"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+    rng: Optional[_PerItemRNG] = getattr(_local, "rng", None)
+    if rng is not None:
+        for device, states in state["items"].items():
+            for generator, item_state in zip(rng.generators(torch.device(device)), states):
+                generator.set_state(item_state)
@@ -0,0 +1,146 @@
+"""
+Semantic cache of generated clips: near-duplicate prompts reuse a previous result.
+
+Prompts are embedded with the model's own T5 text conditioner (mean of the
+projected token embeddings, L2-normalized) and compared by cosine similarity
+against earlier results made with the same model, duration, sampling settings,
+output format and melody.
+Only requests without an explicit seed that opt in with allow_similar are served.
+"""
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Tuple
+import logging
+import threading
+import numpy as np
+from core.metrics import metrics
+from core.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Parameters a cached clip must share with the request it serves
+PARTITION_PARAMS = (
+    "model", "duration", "cfg_coef", "temperature", "top_k", "top_p", "long_form",
+    "stereo", "sample_rate", "format", "melody_id",
+)
+# Similarity histogram: best match of each lookup, in this many buckets over [0, 1]
+HISTOGRAM_BUCKETS = 20
+
+
+def partition_key(params: Dict[str, Any]) -> Tuple:
+    return tuple(params.get(name) for name in PARTITION_PARAMS)
+
+
+def embed_prompt(model_name: str, prompt: str) -> Optional[np.ndarray]:
+    """Unit-length prompt embedding from the model's text conditioner, None if it has none"""
+    import torch
+    from ml.conditioning import normalize_prompt
+    from ml.models import load_model
+
+    model = load_model(model_name)
+    conditioner = model.lm.condition_provider.conditioners.get("description")
+    if conditioner is None:
+        return None
+    # Case carries no meaning for matching; the conditioning cache makes repeats free
+    text = normalize_prompt(prompt).lower()
+    with torch.no_grad():
+        embeds, mask = conditioner(conditioner.tokenize([text]))
+    tokens = embeds[0][mask[0].bool()].float()
+    vector = tokens.mean(dim=0).cpu().numpy()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else None
+
+
+class SemanticCache:
+    """
+    In-process vector index of generated clips, one matrix per partition
+    (PARTITION_PARAMS). Bounded by `max_entries`, oldest dropped first.
+    """
+
+    def __init__(self, threshold: float, max_entries: int):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._vectors: Dict[Tuple, np.ndarray] = {}
+        self._entries: Dict[Tuple, List[Dict[str, Any]]] = {}
+        self._order: Deque[Tuple] = deque()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._histogram: Dict[str, int] = {}
+
+    def lookup(self, params: Dict[str, Any], vector: np.ndarray) -> Optional[Dict[str, Any]]:
+        """Most similar earlier clip above the threshold, or None"""
+        partition = partition_key(params)
+        with self._lock:
+            while True:
+                matrix = self._vectors.get(partition)
+                if matrix is None or not len(matrix):
+                    best, entry = None, None
+                    break
+                scores = matrix @ vector
+                index = int(np.argmax(scores))
+                best, entry = float(scores[index]), self._entries[partition][index]
+                if Path(entry["path"]).exists():
+                    break
+                # Result file was removed: forget it and look again
+                self._remove(partition, index)
+
+            if best is not None:
+                bucket = min(int(max(best, 0.0) * HISTOGRAM_BUCKETS + 1e-9), HISTOGRAM_BUCKETS - 1)
+                label = f"{bucket / HISTOGRAM_BUCKETS:.2f}"
+                self._histogram[label] = self._histogram.get(label, 0) + 1
+            if best is None or best < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return {**entry, "similarity": round(best, 4)}
+
+    def add(self, params: Dict[str, Any], vector: np.ndarray, path: str):
+        """Index a finished clip"""
+        partition = partition_key(params)
+        entry = {"path": str(path), "prompt": params["prompt"], "seed": params.get("seed")}
+        with self._lock:
+            matrix = self._vectors.get(partition)
+            row = vector[np.newaxis, :].astype(np.float32)
+            self._vectors[partition] = row if matrix is None else np.vstack([matrix, row])
+            self._entries.setdefault(partition, []).append(entry)
+            self._order.append(partition)
+            while len(self._order) > self.max_entries:
+                # Entries of a partition are in insertion order, so its oldest is first
+                self._remove(self._order.popleft(), 0, ordered=False)
+
+    def _remove(self, partition: Tuple, index: int, ordered: bool = True):
+        self._vectors[partition] = np.delete(self._vectors[partition], index, axis=0)
+        del self._entries[partition][index]
+        if ordered:
+            # Drop one bookkeeping slot of the partition so sizes stay in step
+            self._order.remove(partition)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._order),
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "similarity_histogram": dict(sorted(self._histogram.items())),
+            }
+
+
+_cache: Optional[SemanticCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_semantic_cache() -> Optional[SemanticCache]:
+    """Process-wide semantic cache, None when disabled"""
+    global _cache
+
+    if not settings.semantic_cache_enabled:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = SemanticCache(settings.semantic_cache_threshold, settings.semantic_cache_max_entries)
+            metrics.register("semantic_cache", _cache.stats)
+        return _cache
@@ -0,0 +1,80 @@
+import json
+import pytest
+import torch
+from ml import artifacts, models
+from ml.artifacts import ArtifactError, verify
+
+
+def test_verify_detects_corruption(tmp_path, monkeypatch):
+    """Test artifacts are checked against the manifest checksums"""
+    monkeypatch.setattr(artifacts.settings, "artifacts_dir", str(tmp_path))
+    directory = tmp_path / "musicgen-small"
+    directory.mkdir()
+    (directory / "lm.safetensors").write_bytes(b"weights")
+    manifest = {
+        "format_version": artifacts.FORMAT_VERSION,
+        "pretrained": "facebook/musicgen-small",
+        "files": {
+            "lm.safetensors": {"size": 7, "sha256": artifacts._sha256(directory / "lm.safetensors")},
+        },
+    }
+    (directory / "manifest.json").write_text(json.dumps(manifest))
+    assert verify("musicgen-small")["pretrained"] == "facebook/musicgen-small"
+    
+    (directory / "lm.safetensors").write_bytes(b"WEIGHTS")
+    verify("musicgen-small", full=False)
+    with pytest.raises(ArtifactError, match="checksum"):
+        verify("musicgen-small")
+    
+    with pytest.raises(ArtifactError, match="not converted"):
+        verify("musicgen-large")
+
+
+def test_model_cache_evicts_least_recently_used(monkeypatch):
+    """Test only max_loaded_models stay loaded, evicting the least recently used"""
+    loads = []
+    monkeypatch.setattr(models, "_model_cache", type(models._model_cache)())
+    monkeypatch.setattr(models, "_load_uncached", lambda name, device: loads.append(name) or object())
+    monkeypatch.setattr(models.settings, "max_loaded_models", 2)
+    monkeypatch.setattr("ml.conditioning.install_conditioning_cache", lambda model, name: None)
+    cpu = torch.device("cpu")
+    
+    for name in ["musicgen-small", "musicgen-medium", "musicgen-small", "musicgen-large", "musicgen-small"]:
+        models.load_model(name, cpu)
+    
+    assert loads == ["musicgen-small", "musicgen-medium", "musicgen-large"]
+    assert list(models._model_cache) == ["musicgen-large:cpu", "musicgen-small:cpu"]
+
+
+def test_model_load_does_not_block_other_models(monkeypatch):
+    """Test a slow load only holds up callers of the same model"""
+    import threading
+    release = threading.Event()
+    loads = []
+    
+    def load_uncached(name, device):
+        loads.append(name)
+        if name == "musicgen-large":
+            release.wait(5)
+        return object()
+    
+    monkeypatch.setattr(models, "_model_cache", type(models._model_cache)())
+    monkeypatch.setattr(models, "_load_uncached", load_uncached)
+    monkeypatch.setattr(models.settings, "max_loaded_models", 2)
+    monkeypatch.setattr("ml.conditioning.install_conditioning_cache", lambda model, name: None)
+    cpu = torch.device("cpu")
+    small = models.load_model("musicgen-small", cpu)
+    
+    results = []
+    loaders = [threading.Thread(target=lambda: results.append(models.load_model("musicgen-large", cpu))) for _ in range(2)]
+    for thread in loaders:
+        thread.start()
+    # Cache hits are answered while the other model is still loading
+    assert models.load_model("musicgen-small", cpu) is small
+    assert not results
+    
+    release.set()
+    for thread in loaders:
+        thread.join(5)
+    assert results[0] is results[1]
+    assert loads == ["musicgen-small", "musicgen-large"]
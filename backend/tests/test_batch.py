@@ -0,0 +1,53 @@
+from fastapi.testclient import TestClient
+from app import app
+from ml.batch import plan_batches
+
+client = TestClient(app)
+
+
+def test_plan_batches_groups_by_params():
+    """Test items are grouped by shared params and split to the model batch size"""
+    items = [{"model": "musicgen-large", "prompt": f"p{i}", "duration": 5} for i in range(5)]
+    items.append({"model": "musicgen-large", "prompt": "long", "duration": 10})
+    assert plan_batches(items) == [[0, 1], [2, 3], [4], [5]]
+
+
+def test_create_batch_job():
+    """Test a batch request creates one job with one item per prompt"""
+    response = client.post(
+        "/api/generate/batch",
+        json={
+            "model": "musicgen-small",
+            "duration": 2,
+            "items": [{"prompt": "rain"}, {"prompt": "thunder", "duration": 3}],
+        },
+    )
+    assert response.status_code == 201
+    data = response.json()
+    assert data["items"] == 2
+    
+    job = client.get(f"/api/jobs/{data['job_id']}").json()
+    assert [item["prompt"] for item in job["items"]] == ["rain", "thunder"]
+    assert [item["params"]["duration"] for item in job["items"]] == [2, 3]
+
+
+def test_batch_items_are_validated():
+    """Test per-item overrides go through the same validation as single requests"""
+    response = client.post(
+        "/api/generate/batch",
+        json={"items": [{"prompt": "rain", "duration": 10_000}]},
+    )
+    assert response.status_code == 422
+
+
+def test_create_variations_job():
+    """Test variations become one job with one reproducible seed per take"""
+    response = client.post(
+        "/api/generate",
+        json={"prompt": "lofi beat", "duration": 2, "num_variations": 3, "seed": 10},
+    )
+    assert response.status_code == 201
+    
+    job = client.get(f"/api/jobs/{response.json()['job_id']}").json()
+    assert [item["seed"] for item in job["items"]] == [10, 11, 12]
+    assert all(item["params"]["seed"] == item["seed"] for item in job["items"])
@@ -0,0 +1,93 @@
+import os
+import pytest
+import torch
+from torch import nn
+from ml.conditioning import ConditioningCache, _wrap_text_conditioner
+
+
+class FakeTextConditioner(nn.Module):
+    """Minimal stand-in for audiocraft's T5Conditioner: one token per word"""
+    
+    t5_tokenizer = None
+    
+    def __init__(self, dim: int = 4):
+        super().__init__()
+        self.output_proj = nn.Linear(dim, dim)
+        self.dim = dim
+        self.encoded = 0
+    
+    def tokenize(self, x):
+        entries = [xi if xi is not None else "" for xi in x]
+        length = max(1, max(len(e.split()) for e in entries))
+        mask = torch.zeros(len(entries), length, dtype=torch.long)
+        ids = torch.zeros(len(entries), length, dtype=torch.long)
+        for i, entry in enumerate(entries):
+            for j, word in enumerate(entry.split()):
+                mask[i, j] = 1
+                ids[i, j] = sum(map(ord, word))
+        return {"input_ids": ids, "attention_mask": mask}
+    
+    def forward(self, inputs):
+        self.encoded += inputs["input_ids"].shape[0]
+        mask = inputs["attention_mask"]
+        embeds = inputs["input_ids"].float().unsqueeze(-1).expand(-1, -1, self.dim)
+        return embeds * mask.unsqueeze(-1), mask
+
+
+def test_cached_embeddings_match_uncached():
+    """Test cached conditioning is identical to the uncached path"""
+    prompts = ["lofi hip hop beat", "rain", None]
+    reference = FakeTextConditioner()
+    expected, expected_mask = reference(reference.tokenize(prompts))
+    
+    conditioner = FakeTextConditioner()
+    _wrap_text_conditioner(conditioner, ConditioningCache(1 << 20), "test", "description")
+    for _ in range(2):
+        embeds, mask = conditioner(conditioner.tokenize(prompts))
+        assert torch.equal(embeds, expected)
+        assert torch.equal(mask, expected_mask)
+    
+    # Second pass was served entirely from the cache
+    assert conditioner.encoded == 3
+
+
+def test_shared_prompts_encode_once():
+    """Test duplicate and whitespace-variant prompts in a batch are encoded once"""
+    cache = ConditioningCache(1 << 20)
+    conditioner = FakeTextConditioner()
+    _wrap_text_conditioner(conditioner, cache, "test", "description")
+    conditioner(conditioner.tokenize(["ambient pads", "ambient  pads ", "ambient pads"]))
+    assert conditioner.encoded == 1
+    assert cache.stats()["entries"] == 1
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    """Test the memory cap evicts old entries and disk copies are reloaded"""
+    entry = torch.ones(4, 4)
+    cache = ConditioningCache(max_bytes=entry.numel() * entry.element_size() * 2, cache_dir=str(tmp_path))
+    for name in ["a", "b", "c"]:
+        cache.put(("m", "description", name), entry)
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["evictions"] == 1
+    
+    assert torch.equal(cache.get(("m", "description", "a")), entry)
+    assert cache.stats()["disk_hits"] == 1
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/maps"), reason="needs /proc/self/maps")
+def test_disk_entries_stay_memory_mapped(tmp_path):
+    """Test an entry read back from disk points into the file mapping, not a private copy"""
+    entry = torch.arange(16.0).reshape(4, 4)
+    ConditioningCache(1 << 20, cache_dir=str(tmp_path)).put(("m", "description", "a"), entry)
+    
+    loaded = ConditioningCache(1 << 20, cache_dir=str(tmp_path)).get(("m", "description", "a"))
+    assert torch.equal(loaded, entry)
+    
+    path = str(next(tmp_path.glob("*.npy")))
+    with open("/proc/self/maps") as f:
+        ranges = [
+            [int(address, 16) for address in line.split()[0].split("-")]
+            for line in f
+            if line.rstrip().endswith(path)
+        ]
+    assert any(start <= loaded.data_ptr() < end for start, end in ranges)
@@ -0,0 +1,31 @@
+from core.executor import parse_cpulist, plan_cpu_slots
+
+
+def test_parse_cpulist():
+    """Test parsing kernel cpulist ranges"""
+    assert parse_cpulist("0-3,8,10-11\n") == [0, 1, 2, 3, 8, 10, 11]
+
+
+def test_plan_splits_cores_evenly():
+    """Test 64 cores split into four 16-thread slots"""
+    plan = plan_cpu_slots(list(range(64)), threads_per_slot=16)
+    assert plan.size == 4
+    assert all(slot.threads == 16 for slot in plan.slots)
+    assigned = [cpu for slot in plan.slots for cpu in slot.cpus]
+    assert sorted(assigned) == list(range(64))
+
+
+def test_plan_keeps_slots_within_numa_nodes():
+    """Test slots never straddle NUMA nodes when nodes are large enough"""
+    numa = {0: list(range(0, 32)), 1: list(range(32, 64))}
+    plan = plan_cpu_slots(list(range(64)), slots=4, numa=numa)
+    for slot in plan.slots:
+        assert slot.numa_node is not None
+        assert set(slot.cpus) <= set(numa[slot.numa_node])
+
+
+def test_plan_oversubscribed_shares_cores():
+    """Test asking for more threads than cores still yields every slot"""
+    plan = plan_cpu_slots(list(range(4)), slots=3, threads_per_slot=2)
+    assert plan.size == 3
+    assert all(len(slot.cpus) == 2 for slot in plan.slots)
@@ -0,0 +1,110 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from app import app
+from core.jobs import JobManager, JobStatus, job_manager
+from core.metrics import metrics
+from core.store import SQLiteJobStore
+from ml import routing
+from ml.routing import ThroughputTracker
+
+client = TestClient(app)
+
+
+def test_generate_rejects_jobs_that_cannot_meet_their_deadline(monkeypatch):
+    """Test the submit-time estimate turns away hopeless jobs, judging degradable ones on their cheapest option"""
+    monkeypatch.setattr(routing, "throughput", ThroughputTracker())
+    monkeypatch.setattr(routing.settings, "degrade_enabled", True)
+    monkeypatch.setattr(job_manager.store, "count", lambda status: 0)
+    rejected = metrics.snapshot()["counters"].get("deadline_rejected", 0)
+    
+    # musicgen-small prior: 2 s/s, so 10 s of audio takes ~20 s; a 5 s take ~10 s
+    body = {"prompt": "rush hour", "model": "musicgen-small", "duration": 10, "deadline": 15}
+    response = client.post("/api/generate", json=body)
+    assert response.status_code == 503
+    assert "deadline" in response.json()["detail"]
+    assert metrics.snapshot()["counters"]["deadline_rejected"] == rejected + 1
+    
+    response = client.post("/api/generate", json={**body, "allow_degrade": True})
+    assert response.status_code == 201
+    job = job_manager.get_job(response.json()["job_id"])
+    assert job.deadline_at is not None
+    assert (job.deadline_at - job.created_at).total_seconds() == 15
+    
+    assert client.post("/api/generate", json={**body, "deadline": 0}).status_code == 422
+    
+    # Every variation is generated, and variations are never degraded
+    variations = {**body, "duration": 5, "num_variations": 2, "allow_degrade": True}
+    assert client.post("/api/generate", json={**variations, "deadline": 15}).status_code == 503
+    assert client.post("/api/generate", json={**variations, "deadline": 25}).status_code == 201
+
+
+def test_queued_jobs_expire_without_running():
+    """Test a job whose deadline passed in the queue is expired on claim, and late completions are counted"""
+    manager = JobManager()
+    ran = []
+    
+    async def process(job, progress_callback):
+        ran.append(job.params["prompt"])
+        await asyncio.sleep(0.2)
+        return f"/api/files/{job.params['prompt']}.wav"
+    
+    async def wait_final(job_id):
+        for _ in range(100):
+            job = manager.get_job(job_id)
+            if job.status not in (JobStatus.QUEUED, JobStatus.RUNNING):
+                return job
+            await asyncio.sleep(0.02)
+        raise AssertionError("job did not finish")
+    
+    async def run():
+        stale = manager.create_job({"prompt": "stale", "deadline": 0.01})
+        late = manager.create_job({"prompt": "late", "deadline": 0.1})
+        on_time = manager.create_job({"prompt": "on-time", "deadline": 60})
+        await asyncio.sleep(0.02)
+        manager.start_worker(process, workers=1)
+        return [await wait_final(job.job_id) for job in (stale, late, on_time)]
+    
+    counters = metrics.snapshot()["counters"]
+    expired_before = counters.get("deadline_expired", 0)
+    missed_before = counters.get("deadline_missed", 0)
+    
+    stale, late, on_time = asyncio.run(run())
+    assert stale.status == JobStatus.EXPIRED
+    assert stale.started_at is None and stale.error
+    assert late.status == on_time.status == JobStatus.DONE
+    assert ran == ["late", "on-time"]
+    
+    counters = metrics.snapshot()["counters"]
+    assert counters["deadline_expired"] == expired_before + 1
+    assert counters["deadline_missed"] == missed_before + 1
+
+
+@pytest.mark.parametrize("sqlite", [False, True])
+def test_overdue_jobs_are_swept_while_workers_are_busy(tmp_path, monkeypatch, sqlite):
+    """Test queued jobs past their deadline are expired without waiting for a free worker"""
+    monkeypatch.setattr("core.jobs.settings.job_poll_interval", 0.05)
+    manager = JobManager(store=SQLiteJobStore(tmp_path / "jobs.sqlite")) if sqlite else JobManager()
+    release = asyncio.Event()
+    
+    async def process(job, progress_callback):
+        await release.wait()
+        return "/api/files/busy.wav"
+    
+    async def run():
+        manager.start_worker(process, workers=1)
+        busy = manager.create_job({"prompt": "busy"})
+        overdue = manager.create_job({"prompt": "overdue", "deadline": 0.05})
+        for _ in range(100):
+            if manager.get_job(overdue.job_id).status == JobStatus.EXPIRED:
+                break
+            await asyncio.sleep(0.02)
+        states = manager.get_job(busy.job_id).status, manager.get_job(overdue.job_id), manager.store.count(JobStatus.QUEUED)
+        release.set()
+        await asyncio.sleep(0.05)
+        return states
+    
+    busy, overdue, queued = asyncio.run(run())
+    assert busy == JobStatus.RUNNING
+    assert overdue.status == JobStatus.EXPIRED and overdue.started_at is None
+    assert queued == 0
@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+from fastapi.testclient import TestClient
+from app import app
+from core.jobs import JobManager, JobStatus
+
+client = TestClient(app)
+
+
+def test_list_jobs_filters_and_pages():
+    """Test filtered listing walks the indexes newest first across pages"""
+    manager = JobManager()
+    jobs = [
+        manager.create_job({"model": "musicgen-small" if i % 2 else "audiogen-small"}, client_key="a" if i < 6 else "b")
+        for i in range(10)
+    ]
+    jobs[5].status = JobStatus.DONE
+    manager.update_job(jobs[5])
+    jobs[1].status = JobStatus.DONE
+    manager.update_job(jobs[1])
+    
+    page, cursor = manager.list_jobs(client_key="a", limit=4)
+    assert [job.seq for job in page] == [6, 5, 4, 3]
+    page, cursor = manager.list_jobs(client_key="a", cursor=cursor, limit=4)
+    assert [job.seq for job in page] == [2, 1]
+    assert cursor is None
+    
+    page, _ = manager.list_jobs(client_key="a", status=JobStatus.DONE)
+    assert [job.job_id for job in page] == [jobs[5].job_id, jobs[1].job_id]
+    page, _ = manager.list_jobs(status=JobStatus.QUEUED, model="musicgen-small")
+    assert [job.seq for job in page] == [10, 8, 4]
+    
+    future = datetime.now() + timedelta(hours=1)
+    assert manager.list_jobs(since=future) == ([], None)
+    assert len(manager.list_jobs(until=future, limit=100)[0]) == 10
+
+
+def test_list_jobs_endpoint_uses_client_key():
+    """Test the history endpoint is scoped to the X-Client-Key header"""
+    headers = {"X-Client-Key": "history-test"}
+    ids = [
+        client.post("/api/generate", json={"prompt": f"take {i}", "duration": 2}, headers=headers).json()["job_id"]
+        for i in range(3)
+    ]
+    
+    data = client.get("/api/jobs", params={"limit": 2}, headers=headers).json()
+    assert [job["job_id"] for job in data["jobs"]] == ids[:0:-1]
+    data = client.get("/api/jobs", params={"limit": 2, "cursor": data["next_cursor"]}, headers=headers).json()
+    assert [job["job_id"] for job in data["jobs"]] == ids[:1]
+    assert data["next_cursor"] is None
+    
+    assert client.get("/api/jobs", headers={"X-Client-Key": "someone-else"}).json()["jobs"] == []
+    # Another client cannot ask for this client's history
+    other = client.get("/api/jobs", params={"client_key": "history-test"}, headers={"X-Client-Key": "someone-else"})
+    assert other.json()["jobs"] == []
@@ -0,0 +1,130 @@
+import asyncio
+import os
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from core.jobs import JobManager, JobStatus
+from core.store import SQLiteJobStore, worker_id
+
+
+def test_sqlite_store_is_shared(tmp_path):
+    """Test jobs created by one process are visible to, and claimed once by, others"""
+    path = tmp_path / "jobs.sqlite"
+    api = JobManager(store=SQLiteJobStore(path))
+    worker_stores = [SQLiteJobStore(path) for _ in range(4)]
+    
+    ids = [
+        api.create_job({"model": "musicgen-small", "prompt": f"p{i}"}, client_key="c").job_id
+        for i in range(20)
+    ]
+    
+    def drain(store):
+        claimed = []
+        while (job := store.claim()) is not None:
+            claimed.append(job.job_id)
+        return claimed
+    
+    with ThreadPoolExecutor(4) as pool:
+        claimed = [job_id for batch in pool.map(drain, worker_stores) for job_id in batch]
+    assert sorted(claimed) == sorted(ids)
+    
+    job = api.get_job(ids[0])
+    assert job.status == JobStatus.RUNNING
+    assert job.started_at is not None
+    
+    page, cursor = api.list_jobs(client_key="c", status=JobStatus.RUNNING, limit=15)
+    assert [job.job_id for job in page] == ids[:4:-1]
+    page, cursor = api.list_jobs(client_key="c", cursor=cursor, limit=15)
+    assert [job.job_id for job in page] == ids[4::-1]
+    assert cursor is None
+
+
+def test_worker_runs_jobs_from_another_process(tmp_path, monkeypatch):
+    """Test a worker polling the shared store completes jobs created elsewhere"""
+    from core import jobs
+    monkeypatch.setattr(jobs.settings, "job_poll_interval", 0.05)
+    path = tmp_path / "jobs.sqlite"
+    api = JobManager(store=SQLiteJobStore(path))
+    worker = JobManager(store=SQLiteJobStore(path))
+    
+    async def process(job, progress_callback):
+        progress_callback(50, "half way")
+        return f"/api/files/{job.params['prompt']}.wav"
+    
+    async def run():
+        worker.start_worker(process, workers=2)
+        job_id = api.create_job({"prompt": "rain"}).job_id
+        for _ in range(100):
+            job = api.get_job(job_id)
+            if job.status == JobStatus.DONE:
+                return job
+            await asyncio.sleep(0.02)
+    
+    job = asyncio.run(run())
+    assert job is not None
+    assert job.result_url == "/api/files/rain.wav"
+    assert job.message == "half way"
+
+
+def test_interrupted_jobs_are_requeued(tmp_path):
+    """Test running jobs of a dead worker go back to the head of the queue, live ones stay"""
+    path = tmp_path / "jobs.sqlite"
+    manager = JobManager(store=SQLiteJobStore(path))
+    first, second = (manager.create_job({"prompt": p}) for p in ("a", "b"))
+    manager.create_job({"prompt": "c"})
+    
+    dead = manager.store.claim()
+    dead.worker = f"{socket.gethostname()}:{os.getpid()}:0ld"  # previous process with this pid
+    manager.store.save(dead)
+    alive = manager.store.claim()
+    assert alive.worker == worker_id()
+    
+    # A restarted worker recovers the orphan only
+    restarted = JobManager(store=SQLiteJobStore(path))
+    assert [job.job_id for job in restarted.recover_interrupted()] == [first.job_id]
+    assert restarted.get_job(second.job_id).status == JobStatus.RUNNING
+    job = restarted.store.claim()
+    assert job.job_id == first.job_id and job.worker == worker_id()
+
+
+def test_jobs_of_another_host_are_requeued_when_their_lease_expires(tmp_path):
+    """Test a job claimed on a host that is gone is recovered once its lease is not renewed"""
+    import time
+    path = tmp_path / "jobs.sqlite"
+    manager = JobManager(store=SQLiteJobStore(path))
+    job = manager.create_job({"prompt": "a"})
+    
+    claimed = manager.store.claim()
+    claimed.worker = "old-container:1:token"  # other hosts always look alive
+    manager.store.save(claimed)
+    assert manager.recover_interrupted() == []
+    
+    # Renewed leases keep the job; one older than the lease period releases it
+    manager.store.heartbeat([job.job_id])
+    assert manager.store.requeue_orphans(lambda orphan: False, stale_before=time.time() - 60) == []
+    recovered = manager.store.requeue_orphans(lambda orphan: False, stale_before=time.time() + 1)
+    assert [orphan.job_id for orphan in recovered] == [job.job_id]
+    assert manager.get_job(job.job_id).status == JobStatus.QUEUED
+    assert manager.store.claim().job_id == job.job_id
+
+
+def test_updates_of_a_lost_claim_are_dropped(tmp_path):
+    """Test a worker whose lease expired cannot overwrite the requeued or reclaimed job"""
+    import time
+    store = SQLiteJobStore(tmp_path / "jobs.sqlite")
+    manager = JobManager(store=store)
+    job = manager.create_job({"prompt": "a"})
+    
+    stale = store.claim()
+    store.requeue_orphans(lambda orphan: False, stale_before=time.time() + 1)
+    stale.progress = 50
+    manager.update_job(stale)
+    assert manager.get_job(job.job_id).status == JobStatus.QUEUED
+    
+    current = store.claim()
+    stale.status = JobStatus.DONE
+    manager.update_job(stale)
+    current.progress = 10
+    manager.update_job(current)
+    saved = manager.get_job(job.job_id)
+    assert saved.status == JobStatus.RUNNING and saved.progress == 10
+    assert store.requeue_orphans(lambda orphan: False, stale_before=time.time() - 60) == []
@@ -0,0 +1,91 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import httpx
+from app import app
+from core.jobs import job_manager, JobStatus
+from core.store import SQLiteJobStore
+from ml.registry import registry
+
+
+def finish_later(job, delay: float, progress: int = 100):
+    """Update a job from another thread, like a generation callback does"""
+    def update():
+        job.progress = progress
+        if progress == 100:
+            job.status = JobStatus.DONE
+        job_manager.update_job(job)
+    threading.Timer(delay, update).start()
+
+
+async def request(method: str, url: str, **kwargs) -> httpx.Response:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await client.request(method, url, **kwargs)
+
+
+def test_long_poll_returns_on_change():
+    """Test a waiting request returns as soon as the job changes"""
+    job = job_manager.create_job({"prompt": "rain"})
+    
+    async def run():
+        finish_later(job, 0.2, progress=40)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        response = await request("GET", f"/api/jobs/{job.job_id}", params={"wait": 10})
+        return response.json(), loop.time() - start
+    
+    data, elapsed = asyncio.run(run())
+    assert data["progress"] == 40
+    assert data["version"] == 1
+    assert elapsed < 5
+    
+    # An outdated version returns immediately
+    response = asyncio.run(
+        asyncio.wait_for(request("GET", f"/api/jobs/{job.job_id}", params={"wait": 10, "version": 0}), 5)
+    )
+    assert response.json()["version"] == 1
+
+
+def test_events_multiplexes_jobs():
+    """Test one stream carries updates of several jobs and ends when all are done"""
+    jobs = [job_manager.create_job({"prompt": f"take {i}"}) for i in range(3)]
+    ids = ",".join([job.job_id for job in jobs] + ["missing"])
+    
+    async def run():
+        for i, job in enumerate(jobs):
+            finish_later(job, 0.1 * (i + 1))
+        return await asyncio.wait_for(request("GET", "/api/jobs/events", params={"ids": ids}), 10)
+    
+    response = asyncio.run(run())
+    events = [
+        (block.split("\r\n")[0], json.loads(block.split("\r\n")[1][len("data: "):]))
+        for block in response.text.split("\r\n\r\n") if block.startswith("event:")
+    ]
+    assert events[0] == ("event: error", {"job_id": "missing", "error": "Job not found"})
+    finals = [data["job_id"] for name, data in events if data.get("status") == "done"]
+    assert finals == [job.job_id for job in jobs]
+
+
+def test_requests_are_served_while_the_store_is_locked(tmp_path, monkeypatch):
+    """Test a job submission waiting on a held write lock does not block other requests"""
+    path = tmp_path / "jobs.sqlite"
+    monkeypatch.setattr(job_manager, "store", SQLiteJobStore(path))
+    job = job_manager.create_job({"prompt": "rain"})
+    writer = sqlite3.connect(path, isolation_level=None)
+    writer.execute("BEGIN IMMEDIATE")
+    
+    async def run():
+        await registry.wait_ready()
+        submit = asyncio.create_task(request("POST", "/api/generate", json={"prompt": "thunder", "duration": 2}))
+        await asyncio.sleep(0.2)
+        status = await asyncio.wait_for(request("GET", f"/api/jobs/{job.job_id}"), 5)
+        assert not submit.done()
+        writer.execute("COMMIT")
+        return status, await asyncio.wait_for(submit, 5)
+    
+    status, submitted = asyncio.run(run())
+    writer.close()
+    assert status.json()["status"] == JobStatus.QUEUED
+    assert submitted.status_code == 201
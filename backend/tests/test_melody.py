@@ -0,0 +1,88 @@
+import io
+from typing import Any, List, NamedTuple
+import numpy as np
+import soundfile as sf
+import torch
+from fastapi.testclient import TestClient
+from app import app
+from core.settings import settings
+from ml.chroma import ChromaCache, _wrap_chroma_conditioner
+
+client = TestClient(app)
+
+
+def _wav_bytes(seconds=1.0, rate=16000):
+    buffer = io.BytesIO()
+    t = np.arange(int(seconds * rate)) / rate
+    sf.write(buffer, np.sin(2 * np.pi * 440 * t).astype(np.float32), rate, format="WAV")
+    return buffer.getvalue()
+
+
+def test_melody_upload_is_content_addressed(tmp_path, monkeypatch):
+    """Test the same track maps to one stored melody, and bad uploads are rejected"""
+    monkeypatch.setattr(settings, "melody_dir", str(tmp_path))
+    data = _wav_bytes()
+    
+    first = client.post("/api/melodies", files={"file": ("a.wav", data, "audio/wav")})
+    assert first.status_code == 201
+    assert first.json()["duration"] == 1.0
+    again = client.post("/api/melodies", files={"file": ("b.wav", data, "audio/wav")})
+    assert again.status_code == 200
+    assert again.json()["melody_id"] == first.json()["melody_id"]
+    assert len(list(tmp_path.iterdir())) == 1
+    
+    assert client.post("/api/melodies", files={"file": ("x.wav", b"not audio", "audio/wav")}).status_code == 400
+    monkeypatch.setattr(settings, "melody_max_duration", 0.5)
+    assert client.post("/api/melodies", files={"file": ("c.wav", _wav_bytes(2.0), "audio/wav")}).status_code == 400
+    monkeypatch.setattr(settings, "melody_max_mb", 0)
+    response = client.post("/api/melodies", files={"file": ("d.wav", _wav_bytes(0.2), "audio/wav")})
+    assert response.status_code == 400 and "MB" in response.json()["detail"]
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_generate_validates_melody(tmp_path, monkeypatch):
+    """Test melodies are only accepted by melody models and must have been uploaded"""
+    monkeypatch.setattr(settings, "melody_dir", str(tmp_path))
+    melody_id = client.post("/api/melodies", files={"file": ("a.wav", _wav_bytes(), "audio/wav")}).json()["melody_id"]
+    body = {"prompt": "piano", "duration": 5, "melody_id": melody_id}
+    headers = {"X-Client-Key": "melody-test"}
+    
+    assert client.post("/api/generate", json={**body, "model": "musicgen-small"}, headers=headers).status_code == 400
+    assert client.post("/api/generate", json={**body, "model": "musicgen-melody", "melody_id": "0" * 64}, headers=headers).status_code == 400
+    assert client.post("/api/generate", json={**body, "model": "musicgen-melody", "long_form": True}, headers=headers).status_code == 422
+    assert client.post("/api/generate", json={**body, "model": "musicgen-melody"}, headers=headers).status_code == 201
+
+
+class WavCondition(NamedTuple):
+    wav: torch.Tensor
+    length: torch.Tensor
+    sample_rate: List[int]
+    path: List[Any]
+
+
+class FakeChroma:
+    def __init__(self):
+        self.analysed = 0
+    
+    def _get_wav_embedding(self, x):
+        self.analysed += x.wav.shape[0]
+        return x.wav.mean(dim=1, keepdim=True).transpose(1, 2).repeat(1, 1, 12)
+
+
+def test_chroma_features_are_computed_once_per_reference(tmp_path):
+    """Test features are cached per waveform, across batches and cache instances"""
+    melody = torch.randn(1, 1, 800)
+    other = torch.randn(1, 1, 800)
+    batch = WavCondition(torch.cat([melody, other, melody]), torch.tensor([800] * 3), [32000] * 3, [None] * 3)
+    
+    conditioner = FakeChroma()
+    expected = FakeChroma()._get_wav_embedding(batch)
+    _wrap_chroma_conditioner(conditioner, ChromaCache(8, str(tmp_path)), "musicgen-melody")
+    torch.testing.assert_close(conditioner._get_wav_embedding(batch), expected)
+    assert conditioner.analysed == 2
+    
+    # A new process reads the features back from disk
+    restarted = FakeChroma()
+    _wrap_chroma_conditioner(restarted, ChromaCache(8, str(tmp_path)), "musicgen-melody")
+    torch.testing.assert_close(restarted._get_wav_embedding(batch), expected)
+    assert restarted.analysed == 0
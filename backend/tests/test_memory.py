@@ -0,0 +1,123 @@
+import threading
+import time
+import pytest
+import soundfile as sf
+import torch
+from ml import generate, memory
+from ml.memory import MemoryAdmission, MemoryModel, MiB, measure_peak
+
+
+class FlakyModel:
+    """Runs out of memory above `max_batch` prompts, otherwise returns silence"""
+    
+    sample_rate = 1000
+    max_duration = 30
+    
+    def __init__(self, max_batch: int):
+        self.max_batch = max_batch
+        self.duration = 0.0
+        self.batches = []
+    
+    def set_generation_params(self, duration, **kwargs):
+        self.duration = duration
+    
+    def generate(self, descriptions, progress=False):
+        self.batches.append(len(descriptions))
+        if len(descriptions) > self.max_batch:
+            raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+        return torch.zeros(len(descriptions), 1, int(self.duration * self.sample_rate))
+
+
+def test_memory_model_learns_and_persists(tmp_path):
+    """Test estimates follow observed peaks and survive a reload"""
+    path = tmp_path / "memory.json"
+    model = MemoryModel(str(path))
+    prior = (100 * MiB, 10 * MiB)
+    assert model.estimate("m", 10, prior) == int(200 * MiB * 1.2)
+    
+    model.observe("m", 10, 300 * MiB)
+    model.observe("m", 20, 500 * MiB)
+    assert abs(MemoryModel(str(path)).estimate("m", 40, prior) - 900 * MiB * 1.2) < MiB
+
+
+def test_admission_splits_batches_to_free_memory(monkeypatch):
+    """Test the batch is sized to what fits, and 0 when one item cannot fit"""
+    admission = MemoryAdmission(MemoryModel())
+    monkeypatch.setattr(memory, "device_free_memory", lambda device: 1000 * MiB)
+    prior = (100 * MiB, 10 * MiB)
+    cpu = torch.device("cpu")
+    
+    # (100 + 10 * 6 items * 10 s) x 1.2 margin = 840 MiB fits in 90% of 1000 MiB
+    assert admission.fit_batch("m", cpu, 8, 10, prior) == 6
+    assert admission.fit_batch("m", cpu, 8, 100, prior) == 0
+
+
+@pytest.mark.skipif(memory.process_rss() is None, reason="needs /proc/self/statm")
+def test_cpu_peak_follows_process_memory():
+    """Test CPU generations are measured from the process RSS, so the model learns from successes"""
+    with measure_peak(torch.device("cpu")) as peak:
+        block = torch.ones(64 * MiB // 4)
+        time.sleep(0.2)
+        del block
+    assert peak["bytes"] >= 48 * MiB
+
+
+def test_oom_splits_batch(tmp_path, monkeypatch):
+    """Test an OOM retries in halves instead of failing the job"""
+    model = FlakyModel(max_batch=2)
+    monkeypatch.setattr(generate, "load_model", lambda name, device: model)
+    monkeypatch.setattr(generate, "get_device", lambda: torch.device("cpu"))
+    monkeypatch.setattr(generate, "get_memory_admission", lambda: MemoryAdmission(MemoryModel()))
+    monkeypatch.setattr(generate.settings, "output_dir", str(tmp_path))
+    monkeypatch.setattr(memory, "device_free_memory", lambda device: None)
+    
+    paths = generate.generate_batch(
+        model_name="musicgen-small",
+        prompts=[f"p{i}" for i in range(5)],
+        duration=1,
+        seeds=[1, 2, 3, 4, 5],
+        stereo=False,
+        sample_rate=16000,
+    )
+    assert len(paths) == 5
+    assert model.batches == [5, 2, 3, 1, 2]
+
+
+class SlowModel(FlakyModel):
+    """Waits for `peers` concurrent generate calls before returning"""
+    
+    def __init__(self, peers: int):
+        super().__init__(max_batch=1)
+        self.barrier = threading.Barrier(peers, timeout=5)
+    
+    def generate(self, descriptions, progress=False):
+        self.barrier.wait()
+        return super().generate(descriptions, progress)
+
+
+def test_slots_sharing_a_model_overlap(tmp_path, monkeypatch):
+    """Test concurrent generations on one model run together, each with its own duration"""
+    model = SlowModel(peers=2)
+    monkeypatch.setattr(generate, "load_model", lambda name, device: model)
+    monkeypatch.setattr(generate, "get_device", lambda: torch.device("cpu"))
+    monkeypatch.setattr(generate, "get_memory_admission", lambda: MemoryAdmission(MemoryModel()))
+    monkeypatch.setattr(generate.settings, "output_dir", str(tmp_path))
+    monkeypatch.setattr(memory, "device_free_memory", lambda device: None)
+    
+    results = {}
+    
+    def run(duration):
+        results[duration] = generate.generate_audio(
+            model_name="musicgen-small", prompt="p", duration=duration, seed=1, stereo=False, sample_rate=16000
+        )
+    
+    threads = [threading.Thread(target=run, args=(duration,)) for duration in (1, 2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    # Both calls had to be inside generate at once to pass the barrier
+    assert not model.barrier.broken and set(results) == {1, 2}
+    assert model.duration == 0.0
+    assert {duration: sf.info(path).duration for duration, path in results.items()} == {1: 1.0, 2: 2.0}
@@ -0,0 +1,53 @@
+import numpy as np
+from fastapi.testclient import TestClient
+from app import app
+from core.settings import settings
+from core.storage import get_storage
+from ml.peaks import PeaksBuilder, select_level, write_sidecar
+
+client = TestClient(app)
+
+
+def test_chunked_peaks_match_single_pass():
+    """Test peaks are identical however the audio is chunked"""
+    rng = np.random.default_rng(0)
+    wav = rng.uniform(-0.5, 0.5, size=(32000 * 3, 2)).astype(np.float32)
+    
+    whole = PeaksBuilder(32000).add(wav).finish()
+    chunked = PeaksBuilder(32000)
+    for start in range(0, len(wav), 7777):
+        chunked.add(wav[start:start + 7777])
+    assert chunked.finish() == whole
+    
+    assert whole["duration"] == 3.0
+    assert whole["channels"] == 2
+    assert [level["length"] for level in whole["levels"]] == [375, 188, 94, 47, 24, 12]
+
+
+def test_peaks_endpoint(tmp_path, monkeypatch):
+    """Test the sidecar is served whole or at the requested resolution"""
+    monkeypatch.setattr(settings, "output_dir", str(tmp_path))
+    wav = np.sin(np.linspace(0, 200 * np.pi, 16000)).astype(np.float32)
+    take = get_storage().staging_path("take")
+    take.write_bytes(b"")
+    write_sidecar(PeaksBuilder(16000).add(wav).finish(), take)
+    get_storage().commit(take)
+    
+    response = client.get("/api/files/take.wav/peaks")
+    assert response.status_code == 200
+    assert response.json()["sample_rate"] == 16000
+    assert "immutable" in response.headers["cache-control"]
+    
+    response = client.get("/api/files/take/peaks", params={"width": 20})
+    data = response.json()
+    assert data["length"] >= 20
+    assert len(data["peaks"]) == 2 * data["length"]
+    assert max(data["peaks"]) == 127
+    
+    assert client.get("/api/files/missing/peaks").status_code == 404
+
+
+def test_select_level_falls_back_to_finest():
+    """Test a width wider than any level returns the finest one"""
+    peaks = PeaksBuilder(16000).add(np.zeros(1000, dtype=np.float32)).finish()
+    assert select_level(peaks, 10000)["samples_per_peak"] == 256
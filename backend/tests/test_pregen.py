@@ -0,0 +1,82 @@
+from fastapi.testclient import TestClient
+from app import app
+from core import pregen
+from core.jobs import JobStatus, job_manager
+from core.pregen import PregenPool, pregen_key
+from core.storage import get_storage
+
+client = TestClient(app)
+
+
+def _params(**overrides):
+    params = {
+        "prompt": "Lo-fi  hip hop beat", "model": pregen.settings.model_default, "duration": 8,
+        "seed": None, "temperature": 1.0, "top_k": 250, "top_p": 0.0, "cfg_coef": 3.0,
+        "stereo": True, "sample_rate": 32000, "format": "wav", "long_form": False, "num_variations": 1,
+    }
+    return {**params, **overrides}
+
+
+def _take(pool, key, name, size=1000, seed=7):
+    path = get_storage().staging_path(name.split(".")[0])
+    path.write_bytes(b"\0" * size)
+    pool.add(key, get_storage().commit(path).path, seed)
+
+
+def test_pregen_key_eligibility():
+    """Test only seedless single takes of the default model share a pool key"""
+    key = pregen_key(_params())
+    assert key == pregen_key(_params(prompt="lo-fi hip HOP beat ", seed=-1))
+    assert key != pregen_key(_params(duration=9))
+    assert pregen_key(_params(seed=3)) is None
+    assert pregen_key(_params(num_variations=2)) is None
+    assert pregen_key(_params(long_form=True)) is None
+    assert pregen_key(_params(model="not-the-default")) is None
+
+
+def test_pool_targets_take_and_budget(tmp_path, monkeypatch):
+    """Test popular prompts become targets, takes are served once and the budget evicts the least popular"""
+    monkeypatch.setattr(pregen.settings, "output_dir", str(tmp_path / "out"))
+    monkeypatch.setattr(pregen.settings, "pregen_min_requests", 2)
+    monkeypatch.setattr(pregen.settings, "pregen_takes_per_prompt", 1)
+    monkeypatch.setattr(pregen.settings, "pregen_disk_mb", 1)
+    pool = PregenPool(str(tmp_path / "pool"))
+
+    pool.record("popular", _params())
+    assert pool.targets() == []
+    for _ in range(3):
+        pool.record("popular", _params())
+    pool.record("rare", _params(prompt="rare"))
+    pool.record("rare", _params(prompt="rare"))
+    assert [target["key"] for target in pool.targets()] == ["popular", "rare"]
+
+    _take(pool, "popular", "a.wav", size=600_000, seed=11)
+    assert [target["key"] for target in pool.targets()] == ["rare"]
+    # Over the 1 MB budget: the least popular key's take goes
+    _take(pool, "rare", "b.wav", size=600_000)
+    assert pool.stats()["takes"] == 1
+    assert not (pool.takes_dir / "b.wav").exists()
+
+    take = pool.take("popular")
+    assert take.seed == 11
+    assert take.path == get_storage().get("a.wav").path and take.path.exists()
+    assert pool.take("popular") is None
+
+
+def test_generate_serves_pregenerated_take(tmp_path, monkeypatch):
+    """Test a stocked prompt returns a finished job without queueing"""
+    monkeypatch.setattr(pregen.settings, "pregen_enabled", True)
+    monkeypatch.setattr(pregen.settings, "output_dir", str(tmp_path / "out"))
+    monkeypatch.setattr(pregen, "_pool", PregenPool(str(tmp_path / "pool")))
+    body = {"prompt": "rainy jazz piano", "duration": 5}
+    _take(pregen._pool, pregen_key(_params(**body)), "take.wav", seed=42)
+    queued = job_manager.store.count(JobStatus.QUEUED)
+
+    response = client.post("/api/generate", json=body)
+    assert response.status_code == 201
+    assert response.json()["status"] == "done"
+    assert response.json()["estimated_seconds"] == 0
+    job = job_manager.get_job(response.json()["job_id"])
+    assert job.result_url == "/api/files/take.wav"
+    assert job.params["seed"] == 42 and job.params["pregenerated"]
+    assert job_manager.store.count(JobStatus.QUEUED) == queued
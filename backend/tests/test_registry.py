@@ -0,0 +1,67 @@
+import asyncio
+import sys
+import threading
+from fastapi.testclient import TestClient
+from app import app
+from ml import registry as registry_module
+from ml.registry import MODEL_SPECS, ModelRegistry
+
+client = TestClient(app)
+
+
+def _registry(monkeypatch, audiogen: bool = False):
+    probes = []
+    
+    def probe_device():
+        probes.append(threading.current_thread())
+        return {"device": "cpu", "device_type": "cpu"}
+    
+    monkeypatch.setattr(registry_module, "_probe_device", probe_device)
+    monkeypatch.setattr(registry_module, "_probe_audiogen", lambda: audiogen)
+    return ModelRegistry(MODEL_SPECS), probes
+
+
+def test_probe_runs_once_and_filters_families(monkeypatch):
+    """Test capabilities are probed once and unavailable families are hidden"""
+    registry, probes = _registry(monkeypatch)
+    assert not registry.ready and registry.device_info() is None
+    
+    assert registry.is_available("musicgen-small")
+    assert not registry.is_available("audiogen-medium")
+    assert "audiogen-medium" not in registry.available_ids()
+    assert registry.get("audiogen-medium") is not None
+    assert [spec.id for spec in registry.cheaper_variants("musicgen-large")] == ["musicgen-medium", "musicgen-small"]
+    assert registry.ready and registry.device_info()["device_type"] == "cpu"
+    assert len(probes) == 1
+    
+    registry, _ = _registry(monkeypatch, audiogen=True)
+    assert registry.is_available("audiogen-medium")
+
+
+def test_wait_ready_probes_off_the_event_loop(monkeypatch):
+    """Test async callers trigger the probe in a worker thread"""
+    registry, probes = _registry(monkeypatch)
+    
+    async def run():
+        await registry.wait_ready()
+        await registry.wait_ready()
+        return threading.current_thread()
+    
+    loop_thread = asyncio.run(run())
+    assert registry.ready
+    assert len(probes) == 1 and probes[0] is not loop_thread
+
+
+def test_health_reports_registry_state(monkeypatch):
+    """Test /health tells whether models are ready and describes the probed device"""
+    registry, _ = _registry(monkeypatch)
+    monkeypatch.setattr(sys.modules["app"], "registry", registry)
+    
+    health = client.get("/health").json()
+    assert health["models_ready"] is False
+    assert "device_type" not in health
+    
+    registry.probe()
+    health = client.get("/health").json()
+    assert health["models_ready"] is True
+    assert health["device_type"] == "cpu"
@@ -0,0 +1,26 @@
+import numpy as np
+import torch
+from ml.resample import resample, resampler_cache_info
+
+
+def test_resample_preserves_frequency():
+    """Test a 440 Hz tone stays at 440 Hz after 32 kHz -> 48 kHz"""
+    t = torch.arange(32000) / 32000
+    wav = torch.sin(2 * np.pi * 440 * t).repeat(2, 2, 1)  # (batch, channels, samples)
+    
+    out = resample(wav, 32000, 48000)
+    assert out.shape == (2, 2, 48000)
+    
+    spectrum = np.abs(np.fft.rfft(out[1, 0].numpy()))
+    assert abs(np.argmax(spectrum) - 440) <= 1
+
+
+def test_resample_kernels_are_cached():
+    """Test rate pairs with the same ratio reuse one kernel"""
+    wav = torch.zeros(1, 1600)
+    resample(wav, 16000, 24000)
+    before = resampler_cache_info()
+    resample(wav, 32000, 48000)
+    after = resampler_cache_info()
+    assert after["hits"] == before["hits"] + 1
+    assert after["kernels"] == before["kernels"]
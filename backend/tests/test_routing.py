@@ -0,0 +1,56 @@
+from ml import routing
+from ml.routing import ThroughputTracker, plan_route
+
+
+def test_routing_degrades_only_under_load(monkeypatch):
+    """Test a deep queue moves a job to the best option within the latency target"""
+    monkeypatch.setattr(routing, "throughput", ThroughputTracker())
+    monkeypatch.setattr(routing.settings, "degrade_target_seconds", 200)
+    params = {"model": "musicgen-large", "cfg_coef": 3.0, "duration": 10}
+    
+    # Priors: large 15 s/s, medium 6 s/s, small 2 s/s
+    assert plan_route(params, queued=0, workers=1) is None
+    
+    route = plan_route(params, queued=1, workers=1)
+    assert route["used"] == {"model": "musicgen-medium", "cfg_coef": 3.0, "duration": 10}
+    assert route["requested"]["model"] == "musicgen-large"
+    
+    route = plan_route(params, queued=5, workers=1)
+    assert route["used"] == {"model": "musicgen-small", "cfg_coef": 3.0, "duration": 10}
+    
+    # Only a shorter take fits: the longest one within the target, not the shortest allowed
+    route = plan_route({**params, "model": "musicgen-small"}, queued=10, workers=1)
+    assert route["used"] == {"model": "musicgen-small", "cfg_coef": 3.0, "duration": 9}
+    
+    # Nothing fits: the cheapest option, smallest model and shortest duration, guidance kept
+    route = plan_route(params, queued=50, workers=1)
+    assert route["used"] == {"model": "musicgen-small", "cfg_coef": 3.0, "duration": 5}
+
+
+def test_routing_meets_deadlines_on_the_jobs_own_runtime(monkeypatch):
+    """Test a deadline is checked against the job alone, not the queue behind it"""
+    monkeypatch.setattr(routing, "throughput", ThroughputTracker())
+    monkeypatch.setattr(routing.settings, "degrade_target_seconds", 10_000)
+    params = {"model": "musicgen-large", "cfg_coef": 3.0, "duration": 10}
+    
+    # 150 s on its own: a deep queue behind it does not matter
+    assert plan_route(params, queued=50, workers=1, deadline=200) is None
+    
+    route = plan_route(params, queued=50, workers=1, deadline=100)
+    assert route["used"] == {"model": "musicgen-medium", "cfg_coef": 3.0, "duration": 10}
+    assert route["deadline_seconds"] == 100
+    
+    # Only a shorter take fits: the longest one finishing in time
+    route = plan_route(params, queued=0, workers=1, deadline=16)
+    assert route["used"] == {"model": "musicgen-small", "cfg_coef": 3.0, "duration": 8}
+
+
+def test_throughput_is_learned():
+    """Test measured runtimes replace the priors"""
+    tracker = ThroughputTracker()
+    assert tracker.realtime_factor("musicgen-small", 3.0) == 2.0
+    tracker.observe("musicgen-small", 3.0, audio_seconds=10, elapsed=5)
+    tracker.observe("musicgen-small", 3.0, audio_seconds=10, elapsed=15)
+    assert abs(tracker.realtime_factor("musicgen-small", 3.0) - (0.3 * 1.5 + 0.7 * 0.5)) < 1e-9
+    # Guidance off falls back to the guidance-on measurement until measured itself
+    assert tracker.realtime_factor("musicgen-small", 1.0) == tracker.realtime_factor("musicgen-small", 3.0)
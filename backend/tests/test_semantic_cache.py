@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import numpy as np
+import worker
+from core.jobs import JobManager
+from ml import generate, routing, semantic_cache
+from ml.routing import ThroughputTracker
+from ml.semantic_cache import SemanticCache
+
+
+def _unit(*values):
+    vector = np.array(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_semantic_cache_matches_within_partition(tmp_path):
+    """Test lookups return the closest clip above the threshold for the same model and duration"""
+    cache = SemanticCache(threshold=0.9, max_entries=10)
+    clip = tmp_path / "a.wav"
+    clip.write_bytes(b"")
+    params = {"prompt": "lofi hip hop beat, chill", "model": "musicgen-small", "duration": 10, "seed": 5}
+    cache.add(params, _unit(1, 0, 0), str(clip))
+    
+    match = cache.lookup({**params, "prompt": "chill lofi hip-hop beat"}, _unit(1, 0.1, 0))
+    assert match["path"] == str(clip) and match["seed"] == 5
+    assert match["similarity"] > 0.99
+    # Different duration or sampling settings, or too far apart
+    assert cache.lookup({**params, "duration": 20}, _unit(1, 0, 0)) is None
+    assert cache.lookup({**params, "cfg_coef": 1.0}, _unit(1, 0, 0)) is None
+    assert cache.lookup(params, _unit(1, 1, 0)) is None
+    
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 3)
+    assert stats["similarity_histogram"] == {"0.70": 1, "0.95": 1}
+
+
+def test_semantic_cache_forgets_missing_and_old_clips(tmp_path):
+    """Test removed files are skipped and the index stays within max_entries"""
+    cache = SemanticCache(threshold=0.5, max_entries=2)
+    params = {"prompt": "p", "model": "musicgen-small", "duration": 10}
+    paths = []
+    for i in range(3):
+        paths.append(tmp_path / f"{i}.wav")
+        paths[-1].write_bytes(b"")
+        cache.add(params, _unit(1, i * 0.1, 0), str(paths[-1]))
+    assert cache.stats()["entries"] == 2
+    
+    paths[1].unlink()
+    assert cache.lookup(params, _unit(1, 0.1, 0))["path"] == str(paths[2])
+    assert cache.stats()["entries"] == 1
+
+
+def test_worker_embeds_prompts_off_the_generation_slots(tmp_path, monkeypatch):
+    """Test prompts are embedded outside the generation threads, once per job"""
+    embedded = []
+    generated = []
+    clip = tmp_path / "a.wav"
+    clip.write_bytes(b"")
+    
+    def embed_prompt(model_name, prompt):
+        embedded.append(threading.current_thread().name)
+        return _unit(1, 0, 0)
+    
+    def generate_audio(**kwargs):
+        generated.append(kwargs["prompt"])
+        kwargs["timing"]["compute_seconds"] = 1.0
+        return str(clip)
+    
+    monkeypatch.setattr(semantic_cache, "embed_prompt", embed_prompt)
+    monkeypatch.setattr(semantic_cache.settings, "semantic_cache_enabled", True)
+    monkeypatch.setattr(semantic_cache, "_cache", None)
+    monkeypatch.setattr(generate, "generate_audio", generate_audio)
+    monkeypatch.setattr(routing, "throughput", ThroughputTracker())
+    
+    manager = JobManager()
+    params = {"prompt": "rain on a tin roof", "model": "musicgen-small", "duration": 5, "cfg_coef": 3.0}
+    
+    def run(job_params):
+        return asyncio.run(worker.process_job(manager.create_job(job_params), lambda *args: None))
+    
+    # Without allow_similar: generated, then embedded once to be indexed
+    assert run(params) == "/api/files/a.wav"
+    assert len(embedded) == 1
+    
+    # Opted in: embedded once for the lookup and served without generating
+    assert run({**params, "allow_similar": True}) == "/api/files/a.wav"
+    assert len(embedded) == 2 and generated == ["rain on a tin roof"]
+    assert not any(name.startswith("generation") for name in embedded)
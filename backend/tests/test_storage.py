@@ -0,0 +1,92 @@
+from fastapi.testclient import TestClient
+from app import app
+from core.settings import settings
+from core.storage import FileStorage, get_storage, shard_of
+
+client = TestClient(app)
+
+
+def test_commit_shards_and_indexes(tmp_path):
+    """Test committed files move into their shard with the sidecar and resolve by name or id"""
+    storage = FileStorage(str(tmp_path))
+    staged = storage.staging_path("abc")
+    staged.write_bytes(b"RIFF")
+    (storage.staging_dir / "abc.peaks.json").write_text("{}")
+    
+    stored = storage.commit(staged)
+    assert stored.path == tmp_path / shard_of("abc") / "abc.wav"
+    assert stored.path.read_bytes() == b"RIFF"
+    assert (stored.path.parent / "abc.peaks.json").exists()
+    assert stored.has_peaks
+    assert not staged.exists()
+    assert storage.get("abc.wav") == stored
+    assert storage.get("abc").name == "abc.wav"
+    assert storage.get("missing.wav") is None
+
+
+def test_migrate_flat_directory(tmp_path):
+    """Test the migration shards flat files and leaves everything else alone"""
+    for name in ("a.wav", "b.mp3", "notes.txt"):
+        (tmp_path / name).write_bytes(b"x")
+    (tmp_path / "a.peaks.json").write_text("{}")
+    storage = FileStorage(str(tmp_path))
+    
+    assert storage.migrate(dry_run=True) == ["a.wav", "b.mp3"]
+    assert storage.get("a.wav") is None
+    assert storage.migrate() == ["a.wav", "b.mp3"]
+    assert storage.migrate() == []
+    assert storage.get("b.mp3").format == "mp3"
+    assert (storage.get("a.wav").path.parent / "a.peaks.json").exists()
+    assert (tmp_path / "notes.txt").exists()
+    assert storage.stats() == {"files": 2, "bytes": 2}
+
+
+def test_files_endpoint_serves_indexed_files_only(tmp_path, monkeypatch):
+    """Test the download route resolves through the index with immutable validators"""
+    monkeypatch.setattr(settings, "output_dir", str(tmp_path))
+    staged = get_storage().staging_path("song")
+    staged.write_bytes(b"\0" * 1000)
+    stored = get_storage().commit(staged)
+    
+    response = client.get("/api/files/song.wav")
+    assert response.status_code == 200
+    assert response.content == b"\0" * 1000
+    assert response.headers["content-type"] == "audio/wav"
+    assert response.headers["etag"] == f'"{stored.sha256}"'
+    assert "immutable" in response.headers["cache-control"]
+    
+    (tmp_path / "flat.wav").write_bytes(b"x")
+    assert client.get("/api/files/flat.wav").status_code == 404
+    assert client.get("/api/files/song").status_code == 404
+    assert client.get("/api/files/..%2Findex.sqlite").status_code == 404
+    
+    # Revalidation is answered from the index
+    response = client.get("/api/files/song.wav", headers={"If-None-Match": f'W/"other", "{stored.sha256}"'})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert client.get("/api/files/song.wav", headers={"If-None-Match": '"other"'}).status_code == 200
+    
+    # Indexed but removed underneath: a 404 rather than a truncated 200
+    stored.path.unlink()
+    assert client.get("/api/files/song.wav").status_code == 404
+    assert client.get("/api/files/song/peaks").status_code == 404
+
+
+def test_index_records_peaks_of_existing_files(tmp_path):
+    """Test an index from before sidecars were recorded learns which files have peaks"""
+    import sqlite3
+    storage = FileStorage(str(tmp_path))
+    for name in ("a", "b"):
+        staged = storage.staging_path(name)
+        staged.write_bytes(b"x")
+        if name == "a":
+            (storage.staging_dir / "a.peaks.json").write_text("{}")
+        storage.commit(staged)
+    conn = sqlite3.connect(tmp_path / "index.sqlite")
+    conn.execute("ALTER TABLE files DROP COLUMN peaks")
+    conn.commit()
+    conn.close()
+    
+    storage = FileStorage(str(tmp_path))
+    assert storage.get("a").has_peaks
+    assert not storage.get("b").has_peaks
@@ -0,0 +1,244 @@
+"""
+Generation worker: claims jobs from the job store and runs them.
+
+Runs inside the API process by default. For multi-process deployments, point
+every process at a shared store and run the workers on their own:
+
+    JOB_STORE=sqlite INLINE_WORKERS=false uvicorn app:app --workers 4
+    JOB_STORE=sqlite python -m worker
+"""
+import asyncio
+import logging
+import os
+import signal
+from datetime import datetime
+from core.settings import settings
+from core.jobs import job_manager, JobStatus
+from core.executor import get_generation_executor, shutdown_generation_executor
+from core.pregen import get_pregen_pool, PregenService
+from ml.registry import registry
+
+logger = logging.getLogger(__name__)
+
+
+async def process_job(job, progress_callback):
+    """Process a generation job"""
+    if job.items:
+        return await process_batch_job(job, progress_callback)
+    
+    # Deferred: pulls in torch and audiocraft
+    from ml.generate import generate_audio
+    from ml.routing import plan_route, throughput
+    from ml.semantic_cache import embed_prompt, get_semantic_cache
+    
+    params = job.params
+    loop = asyncio.get_event_loop()
+    
+    # Opt-in: a seedless request may get the clip of a near-identical earlier prompt
+    semantic_cache = get_semantic_cache()
+    seed = params.get("seed")
+    may_reuse = semantic_cache is not None and params.get("allow_similar") and (seed is None or seed < 0)
+    vector = None
+    if may_reuse:
+        # A T5 forward pass: kept off the generation slots
+        vector = await asyncio.to_thread(embed_prompt, params.get("model", "musicgen-small"), params["prompt"])
+        if vector is not None:
+            match = semantic_cache.lookup(params, vector)
+            if match is not None:
+                logger.info(f"Job {job.job_id} served from '{match['prompt']}' (similarity {match['similarity']})")
+                job.params = {
+                    **params,
+                    "seed": match["seed"],
+                    "similar_to": {"prompt": match["prompt"], "similarity": match["similarity"]},
+                }
+                return file_url(match["path"])
+    
+    # Opt-in: under load, run a cheaper model or a shorter duration and record what was used
+    if params.get("allow_degrade") and settings.degrade_enabled:
+        device_info = registry.device_info() or {}
+        # A job with a deadline also degrades as far as needed to finish before it
+        deadline = (job.deadline_at - datetime.now()).total_seconds() if job.deadline_at else None
+        routing = plan_route(
+            params,
+            queued=await asyncio.to_thread(job_manager.store.count, JobStatus.QUEUED),
+            workers=job_manager.workers,
+            accelerated=device_info.get("device_type", "cpu") != "cpu",
+            deadline=deadline,
+        )
+        if routing is not None:
+            logger.info(f"Job {job.job_id} degraded under load: {routing['requested']} -> {routing['used']}")
+            job.routing = routing
+            await asyncio.to_thread(job_manager.update_job, job)
+            params = {**params, **routing["used"]}
+    
+    # Run generation on a pinned slot of the generation executor
+    timing = {}
+    result_path = await loop.run_in_executor(
+        get_generation_executor(),
+        lambda: generate_audio(
+            model_name=params.get("model", "musicgen-small"),
+            prompt=params["prompt"],
+            duration=params.get("duration", 10),
+            seed=params.get("seed"),
+            temperature=params.get("temperature", 1.0),
+            top_k=params.get("top_k", 250),
+            top_p=params.get("top_p", 0.0),
+            cfg_coef=params.get("cfg_coef", 3.0),
+            stereo=params.get("stereo", True),
+            sample_rate=params.get("sample_rate", 32000),
+            long_form=params.get("long_form", False),
+            progress_callback=progress_callback,
+            checkpoint_key=job.job_id,
+            melody_id=params.get("melody_id"),
+            timing=timing,
+        )
+    )
+    # Model loads (cold starts, swaps) are not part of the learned realtime factor
+    throughput.observe(
+        params.get("model", "musicgen-small"),
+        params.get("cfg_coef", 3.0),
+        params.get("duration", 10),
+        timing["compute_seconds"],
+    )
+    if semantic_cache is not None and not job.routing:
+        # Indexed for later opted-in requests, embedded now if the lookup did not
+        if not may_reuse:
+            vector = await asyncio.to_thread(embed_prompt, params.get("model", "musicgen-small"), params["prompt"])
+        if vector is not None:
+            semantic_cache.add(params, vector, result_path)
+    
+    # Extract filename and create URL
+    return file_url(result_path)
+
+
+async def process_batch_job(job, progress_callback):
+    """
+    Process a multi-item job (batch or variations): items run in model-sized
+    batches, each item keeps its own result
+    """
+    from ml.batch import run_batch
+    
+    def item_callback(index: int, status=None, progress=None, path=None, error=None, seed=None):
+        item = job.items[index]
+        if seed is not None:
+            item.seed = seed
+        if status is not None:
+            item.status = status
+        if progress is not None:
+            item.progress = progress
+        if path is not None:
+            item.result_url = file_url(path)
+        if error is not None:
+            item.error = error
+        job_manager.update_job(job)
+    
+    loop = asyncio.get_event_loop()
+    results = await loop.run_in_executor(
+        get_generation_executor(),
+        lambda: run_batch(
+            [item.params for item in job.items],
+            progress_callback=progress_callback,
+            item_callback=item_callback,
+        )
+    )
+    
+    if not any(results):
+        raise RuntimeError("All batch items failed")
+    
+    # Variations: the first successful take doubles as the job's result
+    if job.params.get("variations"):
+        return file_url(next(path for path in results if path))
+    return None
+
+
+def file_url(path: str) -> str:
+    """Public URL of a generated file"""
+    return f"/api/files/{os.path.basename(path)}"
+
+
+def configure_huggingface():
+    """Apply Hugging Face offline mode and authentication settings"""
+    # Configure Hugging Face offline mode if requested
+    if settings.huggingface_offline:
+        os.environ["HF_HUB_OFFLINE"] = "1"
+        logger.info("Hugging Face offline mode enabled - using local cache only")
+    
+    # Configure Hugging Face authentication if token is provided
+    if settings.huggingface_token:
+        try:
+            from huggingface_hub import login
+            login(token=settings.huggingface_token, add_to_git_credential=False)
+            logger.info("Hugging Face authentication configured")
+        except Exception as e:
+            logger.warning(f"Failed to configure Hugging Face authentication: {e}")
+    else:
+        if not settings.huggingface_offline:
+            logger.info("No Hugging Face token provided - using public access only")
+
+
+async def probe_registry():
+    """Probe model capabilities off the event loop"""
+    loop = asyncio.get_event_loop()
+    try:
+        await loop.run_in_executor(None, registry.probe)
+    except Exception as e:
+        logger.error(f"Model registry probe failed: {e}", exc_info=True)
+
+
+async def warm_up():
+    """Probe model capabilities and start one job worker per generation slot"""
+    await probe_registry()
+    
+    loop = asyncio.get_event_loop()
+    executor = await loop.run_in_executor(None, get_generation_executor)
+    if job_manager.store.shared:
+        # Jobs of a worker that died with this host's previous processes
+        await asyncio.to_thread(job_manager.recover_interrupted)
+    job_manager.start_worker(process_job, workers=executor.plan.size)
+    logger.info("Job worker started")
+    
+    pool = get_pregen_pool()
+    if pool is not None:
+        asyncio.create_task(PregenService(pool).run())
+        logger.info("Pre-generation of popular prompts enabled")
+
+
+async def serve():
+    """Run generation workers until SIGINT/SIGTERM"""
+    stop = asyncio.Event()
+    loop = asyncio.get_event_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+    
+    await warm_up()
+    await stop.wait()
+    logger.info("Stopping worker...")
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    if not job_manager.store.shared:
+        raise SystemExit("A standalone worker needs a shared job store (set JOB_STORE=sqlite)")
+    
+    logger.info(f"Starting generation worker (pid {os.getpid()})...")
+    logger.info(f"Device: {settings.device}")
+    logger.info(f"Output directory: {settings.output_dir}")
+    configure_huggingface()
+    
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shutdown_generation_executor()
+        job_manager.store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -42,7 +42,7 @@ export interface GenerateResponse {
 
 export interface JobStatus {
   job_id: string
-  status: 'queued' | 'running' | 'done' | 'error'
+  status: 'queued' | 'running' | 'done' | 'error' | 'expired'
   progress: number
   message: string
   result_url: string | null
@@ -35,7 +35,7 @@ export default function JobProgress({ jobId, onComplete, onError }: JobProgressP
           if (data.status === 'done') {
             onComplete(data.result_url)
             eventSource?.close()
-          } else if (data.status === 'error') {
+          } else if (data.status === 'error' || data.status === 'expired') {
             onError(data.error || 'Unknown error')
             eventSource?.close()
           }
@@ -69,7 +69,7 @@ export default function JobProgress({ jobId, onComplete, onError }: JobProgressP
 
           if (jobStatus.status === 'done') {
             onComplete(jobStatus.result_url)
-          } else if (jobStatus.status === 'error') {
+          } else if (jobStatus.status === 'error' || jobStatus.status === 'expired') {
             onError(jobStatus.error || 'Unknown error')
           }
         } catch (e) {
@@ -97,6 +97,7 @@ export default function JobProgress({ jobId, onComplete, onError }: JobProgressP
       case 'done':
         return 'bg-green-500'
       case 'error':
+      case 'expired':
         return 'bg-red-500'
       default:
         return 'bg-gray-400'